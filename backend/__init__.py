@@ -1,8 +1,13 @@
 """
 LangGraph Chat Server Backend
 """
-from .main import app, create_app
-
 __version__ = "1.0.0"
 __all__ = ["app", "create_app"]
 
+
+def __getattr__(name):
+    # 延迟导入应用：graph.py 等独立入口只导入 backend.utils 时，不会触发配置校验和服务初始化
+    if name in __all__:
+        from . import main
+        return getattr(main, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -9,6 +9,7 @@ from .handlers import (
     handle_delete_thread,
     handle_cancel_run,
     handle_get_info,
+    handle_get_stats,
 )
 
 __all__ = [
@@ -19,5 +20,6 @@ __all__ = [
     "handle_delete_thread",
     "handle_cancel_run",
     "handle_get_info",
+    "handle_get_stats",
 ]
 
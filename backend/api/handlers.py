@@ -2,7 +2,7 @@
 API 请求处理器
 """
 from fastapi import HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 
 from ..models.schemas import (
     RunInput,
@@ -11,7 +11,23 @@ from ..models.schemas import (
     InfoResponse,
 )
 from ..services.graph_service import graph_service
+from ..services.llm_service import llm_service
+from ..services.http_client import http_client_pool
 from ..services.thread_service import thread_service
+from ..services.history_cache import encode_json
+from ..services.database_service import database_service
+from ..services.response_cache import response_cache
+from ..services.semantic_cache import semantic_cache
+from ..services.metrics_service import metrics_service
+from ..services.summary_service import summary_service
+from ..services.retrieval_memory import retrieval_memory
+from ..services.map_reduce import map_reduce_service
+from ..services.admission import admission_controller
+from ..services.single_flight import single_flight
+from ..services.batch_service import batch_service
+from ..services.graph_registry import graph_registry
+from ..services.tool_executor import tool_executor
+from ..utils.tool_cache import tool_cache_stats
 from ..config import settings
 
 
@@ -44,30 +60,31 @@ async def handle_stream_run(run_input: RunInput) -> StreamingResponse:
     )
 
 
-async def handle_search_threads() -> list:
+async def handle_search_threads() -> Response:
     """
     处理搜索线程请求
 
     Returns:
-        线程列表
+        线程列表（直接拼接缓存的消息 JSON，不再逐条重新序列化）
     """
     threads = thread_service.get_all_threads()
 
     # 转换为前端期望的格式
-    result = []
+    parts = []
     for thread in threads:
-        result.append({
+        serialized = thread_service.get_serialized_messages(thread["thread_id"])
+        if serialized is None:
+            continue
+        header = encode_json({
             "thread_id": thread["thread_id"],
             "created_at": thread["created_at"],
             "updated_at": thread["updated_at"],
             "metadata": {},
-            "values": {
-                "messages": thread["messages"]
-            }
         })
+        parts.append(serialized.wrap(header[:-1] + b',"values":{"messages":', b"}}"))
 
-    print(f"📋 搜索线程: 找到 {len(result)} 个线程")
-    return result
+    print(f"📋 搜索线程: 找到 {len(parts)} 个线程")
+    return Response(content=b"[" + b",".join(parts) + b"]", media_type="application/json")
 
 
 async def handle_create_thread() -> dict:
@@ -90,7 +107,7 @@ async def handle_create_thread() -> dict:
     }
 
 
-async def handle_get_thread_state(thread_id: str) -> dict:
+async def handle_get_thread_state(thread_id: str) -> Response:
     """
     处理获取线程状态请求
 
@@ -98,27 +115,28 @@ async def handle_get_thread_state(thread_id: str) -> dict:
         thread_id: 线程ID
 
     Returns:
-        线程状态
+        线程状态（直接拼接缓存的消息 JSON）
 
     Raises:
         HTTPException: 线程不存在时抛出 404 错误
     """
-    thread = thread_service.get_thread(thread_id)
+    serialized = thread_service.get_serialized_messages(thread_id)
 
-    if not thread:
+    if serialized is None:
         raise HTTPException(status_code=404, detail="Thread not found")
 
-    return {
-        "values": {
-            "messages": thread["messages"]
-        },
+    suffix = b"}," + encode_json({
         "next": [],
         "config": {
             "configurable": {
                 "thread_id": thread_id
             }
         }
-    }
+    })[1:]
+    return Response(
+        content=serialized.wrap(b'{"values":{"messages":', suffix),
+        media_type="application/json",
+    )
 
 
 async def handle_delete_thread(thread_id: str) -> DeleteResponse:
@@ -152,9 +170,9 @@ async def handle_cancel_run(run_id: str) -> dict:
         取消响应
     """
     print(f"🛑 收到取消请求: {run_id}")
-    # 注意：当前实现中，取消主要在前端通过 AbortController 处理
-    # 这里返回成功响应即可
-    return {"status": "cancelled", "run_id": run_id}
+    # 前端断开连接（AbortController）时流会自然结束；这里通知仍在进行的运行尽快停止
+    found = graph_service.cancel_run(run_id)
+    return {"status": "cancelled" if found else "not_found", "run_id": run_id}
 
 
 async def handle_get_info() -> InfoResponse:
@@ -170,3 +188,43 @@ async def handle_get_info() -> InfoResponse:
         model=settings.deepseek_model,
     )
 
+
+
+async def handle_get_runs(since: str = None, limit: int = 100) -> dict:
+    """
+    处理查询运行指标请求
+
+    Args:
+        since: 只返回该时间（ISO 格式）之后的运行
+        limit: 最多返回条数
+
+    Returns:
+        按时间倒序的运行指标
+    """
+    return {"runs": database_service.load_runs(since, min(limit, 1000))}
+
+
+async def handle_get_stats() -> dict:
+    """
+    处理获取运行统计请求
+
+    Returns:
+        各组件的统计信息
+    """
+    return {
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "runs": metrics_service.stats(),
+        "summary": summary_service.stats(),
+        "retrieval": retrieval_memory.stats(),
+        "map_reduce": map_reduce_service.stats(),
+        "llm_backends": llm_service.get_backend_stats(),
+        "llm_hedging": llm_service.get_hedge_stats(),
+        "llm_http": http_client_pool.stats(),
+        "admission": admission_controller.stats(),
+        "single_flight": single_flight.stats(),
+        "batch": batch_service.stats(),
+        "graphs": graph_registry.stats(),
+        "tools": tool_executor.stats(),
+        "tool_cache": tool_cache_stats(),
+    }
@@ -1,10 +1,14 @@
 """
 API 路由定义
 """
-from fastapi import APIRouter, Request
+import time
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 import json
 
+from ..config import settings
 from ..models.schemas import (
     DeleteResponse,
     InfoResponse,
@@ -16,6 +20,8 @@ from .handlers import (
     handle_delete_thread,
     handle_cancel_run,
     handle_get_info,
+    handle_get_stats,
+    handle_get_runs,
 )
 
 
@@ -26,6 +32,7 @@ router = APIRouter()
 @router.post("/threads/{thread_id}/runs/stream")
 async def stream_run(thread_id: str, request: Request):
     """流式运行端点"""
+    received_at = time.perf_counter()
     try:
         # 先读取原始请求体
         body = await request.body()
@@ -38,15 +45,42 @@ async def stream_run(thread_id: str, request: Request):
         messages = data.get("input", {}).get("messages", [])
         stream_mode = data.get("stream_mode", ["messages", "values"])
 
+        # 响应缓存开关：助手级别由配置关闭，线程级别由 config.configurable.response_cache 关闭
+        assistant_id = data.get("assistant_id", "agent")
+        configurable = (data.get("config") or {}).get("configurable") or {}
+        use_cache = (
+            assistant_id not in settings.response_cache_disabled_assistants
+            and configurable.get("response_cache", True) is not False
+        )
+
         print(f"💬 用户消息: {messages[0]['content'][0]['text'] if messages else 'N/A'}")
         print(f"📡 Stream Mode: {stream_mode}")
 
         # 调用处理器
         from ..services.graph_service import graph_service
+        from ..services.graph_registry import graph_registry
         from fastapi.responses import StreamingResponse
 
+        # 注册表中的助手使用各自的图（首次使用时编译），其他 assistant_id 使用默认对话图
+        if assistant_id in graph_registry:
+            print(f"🧭 助手: {assistant_id}")
+            stream = graph_service.stream_assistant_response(
+                assistant_id, messages, thread_id, stream_mode,
+                user_id=configurable.get("user_id"),
+                received_at=received_at,
+                include_metrics=configurable.get("run_metrics") is True,
+            )
+        else:
+            stream = graph_service.stream_response(
+                messages, thread_id, stream_mode, use_cache=use_cache,
+                # 准入排队按用户公平轮转，未提供用户ID时按线程
+                user_id=configurable.get("user_id"),
+                received_at=received_at,
+                include_metrics=configurable.get("run_metrics") is True,
+            )
+
         return StreamingResponse(
-            graph_service.stream_response(messages, thread_id, stream_mode),
+            stream,
             media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
@@ -65,6 +99,41 @@ async def stream_run(thread_id: str, request: Request):
         raise
 
 
+@router.post("/runs/batch")
+async def batch_run(
+    request: Request,
+    concurrency: Optional[int] = None,
+    batch_id: Optional[str] = None,
+    create_threads: bool = False,
+):
+    """
+    批量运行端点
+
+    请求体为 NDJSON（每行 {"id"?, "input"} 或 {"id"?, "messages"}），结果按完成顺序以 NDJSON 流式返回，
+    最后一行是汇总。指定 batch_id 时保存进度，中断后用同一个 batch_id 重新提交会跳过已完成的输入。
+    """
+    from ..services.batch_service import batch_service, parse_batch_lines
+    from fastapi.responses import StreamingResponse
+
+    body = await request.body()
+    try:
+        items = parse_batch_lines(body.decode("utf-8").splitlines())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def ndjson():
+        async for result in batch_service.run(
+            items, concurrency=concurrency, batch_id=batch_id, create_threads=create_threads
+        ):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        ndjson(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/threads/search")
 async def search_threads():
     """搜索线程"""
@@ -100,3 +169,15 @@ async def get_info():
     """获取服务信息"""
     return await handle_get_info()
 
+
+
+@router.get("/runs")
+async def get_runs(since: Optional[str] = None, limit: int = 100):
+    """查询运行指标"""
+    return await handle_get_runs(since, limit)
+
+
+@router.get("/stats")
+async def get_stats():
+    """获取运行统计"""
+    return await handle_get_stats()
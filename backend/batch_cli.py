@@ -0,0 +1,109 @@
+"""
+批量推理命令行
+
+在本进程中运行（默认），或把输入提交到正在运行的服务（--server，与在线请求共用准入控制）。
+结果按完成顺序写成 NDJSON，最后一行是汇总；日志输出到 stderr。
+
+用法:
+    python -m backend.batch_cli questions.ndjson -o answers.ndjson --concurrency 8 --checkpoint answers.checkpoint
+    python -m backend.batch_cli questions.ndjson --server http://localhost:2024 --batch-id nightly-2024-06-01
+    cat questions.ndjson | python -m backend.batch_cli - > answers.ndjson
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import sys
+from typing import Optional, TextIO
+
+
+async def run_local(args, lines: list, output: TextIO) -> Optional[dict]:
+    """在本进程中运行批量输入"""
+    # 应用日志写到 stderr，stdout 只输出结果
+    with contextlib.redirect_stdout(sys.stderr):
+        from .services.batch_service import batch_service, parse_batch_lines
+
+        items = parse_batch_lines(lines)
+        summary = None
+        async for result in batch_service.run(
+            items,
+            concurrency=args.concurrency,
+            batch_id=args.batch_id,
+            checkpoint_path=args.checkpoint,
+            create_threads=args.create_threads,
+        ):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            if result["type"] == "summary":
+                summary = result
+        return summary
+
+
+async def run_remote(args, lines: list, output: TextIO) -> Optional[dict]:
+    """把批量输入提交到服务端 /runs/batch"""
+    import httpx
+
+    params = {"create_threads": str(args.create_threads).lower()}
+    if args.concurrency:
+        params["concurrency"] = args.concurrency
+    if args.batch_id:
+        params["batch_id"] = args.batch_id
+
+    summary = None
+    async with httpx.AsyncClient(base_url=args.server, timeout=None) as client:
+        async with client.stream(
+            "POST", "/runs/batch", params=params, content="\n".join(lines).encode("utf-8"),
+            headers={"Content-Type": "application/x-ndjson"},
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise SystemExit(f"❌ 提交失败 ({response.status_code}): {response.text}")
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                output.write(line + "\n")
+                output.flush()
+                result = json.loads(line)
+                if result["type"] == "summary":
+                    summary = result
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="批量推理：NDJSON 输入，按完成顺序输出 NDJSON 结果")
+    parser.add_argument("input", help="NDJSON 输入文件，- 表示标准输入")
+    parser.add_argument("-o", "--output", default=None, help="结果文件（追加写入），默认标准输出")
+    parser.add_argument("--concurrency", type=int, default=None, help="并发数，默认 BATCH_CONCURRENCY")
+    parser.add_argument("--batch-id", default=None, help="批次ID，在 BATCH_CHECKPOINT_DIR 中保存进度")
+    parser.add_argument("--checkpoint", default=None, help="检查点文件（本地运行），重新运行时跳过已完成的输入")
+    parser.add_argument("--create-threads", action="store_true", help="为每个输入创建线程并保存对话")
+    parser.add_argument("--server", default=None, help="提交到正在运行的服务，如 http://localhost:2024")
+    args = parser.parse_args()
+    if args.server and args.checkpoint:
+        parser.error("--checkpoint 只用于本地运行，提交到服务时使用 --batch-id")
+
+    if args.input == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+
+    with contextlib.ExitStack() as stack:
+        output = sys.stdout if args.output is None else stack.enter_context(
+            open(args.output, "a", encoding="utf-8")
+        )
+        runner = run_remote if args.server else run_local
+        try:
+            summary = asyncio.run(runner(args, lines, output))
+        except ValueError as e:
+            raise SystemExit(f"❌ {e}")
+
+    if summary is not None:
+        print(f"📦 完成 {summary['ok']} 个, 失败 {summary['error']} 个, 跳过 {summary['skipped']} 个, "
+              f"用时 {summary['elapsed_ms'] / 1000:.1f}s", file=sys.stderr)
+        if summary["error"]:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,7 +24,114 @@ class Settings(BaseSettings):
     llm_temperature: float = 0.7
     llm_max_tokens: int = 4096
     llm_streaming: bool = True
+    llm_context_window: int = 64000  # 模型上下文窗口（deepseek-chat 为 64K）
+    llm_context_reserve_tokens: int = 1024  # prompt 预算之外的额外预留
+    llm_context_strategy: str = "block"  # newest: 逐条填充; block: 按块丢弃，保持前缀稳定
+    llm_context_block_size: int = 8  # block 策略每块的消息条数
+
+    # LLM 后端池配置（DeepSeek 之外的 OpenAI 兼容后端，如 OpenAI、Ollama 的 /v1 接口）
+    # 例: [{"name": "openai", "model": "gpt-4o-mini", "base_url": "https://api.openai.com/v1", "api_key_env": "OPENAI_API_KEY"}]
+    llm_backends: list[dict] = []
+    llm_first_token_timeout: float = 20.0  # 首个分块的等待上限，超时前可切换后端
+    llm_ewma_alpha: float = 0.3  # 延迟/吞吐 EWMA 的平滑系数
+    llm_breaker_failures: int = 3  # 连续失败多少次打开熔断
+    llm_breaker_cooldown_seconds: float = 30.0  # 熔断打开后多久放行试探请求
+    llm_health_check_interval: float = 30.0  # 健康检查间隔（秒），0 表示关闭
+    # 对冲请求：首个分块超过近期首 token 延迟的百分位时，在备用后端（没有时在同一后端）再发一个请求
+    llm_hedge_enabled: bool = False
+    llm_hedge_percentile: float = 95.0
+    llm_hedge_min_delay_ms: float = 300.0  # 对冲延迟下限
+    llm_hedge_initial_delay_ms: float = 3000.0  # 样本不足时的对冲延迟
+    llm_hedge_budget: float = 0.05  # 对冲请求占总请求的比例上限（额外花费上限）
+
+    # LLM HTTP 连接池配置（所有模型实例共用一组客户端）
+    llm_http_max_connections: int = 100
+    llm_http_max_keepalive: int = 20  # 最多保持的空闲连接数
+    llm_http_keepalive_expiry: float = 120.0  # 空闲连接保持时间，应大于健康检查间隔以保持连接常热
+    llm_http2: bool = True  # 需要安装 h2（pip install 'httpx[http2]'），未安装时退回 HTTP/1.1
+    llm_http_connect_timeout: float = 5.0
+    llm_http_read_timeout: float = 120.0  # 流式响应中两个分块之间的最长间隔
+    llm_http_warm_connections: int = 2  # 启动时为每个后端预先建立的连接数
+
+    # 模型提供方：deepseek（真实接口）、fake（本地确定性假模型）或 replay（回放录制的 token 流），
+    # 后两者用于压测和 CI 基准，不需要 API Key
+    llm_provider: str = "deepseek"
+    fake_llm_ttft_ms: float = 300.0
+    fake_llm_tokens_per_second: float = 50.0
+    fake_llm_jitter: float = 0.2  # 延迟的相对抖动幅度
+    fake_llm_length_distribution: str = "lognormal"  # fixed / normal / lognormal
+    fake_llm_length_mean: int = 200  # 输出分块数
+    fake_llm_length_stddev: int = 100
+    fake_llm_corpus: str = "mixed"  # zh / en / code / mixed
+    fake_llm_error_rate: float = 0.0  # 注入错误的概率
+    fake_llm_error_kinds: list[str] = ["before_first_token", "mid_stream", "rate_limit"]
+    fake_llm_seed: int = 0
+
+    # token 流录制与回放：设置录制目录后每次模型调用写入压缩的 cassette 文件；
+    # LLM_PROVIDER=replay 时按录制的节奏回放（不需要 API Key）
+    llm_record_dir: Optional[str] = None
+    llm_record_prompts: bool = True  # False 时只记录 prompt 哈希
+    llm_replay_path: Optional[str] = None  # cassette 文件、目录或通配符
+    llm_replay_time_scale: float = 1.0  # 回放时间缩放（0.5 表示两倍速，0 表示不等待）
+    llm_replay_match: str = "prompt"  # prompt: 优先回放 prompt 相同的录制; sequential: 按顺序轮流回放
     
+    # 后台滚动摘要配置（默认关闭）
+    summary_enabled: bool = False
+    summary_trigger_tokens: int = 16000  # 未摘要部分超过该 token 数时触发
+    summary_keep_recent_tokens: int = 4000  # 摘要后保留原文的最近消息 token 数
+    summary_model: Optional[str] = None  # 摘要使用的模型，默认与对话模型相同
+    summary_max_tokens: int = 1024
+    summary_temperature: float = 0.3
+
+    # 线程检索记忆配置（默认关闭，需要 numpy）
+    retrieval_enabled: bool = False
+    retrieval_top_k: int = 4  # 最多召回的早期消息条数
+    retrieval_max_tokens: int = 1024  # 召回内容占用的 token 上限（从上下文预算中预留）
+    retrieval_min_score: float = 0.3  # 召回所需的最低余弦相似度
+    retrieval_dim: int = 256
+    retrieval_inline_limit: int = 64  # 待计算向量的消息超过该数量时在后台构建索引（本轮不召回）
+    retrieval_resident_threads: int = 32  # 常驻内存的线程向量索引数量
+
+    # 超长输入 Map-Reduce 配置（分块要点使用摘要模型）
+    map_reduce_enabled: bool = True
+    map_reduce_threshold_tokens: int = 16000  # 单条消息超过该 token 数时切分处理
+    map_reduce_chunk_tokens: int = 4000  # 每个分块的 token 上限
+    map_reduce_max_concurrency: int = 4  # 同时处理的分块数
+    map_reduce_notes_tokens: int = 12000  # 全部分块要点的 token 预算
+
+    # LLM 调用准入控制（超出并发/额度时按用户或线程公平排队）
+    admission_enabled: bool = True
+    admission_max_in_flight: int = 32  # 同时进行的 LLM 流式调用上限
+    admission_requests_per_minute: int = 0  # 服务商 RPM 额度，0 表示不限制
+    admission_tokens_per_minute: int = 0  # 服务商 TPM 额度，0 表示不限制
+    admission_queue_timeout: float = 120.0  # 最长排队时间（秒）
+    admission_expected_completion_tokens: int = 512  # 准入时预估的输出 token 数
+
+    # 相同生成请求合并（对话和参数相同的请求共享进行中的上游生成）
+    single_flight_enabled: bool = True
+
+    # 批量推理（POST /runs/batch 和 python -m backend.batch_cli）
+    batch_concurrency: int = 4  # 默认并发数
+    batch_max_concurrency: int = 16  # 请求可指定的并发上限
+    batch_max_retries: int = 3  # 服务商限流时单个输入的最多重试次数
+    batch_checkpoint_dir: str = "batch_checkpoints"  # 按 batch_id 保存进度的目录
+
+    # 多助手图注册表（按 assistant_id 路由，首次使用时编译，共享 LLM 客户端和检查点）
+    # 值为 "模块路径:工厂函数" 或 langgraph.json 风格的 "./文件.py:工厂函数"，工厂函数接收 llm 和 checkpointer
+    assistant_graphs: dict[str, str] = {
+        "customer_service": "./examples/intelligent_customer_service.py:create_graph",
+    }
+    graph_registry_memory_limit_mb: int = 0  # 进程内存（RSS）超过该值时卸载空闲的图，0 表示不限制
+    graph_registry_idle_seconds: float = 300.0  # 内存压力下只卸载空闲超过该时间的图
+    graph_registry_max_loaded: int = 0  # 同时加载的图数量上限（超出时卸载最久未用且没有进行中运行的图），0 表示不限制
+
+    # ReAct Agent 工具执行（同一步的多个调用并发执行，每个调用限时）
+    tool_max_workers: int = 8  # 同步工具线程池大小
+    tool_timeout_seconds: float = 30.0  # 单个工具调用的默认超时，0 表示不限制
+    tool_timeouts: dict[str, float] = {}  # 按工具名配置的超时
+    tool_cache_ttl_seconds: float = 300.0  # 内置工具结果缓存的有效期（声明了 no_cache 的工具除外），0 表示不缓存
+    tool_cache_max_entries: int = 1024  # 每个工具最多缓存的结果数
+
     # CORS 配置
     cors_origins: list[str] = ["*"]
     cors_credentials: bool = True
@@ -33,6 +140,21 @@ class Settings(BaseSettings):
 
     # 数据库配置
     sqlite_db_path: str = "checkpoints.sqlite"
+    run_metrics_persist: bool = True  # 运行指标写入 runs 表
+
+    # LLM 响应缓存配置（精确匹配，默认关闭）
+    response_cache_enabled: bool = False
+    response_cache_max_entries: int = 1024
+    response_cache_ttl_seconds: int = 3600
+    response_cache_db_path: Optional[str] = None  # 设置后启用 SQLite 持久层
+    response_cache_disabled_assistants: list[str] = []
+
+    # 语义缓存配置（首轮问题的相似度匹配，默认关闭，需要 numpy）
+    semantic_cache_enabled: bool = False
+    semantic_cache_capacity: int = 100_000
+    semantic_cache_threshold: float = 0.75
+    semantic_cache_dim: int = 256
+    semantic_cache_path: Optional[str] = None  # 持久化路径前缀（.npy + .json），多 worker 时只有一个进程写入
     
     class Config:
         env_file = ".env"
@@ -46,7 +168,7 @@ class Settings(BaseSettings):
         if not self.deepseek_api_key:
             self.deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
         
-        if not self.deepseek_api_key:
+        if not self.deepseek_api_key and self.llm_provider not in ("fake", "replay"):
             raise ValueError("请设置 DEEPSEEK_API_KEY 环境变量")
 
 
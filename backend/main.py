@@ -3,12 +3,18 @@
 LangGraph Chat Server - 模块化版本
 主应用入口
 """
+import asyncio
+import gc
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .config import settings
 from .api.routes import router
+from .services.semantic_cache import semantic_cache
+from .services.llm_service import llm_service
+from .services.http_client import http_client_pool
 
 
 def create_app() -> FastAPI:
@@ -47,14 +53,28 @@ async def startup_event():
     """应用启动事件"""
     print("🚀 Starting LangGraph Chat Server...")
     print(f"📚 Based on LangGraph tutorials")
-    print(f"🌊 Real streaming with astream_events")
+    print(f"🌊 Real streaming with filtered stream modes")
     print(f"🤖 Model: {settings.deepseek_model}")
+    # 预热连接不阻塞启动太久，失败时首个请求再建立连接
+    try:
+        await asyncio.wait_for(llm_service.warm_up(), timeout=settings.llm_http_connect_timeout * 2)
+    except asyncio.TimeoutError:
+        print("⚠️  LLM 连接预热超时")
+    llm_service.start_health_checks()
+    # 启动时导入和初始化的对象（模块、模型、图）常驻内存，移出 GC 追踪：
+    # 否则每次全代回收都要扫描它们（停顿上百毫秒），期间所有进行中的流式输出一起卡住
+    gc.freeze()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭事件"""
     print("👋 Shutting down LangGraph Chat Server...")
+    llm_service.stop_health_checks()
+    if llm_service.recorder is not None:
+        await asyncio.to_thread(llm_service.recorder.close)
+    await http_client_pool.aclose()
+    await asyncio.to_thread(semantic_cache.save)
 
 
 def main():
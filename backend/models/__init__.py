@@ -1,7 +1,7 @@
 """
 Models module
 """
-from .state import State
+from .state import State, ChatContext
 from .schemas import (
     Message,
     MessageContent,
@@ -15,6 +15,7 @@ from .schemas import (
 
 __all__ = [
     "State",
+    "ChatContext",
     "Message",
     "MessageContent",
     "InputMessages",
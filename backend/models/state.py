@@ -1,7 +1,8 @@
 """
 状态定义模块
 """
-from typing import Annotated, List
+from dataclasses import dataclass
+from typing import Annotated, Any, List, Optional
 from typing_extensions import TypedDict
 from langchain_core.messages import BaseMessage
 from langgraph.graph.message import add_messages
@@ -11,3 +12,9 @@ class State(TypedDict):
     """LangGraph 状态定义"""
     messages: Annotated[List[BaseMessage], add_messages]
 
+
+@dataclass
+class ChatContext:
+    """单次运行的上下文（通过 runtime context 传入节点，不写入检查点）"""
+    prompt: Optional[List[BaseMessage]] = None  # 已组装好的 prompt，为 None 时节点按状态自行组装
+    metrics: Any = None  # 运行指标（RunMetrics），记录服务商返回的用量
@@ -0,0 +1,20 @@
+"""
+Providers module
+不访问真实服务商的聊天模型实现，不依赖配置和全局服务，可以被独立入口直接导入
+"""
+from .base import StreamingChatModel, inner_astream, inner_stream
+from .fake import FAKE_LLM_SETTINGS, FakeChatModel, FakeLLMError
+from .cassette import CassetteWriter, RecordingChatModel, ReplayChatModel, load_cassettes
+
+__all__ = [
+    "StreamingChatModel",
+    "inner_astream",
+    "inner_stream",
+    "FakeChatModel",
+    "FakeLLMError",
+    "FAKE_LLM_SETTINGS",
+    "CassetteWriter",
+    "RecordingChatModel",
+    "ReplayChatModel",
+    "load_cassettes",
+]
@@ -0,0 +1,92 @@
+"""
+流式聊天模型基类
+子类只实现 _stream/_astream，非流式调用（invoke/ainvoke）由基类把分块合并成一条消息
+"""
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+# 包装其他模型的模型（后端池、录制）把内层模型作为内部调用直接读取 _stream/_astream，
+# 不经过 LangChain 的运行包装：外层运行已经为每个分块触发回调，内层再包装一次只会重复创建回调管理器、
+# 逐块重建结果并在结束时再合并一遍全部分块，messages 流式模式等回调消费者还会收到重复的分块
+
+
+async def inner_astream(
+    model: BaseChatModel,
+    messages: List[BaseMessage],
+    stop: Optional[List[str]] = None,
+    **kwargs: Any,
+) -> AsyncIterator[AIMessageChunk]:
+    """
+    作为内部调用流式读取内层模型
+
+    Args:
+        model: 内层模型
+        messages: 输入消息
+        stop: 停止词
+        **kwargs: 其他调用参数
+
+    Yields:
+        消息分块
+    """
+    async for chunk in model._astream(messages, stop=stop, **kwargs):
+        yield chunk.message
+
+
+def inner_stream(
+    model: BaseChatModel,
+    messages: List[BaseMessage],
+    stop: Optional[List[str]] = None,
+    **kwargs: Any,
+) -> Iterator[AIMessageChunk]:
+    """
+    作为内部调用同步流式读取内层模型
+
+    Args:
+        model: 内层模型
+        messages: 输入消息
+        stop: 停止词
+        **kwargs: 其他调用参数
+
+    Yields:
+        消息分块
+    """
+    for chunk in model._stream(messages, stop=stop, **kwargs):
+        yield chunk.message
+
+
+class StreamingChatModel(BaseChatModel):
+    """以流式输出为主的聊天模型：_generate/_agenerate 合并 _stream/_astream 的分块"""
+
+    @staticmethod
+    def _result(message: Optional[AIMessageChunk]) -> ChatResult:
+        """合并后的消息作为调用结果（没有任何分块时为空消息）"""
+        return ChatResult(generations=[ChatGeneration(message=message or AIMessageChunk(content=""))])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message: Optional[AIMessageChunk] = None
+        for chunk in self._stream(messages, stop=stop, **kwargs):
+            message = chunk.message if message is None else message + chunk.message
+        return self._result(message)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message: Optional[AIMessageChunk] = None
+        async for chunk in self._astream(messages, stop=stop, **kwargs):
+            message = chunk.message if message is None else message + chunk.message
+        return self._result(message)
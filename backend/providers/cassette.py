@@ -0,0 +1,329 @@
+"""
+模型 token 流录制与回放模块
+录制模式把每次调用的 prompt、分块内容和分块到达时间写入 gzip 压缩的 cassette 文件（JSON Lines），
+回放模型按原始或缩放后的节奏重放这些分块，用真实服务商的突发/停顿特征做离线压测。
+调用方中途取消的调用也会录制（标记 cancelled），回放时默认跳过，避免把截断的输出当作完整回答重放
+"""
+import asyncio
+import atexit
+import glob
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk
+from pydantic import ConfigDict
+
+from ..utils.tokens import flatten_content
+from .base import StreamingChatModel, inner_astream, inner_stream
+from .fake import FakeLLMError
+
+
+def prompt_hash(messages: Sequence[BaseMessage]) -> str:
+    """计算 prompt 哈希（回放时按它匹配录制的调用）"""
+    raw = json.dumps([[m.type, flatten_content(m.content)] for m in messages], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CassetteWriter:
+    """
+    cassette 文件写入器
+
+    记录先放入队列，由后台线程批量追加到文件（每批一个 gzip 成员，进程中断时已写入的记录仍然完整），
+    模型调用结束时不在事件循环上做文件 I/O；进程退出时写完队列中剩余的记录
+    """
+
+    def __init__(self, directory: str, record_prompts: bool = True):
+        """
+        初始化写入器
+
+        Args:
+            directory: cassette 目录（每个进程一个文件）
+            record_prompts: 是否记录 prompt 原文（False 时只记录哈希）
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(directory, f"cassette-{stamp}-{os.getpid()}.jsonl.gz")
+        self.record_prompts = record_prompts
+        self.lock = threading.Lock()
+        self.count = 0
+        self.closed = False
+        self.queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="cassette-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, entry: Dict[str, Any]) -> None:
+        """
+        写入一次调用的记录（只入队，不等待写入文件）
+
+        Args:
+            entry: 调用记录
+        """
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        if self.closed:
+            self._append([line])
+        else:
+            self.queue.put(line)
+
+    def _run(self) -> None:
+        """后台线程：取出队列中已有的全部记录，一次追加到文件"""
+        while True:
+            line = self.queue.get()
+            lines = []
+            while line is not None:
+                lines.append(line)
+                try:
+                    line = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                if lines:
+                    self._append(lines)
+            except Exception as e:
+                print(f"⚠️  cassette 写入失败: {e}")
+            finally:
+                for _ in range(len(lines) + (line is None)):
+                    self.queue.task_done()
+            if line is None:
+                return
+
+    def _append(self, lines: List[str]) -> None:
+        """把多条记录作为一个 gzip 成员追加到文件"""
+        with self.lock, gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.writelines(lines)
+            self.count += len(lines)
+
+    def flush(self) -> None:
+        """等待队列中的记录全部写入文件（阻塞，异步代码中用 asyncio.to_thread 调用）"""
+        self.queue.join()
+
+    def close(self) -> None:
+        """写完剩余记录并停止后台线程（之后的记录直接写入文件）"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+
+def load_cassettes(path: str, include_cancelled: bool = False) -> List[Dict[str, Any]]:
+    """
+    读取 cassette 记录
+
+    Args:
+        path: cassette 文件、目录（读取其中全部 *.jsonl.gz）或通配符
+        include_cancelled: 是否包含调用方中途取消的调用（输出不完整，默认跳过）
+
+    Returns:
+        按文件名和写入顺序排列的调用记录
+    """
+    if os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, "*.jsonl.gz")))
+    else:
+        files = sorted(glob.glob(path))
+
+    entries = []
+    for file in files:
+        with gzip.open(file, "rt", encoding="utf-8") as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    if not include_cancelled:
+        entries = [entry for entry in entries if not entry.get("cancelled")]
+    return entries
+
+
+class _Recording:
+    """单次调用的录制状态"""
+
+    def __init__(self, model: BaseChatModel, writer: CassetteWriter, name: str, messages: List[BaseMessage]):
+        self.writer = writer
+        self.started = time.perf_counter()
+        self.entry: Dict[str, Any] = {
+            "backend": name,
+            "model": getattr(model, "model_name", None) or type(model).__name__,
+            "recorded_at": datetime.now().isoformat(),
+            "prompt_hash": prompt_hash(messages),
+            "chunks": [],
+        }
+        if writer.record_prompts:
+            self.entry["prompt"] = [[m.type, flatten_content(m.content)] for m in messages]
+
+    def add(self, chunk: AIMessageChunk) -> None:
+        if chunk.content:
+            offset = round(time.perf_counter() - self.started, 4)
+            self.entry["chunks"].append([offset, flatten_content(chunk.content)])
+        if chunk.usage_metadata:
+            self.entry["usage"] = dict(chunk.usage_metadata)
+
+    def finish(self, error: Optional[BaseException] = None, cancelled: bool = False) -> None:
+        self.entry["duration"] = round(time.perf_counter() - self.started, 4)
+        if cancelled:
+            self.entry["cancelled"] = True
+        if error is not None:
+            self.entry["error"] = {"message": str(error), "status_code": getattr(error, "status_code", None)}
+        self.writer.write(self.entry)
+
+
+class RecordingChatModel(StreamingChatModel):
+    """录制包装：调用内部模型，同时把 token 流写入 cassette（工具调用分块照常透传，但不录制）"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: BaseChatModel
+    writer: Any
+    name: str = "default"
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording-chat-model"
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        recording = _Recording(self.inner, self.writer, self.name, messages)
+        error = None
+        completed = False
+        try:
+            async for chunk in inner_astream(self.inner, messages, stop=stop, **kwargs):
+                recording.add(chunk)
+                yield ChatGenerationChunk(message=chunk)
+            completed = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # 调用方中途停止读取（取消、切换后端）时也保存已录制的部分
+            recording.finish(error, cancelled=not completed and error is None)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        recording = _Recording(self.inner, self.writer, self.name, messages)
+        error = None
+        completed = False
+        try:
+            for chunk in inner_stream(self.inner, messages, stop=stop, **kwargs):
+                recording.add(chunk)
+                yield ChatGenerationChunk(message=chunk)
+            completed = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # 调用方中途停止读取（取消、切换后端）时也保存已录制的部分
+            recording.finish(error, cancelled=not completed and error is None)
+
+
+class ReplayChatModel(StreamingChatModel):
+    """回放模型：按录制的分块和时间间隔输出"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    entries: List[Dict[str, Any]]
+    time_scale: float = 1.0  # 时间缩放（0.5 表示两倍速，0 表示不等待）
+    # prompt: 优先回放 prompt 相同的录制，没有时按顺序轮流回放；sequential: 始终按顺序轮流回放
+    match: str = "prompt"
+    include_cancelled: bool = False  # 是否回放调用方中途取消的调用（输出被截断）
+    index: Dict[str, List[int]] = {}
+    counter: Any = None
+
+    def model_post_init(self, __context: Any) -> None:
+        if not self.include_cancelled:
+            self.entries = [entry for entry in self.entries if not entry.get("cancelled")]
+        if not self.entries:
+            raise ValueError("cassette 中没有可回放的记录")
+        self.index = {}
+        for i, entry in enumerate(self.entries):
+            self.index.setdefault(entry.get("prompt_hash", ""), []).append(i)
+        self.counter = itertools.count()
+
+    @classmethod
+    def from_path(cls, path: str, **kwargs: Any) -> "ReplayChatModel":
+        """从 cassette 文件或目录创建回放模型"""
+        return cls(entries=load_cassettes(path, include_cancelled=kwargs.get("include_cancelled", False)), **kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay-chat-model"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        """绑定工具（录制不包含工具调用，只保证接口兼容）"""
+        return self.bind(**kwargs)
+
+    def select(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        """
+        选择要回放的录制
+
+        Args:
+            messages: 输入消息
+
+        Returns:
+            调用记录
+        """
+        n = next(self.counter)
+        if self.match == "prompt":
+            matches = self.index.get(prompt_hash(messages))
+            if matches:
+                return self.entries[matches[n % len(matches)]]
+        return self.entries[n % len(self.entries)]
+
+    def _steps(self, entry: Dict[str, Any]) -> Iterator[tuple]:
+        """(等待秒数, 分块)"""
+        previous = 0.0
+        for offset, content in entry["chunks"]:
+            yield max(0.0, offset - previous) * self.time_scale, content
+            previous = offset
+
+    @staticmethod
+    def _final(entry: Dict[str, Any]) -> ChatGenerationChunk:
+        """录制结束时的错误或用量分块"""
+        error = entry.get("error")
+        if error:
+            raise FakeLLMError(f"回放录制的错误: {error['message']}", status_code=error.get("status_code") or 500)
+        usage = entry.get("usage")
+        return ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage) if usage
+                                   else AIMessageChunk(content=""))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        entry = self.select(messages)
+        for delay, content in self._steps(entry):
+            await asyncio.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=content))
+        yield self._final(entry)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        entry = self.select(messages)
+        for delay, content in self._steps(entry):
+            time.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=content))
+        yield self._final(entry)
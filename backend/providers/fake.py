@@ -0,0 +1,285 @@
+"""
+确定性假模型模块
+不访问网络，按配置的首 token 延迟、吞吐、抖动和长度分布流式输出语料，用于压测和 CI 基准测试。
+同一对话在同一 seed 下输出相同的内容和节奏
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Literal, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk
+
+from ..utils.tokens import count_message_tokens, flatten_content
+from .base import StreamingChatModel
+
+
+ZH_TEXT = (
+    "这是一个用于压力测试的模拟回复。系统会按照配置的速度逐个输出分块，"
+    "以便在不调用真实模型的情况下测量首个 token 延迟、吞吐量和端到端耗时。"
+    "在实际部署中，流式响应需要经过网关、应用服务器、图执行引擎和数据库，"
+    "每一层都可能引入额外的排队和序列化开销。通过固定的随机种子，"
+    "同样的请求每次都会得到同样的输出，方便对比优化前后的结果。"
+    "长回复通常包含多个段落、列表和代码示例，中文字符的分词方式也与英文不同，"
+    "因此语料中混合了常见的标点符号、数字 2024 和英文单词 LangGraph。\n\n"
+)
+
+EN_TEXT = (
+    "This is a simulated response used for load testing. Tokens are emitted at a configurable rate "
+    "so that time to first token, throughput and end-to-end latency can be measured without calling "
+    "a real model. In production a streaming response passes through the gateway, the application "
+    "server, the graph runtime and the database, and every layer can add queueing and serialization "
+    "overhead. With a fixed seed the same request always produces the same output, which makes "
+    "before and after comparisons reproducible.\n\n"
+)
+
+CODE_TEXT = (
+    "```python\n"
+    "import asyncio\n"
+    "from typing import AsyncIterator\n\n\n"
+    "async def stream_tokens(prompt: str, rate: float = 50.0) -> AsyncIterator[str]:\n"
+    "    \"\"\"Yield tokens at a fixed rate.\"\"\"\n"
+    "    for index, word in enumerate(prompt.split()):\n"
+    "        await asyncio.sleep(1 / rate)\n"
+    "        yield f\"{index}:{word} \"\n\n\n"
+    "class Counter:\n"
+    "    def __init__(self) -> None:\n"
+    "        self.values: dict[str, int] = {}\n\n"
+    "    def add(self, key: str, amount: int = 1) -> int:\n"
+    "        self.values[key] = self.values.get(key, 0) + amount\n"
+    "        return self.values[key]\n"
+    "```\n\n"
+)
+
+
+def _tokenize_latin(text: str) -> List[str]:
+    """按单词切分（空白附在下一个单词前面，接近 BPE 分词的效果）"""
+    return re.findall(r"\s*(?:\w+|[^\w\s])|\s+", text)
+
+
+def _tokenize_cjk(text: str) -> List[str]:
+    """中文交替按 2 个字、1 个字切分，其他部分按单词切分"""
+    tokens = []
+    for part in re.findall(r"[一-鿿]+|[^一-鿿]+", text):
+        if not re.match(r"[一-鿿]", part):
+            tokens.extend(_tokenize_latin(part))
+            continue
+        i, size = 0, 2
+        while i < len(part):
+            tokens.append(part[i:i + size])
+            i += size
+            size = 3 - size
+    return tokens
+
+
+CORPORA: Dict[str, List[str]] = {
+    "zh": _tokenize_cjk(ZH_TEXT),
+    "en": _tokenize_latin(EN_TEXT),
+    "code": _tokenize_latin(CODE_TEXT),
+    "mixed": _tokenize_cjk(ZH_TEXT) + _tokenize_latin(CODE_TEXT) + _tokenize_latin(EN_TEXT),
+}
+
+
+# 可通过 FAKE_LLM_* 配置的字段（backend 的 Settings 中为 fake_llm_*，独立入口读取同名环境变量）
+FAKE_LLM_SETTINGS = (
+    "ttft_ms",
+    "tokens_per_second",
+    "jitter",
+    "length_distribution",
+    "length_mean",
+    "length_stddev",
+    "corpus",
+    "error_rate",
+    "error_kinds",
+    "seed",
+)
+
+
+class FakeLLMError(Exception):
+    """注入的模型错误（status_code 与 OpenAI 兼容接口的错误一致，便于上层按状态码处理）"""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = None
+
+
+class FakeChatModel(StreamingChatModel):
+    """确定性假聊天模型"""
+
+    model_name: str = "fake-chat"
+    ttft_ms: float = 300.0  # 首个分块之前的延迟
+    tokens_per_second: float = 50.0  # 首个分块之后的输出速度
+    jitter: float = 0.2  # 延迟的相对抖动幅度（0.2 表示 ±20%）
+    length_distribution: Literal["fixed", "normal", "lognormal"] = "lognormal"
+    length_mean: int = 200  # 输出分块数的均值
+    length_stddev: int = 100
+    max_tokens: Optional[int] = None
+    corpus: Literal["zh", "en", "code", "mixed"] = "mixed"
+    error_rate: float = 0.0  # 注入错误的概率
+    # before_first_token: 首个分块前失败；mid_stream: 输出一半后断开；rate_limit: 首个分块前返回 429
+    error_kinds: List[str] = ["before_first_token", "mid_stream", "rate_limit"]
+    seed: int = 0
+    # True 时同一对话输出相同内容；False 时每次调用都不同（仍由 seed 决定整个序列）
+    deterministic: bool = True
+    calls: int = 0
+
+    @classmethod
+    def from_env(cls, **kwargs: Any) -> "FakeChatModel":
+        """
+        从 FAKE_LLM_* 环境变量创建（供不使用 backend 配置的独立入口使用，与 LLM_PROVIDER=fake 的配置项相同）
+
+        Args:
+            **kwargs: 其他模型参数（如 max_tokens），优先于环境变量
+
+        Returns:
+            假模型
+        """
+        options: Dict[str, Any] = {}
+        for name in FAKE_LLM_SETTINGS:
+            value = os.getenv(f"FAKE_LLM_{name.upper()}")
+            if value:
+                # 列表与 pydantic-settings 一致使用 JSON，其余字段由模型校验转换类型
+                options[name] = json.loads(value) if name == "error_kinds" else value
+        return cls(**{**options, **kwargs})
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "corpus": self.corpus, "seed": self.seed}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        """绑定工具（假模型不会发起工具调用，只保证接口兼容）"""
+        return self.bind(**kwargs)
+
+    def _rng(self, messages: List[BaseMessage]) -> random.Random:
+        """本次调用的随机数生成器"""
+        self.calls += 1
+        if self.deterministic:
+            digest = hashlib.sha256(
+                "\x00".join(f"{m.type}:{flatten_content(m.content)}" for m in messages).encode("utf-8")
+            ).hexdigest()
+            return random.Random(f"{self.seed}:{digest}")
+        return random.Random(f"{self.seed}:{self.calls}")
+
+    def _sample_length(self, rng: random.Random, max_tokens: Optional[int]) -> int:
+        """按长度分布抽取输出分块数"""
+        if self.length_distribution == "fixed":
+            length = self.length_mean
+        elif self.length_distribution == "normal":
+            length = rng.gauss(self.length_mean, self.length_stddev)
+        else:
+            # 对数正态：大部分回复较短，少数很长（与真实分布接近）
+            sigma = math.sqrt(math.log(1 + (self.length_stddev / max(1, self.length_mean)) ** 2))
+            mu = math.log(max(1, self.length_mean)) - sigma ** 2 / 2
+            length = rng.lognormvariate(mu, sigma)
+        limit = max_tokens or self.max_tokens
+        length = max(1, int(length))
+        return min(length, limit) if limit else length
+
+    def _delay(self, rng: random.Random, seconds: float) -> float:
+        """加入抖动后的延迟"""
+        return max(0.0, seconds * (1 + self.jitter * rng.uniform(-1, 1)))
+
+    def plan(
+        self,
+        messages: List[BaseMessage],
+        max_tokens: Optional[int] = None,
+    ) -> Tuple[List[Tuple[float, str]], Optional[str]]:
+        """
+        生成本次调用的输出计划
+
+        Args:
+            messages: 输入消息
+            max_tokens: 调用时指定的输出上限
+
+        Returns:
+            ([(输出前的等待秒数, 分块)], 注入的错误类型或 None)
+        """
+        rng = self._rng(messages)
+        corpus = CORPORA[self.corpus]
+        length = self._sample_length(rng, max_tokens)
+        start = rng.randrange(len(corpus))
+
+        steps = [(self._delay(rng, self.ttft_ms / 1000), corpus[start % len(corpus)])]
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for i in range(1, length):
+            steps.append((self._delay(rng, interval), corpus[(start + i) % len(corpus)]))
+
+        error = None
+        if self.error_kinds and rng.random() < self.error_rate:
+            error = rng.choice(self.error_kinds)
+        return steps, error
+
+    def _usage_chunk(self, messages: List[BaseMessage], completion_tokens: int) -> ChatGenerationChunk:
+        """最后一个分块：返回用量（与 OpenAI 兼容接口的 stream_usage 一致）"""
+        prompt_tokens = sum(count_message_tokens(message) for message in messages)
+        return ChatGenerationChunk(message=AIMessageChunk(
+            content="",
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+            response_metadata={"model_name": self.model_name, "finish_reason": "stop"},
+        ))
+
+    @staticmethod
+    def _raise(error: str) -> None:
+        if error == "rate_limit":
+            raise FakeLLMError("注入错误: 429 Too Many Requests", status_code=429)
+        raise FakeLLMError(f"注入错误: {error}")
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        steps, error = self.plan(messages, kwargs.get("max_tokens"))
+        fail_at = len(steps) // 2 if error == "mid_stream" else 0
+        # 按绝对时间输出（与真实服务商一样不受调用方处理速度影响，处理开销不会累积到后续分块）
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        for i, (delay, token) in enumerate(steps):
+            deadline += delay
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            if error and i == fail_at:
+                self._raise(error)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield self._usage_chunk(messages, len(steps))
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        steps, error = self.plan(messages, kwargs.get("max_tokens"))
+        fail_at = len(steps) // 2 if error == "mid_stream" else 0
+        deadline = time.perf_counter()
+        for i, (delay, token) in enumerate(steps):
+            deadline += delay
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+            if error and i == fail_at:
+                self._raise(error)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield self._usage_chunk(messages, len(steps))
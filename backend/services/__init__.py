@@ -4,6 +4,18 @@ Services module
 from .llm_service import llm_service, LLMService
 from .thread_service import thread_service, ThreadService
 from .graph_service import graph_service, GraphService
+from .response_cache import response_cache, ResponseCache
+from .semantic_cache import semantic_cache, SemanticCache
+from .metrics_service import metrics_service, MetricsService, RunMetrics
+from .summary_service import summary_service, SummaryService
+from .retrieval_memory import retrieval_memory, RetrievalMemory
+from .map_reduce import map_reduce_service, MapReduceService
+from .http_client import http_client_pool, HttpClientPool
+from .admission import admission_controller, AdmissionController
+from .single_flight import single_flight, SingleFlight
+from .batch_service import batch_service, BatchService
+from .graph_registry import graph_registry, GraphRegistry
+from .tool_executor import tool_executor, ToolExecutor
 
 __all__ = [
     "llm_service",
@@ -12,5 +24,30 @@ __all__ = [
     "ThreadService",
     "graph_service",
     "GraphService",
+    "response_cache",
+    "ResponseCache",
+    "semantic_cache",
+    "SemanticCache",
+    "metrics_service",
+    "MetricsService",
+    "RunMetrics",
+    "summary_service",
+    "SummaryService",
+    "retrieval_memory",
+    "RetrievalMemory",
+    "map_reduce_service",
+    "MapReduceService",
+    "http_client_pool",
+    "HttpClientPool",
+    "admission_controller",
+    "AdmissionController",
+    "single_flight",
+    "SingleFlight",
+    "batch_service",
+    "BatchService",
+    "graph_registry",
+    "GraphRegistry",
+    "tool_executor",
+    "ToolExecutor",
 ]
 
@@ -0,0 +1,363 @@
+"""
+LLM 调用准入控制模块
+限制同时进行的流式调用数和每分钟请求数/token 数，超出时按线程（或用户）轮转公平排队，
+排队期间向客户端报告位置和预计等待时间
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncGenerator, Deque, Dict, Optional
+
+from ..config import settings
+
+
+class AdmissionTimeout(Exception):
+    """排队超时"""
+
+
+def rate_limit_retry_after(error: BaseException, default: float = 10.0) -> Optional[float]:
+    """
+    判断错误是否为服务商限流（HTTP 429），并解析建议的等待时间
+
+    沿异常链查找（后端池在全部后端失败时会把原始错误作为 __cause__）。
+
+    Args:
+        error: 调用 LLM 时抛出的异常
+        default: 服务商未返回 Retry-After 时的等待秒数
+
+    Returns:
+        等待秒数，不是限流错误时返回 None
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if getattr(error, "status_code", None) == 429:
+            response = getattr(error, "response", None)
+            retry_after = response.headers.get("retry-after") if response is not None else None
+            try:
+                return max(0.0, float(retry_after)) if retry_after is not None else default
+            except ValueError:
+                return default
+        error = error.__cause__ or error.__context__
+    return None
+
+
+class TokenBucket:
+    """令牌桶（每分钟额度，按秒平滑补充；额度为 0 表示不限制）"""
+
+    def __init__(self, per_minute: int):
+        """
+        初始化令牌桶
+
+        Args:
+            per_minute: 每分钟额度
+        """
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        额度足够前还需等待的秒数
+
+        Args:
+            amount: 需要的额度（超过桶容量时按容量计，避免永远等不到）
+
+        Returns:
+            等待秒数，0 表示可以立即消费
+        """
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        """消费额度"""
+        if not self.unlimited:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """按实际用量修正（delta 为实际减去预估，可能为负）"""
+        if not self.unlimited:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class Ticket:
+    """排队凭证"""
+
+    def __init__(self, key: str, tokens: int, slots: int = 1, requests: int = 1):
+        self.key = key
+        self.tokens = tokens
+        self.slots = slots  # 占用的并发名额（一次运行内部并行调用多次模型时大于 1）
+        self.requests = requests  # 计入 RPM 的请求数
+        self.granted = asyncio.Event()
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.released = False
+
+
+class AdmissionController:
+    """准入控制器（并发上限 + RPM/TPM 令牌桶 + 按 key 轮转的公平队列）"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_in_flight: int = 32,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        queue_timeout: float = 120.0,
+        expected_completion_tokens: int = 512,
+    ):
+        """
+        初始化准入控制器
+
+        Args:
+            enabled: 是否启用
+            max_in_flight: 同时进行的 LLM 流式调用上限
+            requests_per_minute: 每分钟请求数上限，0 表示不限制
+            tokens_per_minute: 每分钟 token 数上限（prompt + 预估输出），0 表示不限制
+            queue_timeout: 最长排队时间（秒）
+            expected_completion_tokens: 准入时预估的输出 token 数（结束后按实际用量修正）
+        """
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.expected_completion_tokens = expected_completion_tokens
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.in_flight = 0
+        self.paused_until = 0.0  # 上游限流时暂停放行到该时间
+        # 每个 key 一个 FIFO 队列，按 OrderedDict 顺序轮转出队
+        self.queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self.retry_handle: Optional[asyncio.TimerHandle] = None
+        self.ewma_service_seconds = 10.0
+        self.counters = {"admitted": 0, "waited": 0, "timeouts": 0, "rate_limited": 0}
+
+    def _queued(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def _dispatch(self) -> None:
+        """在并发和额度允许的范围内按轮转顺序放行排队的请求"""
+        self.retry_handle = None
+        while self.queues and self.in_flight < self.max_in_flight:
+            key, queue = next(iter(self.queues.items()))
+            ticket = queue[0]
+            if self.in_flight + ticket.slots > self.max_in_flight:
+                # 并发名额不够时等进行中的调用释放（release 会再次放行）
+                return
+
+            wait = max(
+                self.paused_until - time.monotonic(),
+                self.requests.wait_time(ticket.requests),
+                self.tokens.wait_time(ticket.tokens),
+            )
+            if wait > 0:
+                # 额度不足时定时重试，不逐个轮询
+                self.retry_handle = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            queue.popleft()
+            if queue:
+                self.queues.move_to_end(key)
+            else:
+                del self.queues[key]
+
+            self.requests.consume(ticket.requests)
+            self.tokens.consume(ticket.tokens)
+            self.in_flight += ticket.slots
+            self.counters["admitted"] += 1
+            ticket.granted_at = time.monotonic()
+            ticket.granted.set()
+
+    def enqueue(self, key: str, tokens: int, slots: int = 1, requests: int = 1) -> Ticket:
+        """
+        申请一次 LLM 调用
+
+        Args:
+            key: 公平队列的 key（用户ID或线程ID）
+            tokens: 预估 token 数
+            slots: 占用的并发名额（超过上限时按上限计，避免永远等不到）
+            requests: 计入 RPM 的请求数
+
+        Returns:
+            排队凭证（已放行时 granted 已被设置）
+        """
+        ticket = Ticket(key, tokens, max(1, min(slots, self.max_in_flight)), max(1, requests))
+        if not self.enabled:
+            ticket.granted.set()
+            return ticket
+
+        self.queues.setdefault(key, deque()).append(ticket)
+        if self.retry_handle is None:
+            self._dispatch()
+        if not ticket.granted.is_set():
+            self.counters["waited"] += 1
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """
+        计算凭证在轮转顺序中的位置（1 表示下一个放行）
+
+        Args:
+            ticket: 排队凭证
+
+        Returns:
+            位置
+        """
+        keys = list(self.queues)
+        queue = self.queues.get(ticket.key)
+        if queue is None or ticket not in queue:
+            return 0
+        index = queue.index(ticket)
+        order = keys.index(ticket.key)
+        ahead = index
+        for j, key in enumerate(keys):
+            if key != ticket.key:
+                ahead += min(len(self.queues[key]), index + (1 if j < order else 0))
+        return ahead + 1
+
+    def estimated_wait(self, ticket: Ticket) -> float:
+        """
+        估算剩余等待时间（秒）
+
+        Args:
+            ticket: 排队凭证
+
+        Returns:
+            预计等待秒数
+        """
+        position = self.position(ticket)
+        slots = math.ceil(position / max(1, self.max_in_flight)) * self.ewma_service_seconds
+        budget = max(
+            self.paused_until - time.monotonic(),
+            self.requests.wait_time(position),
+            self.tokens.wait_time(ticket.tokens * position),
+        )
+        return round(max(slots if self.in_flight >= self.max_in_flight else 0.0, budget), 1)
+
+    async def wait(
+        self,
+        ticket: Ticket,
+        cancel_event: Optional[asyncio.Event] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        等待放行，排队位置变化时产出进度（收到取消信号时直接结束，由调用方检查信号）
+
+        Args:
+            ticket: 排队凭证
+            cancel_event: 取消信号
+
+        Yields:
+            {"type": "queue", "position", "estimated_wait_seconds"}
+
+        Raises:
+            AdmissionTimeout: 超过最长排队时间
+        """
+        last_position = None
+        while not ticket.granted.is_set():
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            if time.monotonic() - ticket.enqueued_at > self.queue_timeout:
+                self.counters["timeouts"] += 1
+                raise AdmissionTimeout()
+
+            position = self.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield {
+                    "type": "queue",
+                    "position": position,
+                    "estimated_wait_seconds": self.estimated_wait(ticket),
+                }
+            try:
+                await asyncio.wait_for(ticket.granted.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, ticket: Ticket, actual_tokens: Optional[int] = None) -> None:
+        """
+        结束调用（或放弃排队），释放并发名额并按实际用量修正 TPM 额度
+
+        Args:
+            ticket: 排队凭证
+            actual_tokens: 实际 token 用量，未知时不修正
+        """
+        if not self.enabled or ticket.released:
+            return
+        ticket.released = True
+
+        if not ticket.granted.is_set():
+            queue = self.queues.get(ticket.key)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self.queues[ticket.key]
+            return
+
+        self.in_flight -= ticket.slots
+        if actual_tokens:
+            self.tokens.adjust(actual_tokens - ticket.tokens)
+        duration = time.monotonic() - ticket.granted_at
+        self.ewma_service_seconds = 0.2 * duration + 0.8 * self.ewma_service_seconds
+        if self.retry_handle is None:
+            self._dispatch()
+
+    def on_rate_limited(self, retry_after: float) -> None:
+        """
+        上游返回 429 时暂停放行
+
+        Args:
+            retry_after: 上游建议的等待秒数
+        """
+        self.counters["rate_limited"] += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        if self.retry_handle is not None:
+            self.retry_handle.cancel()
+        if self.queues:
+            self._dispatch()
+        else:
+            self.retry_handle = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取准入统计
+
+        Returns:
+            进行中/排队中的请求数和计数器
+        """
+        return {
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "queued": self._queued(),
+            "paused_seconds": round(max(0.0, self.paused_until - time.monotonic()), 1),
+            "queue_keys": len(self.queues),
+            "ewma_service_seconds": round(self.ewma_service_seconds, 2),
+            **self.counters,
+        }
+
+
+# 全局准入控制器实例
+admission_controller = AdmissionController(
+    enabled=settings.admission_enabled,
+    max_in_flight=settings.admission_max_in_flight,
+    requests_per_minute=settings.admission_requests_per_minute,
+    tokens_per_minute=settings.admission_tokens_per_minute,
+    queue_timeout=settings.admission_queue_timeout,
+    expected_completion_tokens=settings.admission_expected_completion_tokens,
+)
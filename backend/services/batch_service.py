@@ -0,0 +1,394 @@
+"""
+批量推理模块
+离线批量输入（NDJSON，每行一个问题或一段对话）经过编译好的图并发运行，结果按完成顺序以 NDJSON 返回。
+每个输入都经过准入控制（与在线请求公平排队，服务商限流时暂停并重试），完成的结果写入检查点文件，
+中断后用同一个检查点重新运行时跳过已完成的输入。默认不创建线程
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from typing import Any, AsyncGenerator, Dict, Iterable, List, Optional, Set
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from ..config import settings
+from ..utils.tokens import count_message_tokens, count_text_tokens, flatten_content
+from .admission import admission_controller, AdmissionTimeout, rate_limit_retry_after
+from .graph_service import graph_service
+from .metrics_service import metrics_service
+from .thread_service import thread_service
+
+
+MESSAGE_TYPES = {
+    "user": HumanMessage,
+    "human": HumanMessage,
+    "assistant": AIMessage,
+    "ai": AIMessage,
+    "system": SystemMessage,
+}
+
+
+def parse_batch_lines(lines: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    解析 NDJSON 输入
+
+    每行是一个 JSON 对象：{"id"?, "input": "问题"} 或 {"id"?, "messages": [{"role", "content"}]}，
+    可选 "thread_id"（创建线程时使用）。没有 id 时用行号（从 0 开始，跳过空行不计）作为 id，
+    同一个文件重新运行时 id 不变，检查点才能生效。
+
+    Args:
+        lines: NDJSON 文本行
+
+    Returns:
+        输入列表
+
+    Raises:
+        ValueError: 某一行不是合法的输入
+    """
+    items = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"第 {line_number} 行不是合法的 JSON: {e}") from e
+        if not isinstance(item, dict) or ("input" not in item and "messages" not in item):
+            raise ValueError(f"第 {line_number} 行缺少 input 或 messages")
+        error = _check_messages(item)
+        if error:
+            raise ValueError(f"第 {line_number} 行的 messages 不合法: {error}")
+        item["id"] = str(item.get("id", len(items)))
+        items.append(item)
+    return items
+
+
+def _check_messages(item: Dict[str, Any]) -> Optional[str]:
+    """检查 messages 的结构（to_messages 能够转换），合法时返回 None，否则返回原因"""
+    if "messages" not in item:
+        return None
+    messages = item["messages"]
+    if not isinstance(messages, list) or not messages:
+        return "应为非空的消息数组"
+    for index, message in enumerate(messages):
+        if not isinstance(message, dict):
+            return f"第 {index} 条消息不是对象"
+        if "content" not in message:
+            return f"第 {index} 条消息缺少 content"
+        role = message.get("role") or message.get("type")
+        if role is not None and role not in MESSAGE_TYPES:
+            return f"第 {index} 条消息的角色 {role!r} 不受支持"
+    return None
+
+
+def to_messages(item: Dict[str, Any]) -> List[BaseMessage]:
+    """
+    把批量输入转换为消息列表
+
+    Args:
+        item: 批量输入
+
+    Returns:
+        消息列表
+    """
+    if "messages" not in item:
+        return [HumanMessage(content=flatten_content(item["input"]))]
+    messages = []
+    for message in item["messages"]:
+        message_type = MESSAGE_TYPES.get(message.get("role") or message.get("type"), HumanMessage)
+        messages.append(message_type(content=flatten_content(message["content"])))
+    return messages
+
+
+class BatchCheckpoint:
+    """批量进度检查点（完成的结果逐行追加到 NDJSON 文件）"""
+
+    def __init__(self, path: str):
+        """
+        初始化检查点，读取已完成的输入
+
+        Args:
+            path: 检查点文件路径
+        """
+        self.path = path
+        self.completed: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 进程中断时最后一行可能不完整
+                        continue
+                    if result.get("status") == "ok":
+                        self.completed.add(str(result["id"]))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def record(self, result: Dict[str, Any]) -> None:
+        """
+        记录一个完成的结果（失败的输入不记录，下次重新运行）
+
+        Args:
+            result: 结果
+        """
+        if result["status"] != "ok":
+            return
+        self.file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.completed.add(result["id"])
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class BatchService:
+    """批量推理服务类"""
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        max_concurrency: int = 16,
+        max_retries: int = 3,
+        checkpoint_dir: str = "batch_checkpoints",
+    ):
+        """
+        初始化批量推理服务
+
+        Args:
+            concurrency: 默认并发数
+            max_concurrency: 并发上限
+            max_retries: 服务商限流时单个输入的最多重试次数
+            checkpoint_dir: 按 batch_id 保存检查点的目录
+        """
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.checkpoint_dir = checkpoint_dir
+        self.counters = {"batches": 0, "items": 0, "failed": 0, "skipped": 0, "retries": 0}
+        self.active = 0
+
+    def checkpoint_path(self, batch_id: str) -> str:
+        """batch_id 对应的检查点文件路径"""
+        safe_id = re.sub(r"[^\w.-]", "_", batch_id)
+        return os.path.join(self.checkpoint_dir, f"{safe_id}.ndjson")
+
+    async def run(
+        self,
+        items: List[Dict[str, Any]],
+        concurrency: Optional[int] = None,
+        batch_id: Optional[str] = None,
+        checkpoint_path: Optional[str] = None,
+        create_threads: bool = False,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        并发运行批量输入
+
+        Args:
+            items: 批量输入（parse_batch_lines 的结果）
+            concurrency: 并发数，未指定时使用默认值
+            batch_id: 批次ID（准入排队的公平单位；指定时在检查点目录中保存进度）
+            checkpoint_path: 检查点文件路径（优先于 batch_id 对应的路径），都未指定时不保存进度
+            create_threads: 是否为每个输入创建线程并保存对话
+
+        Yields:
+            按完成顺序的结果 {"type": "result", "id", "status", ...}，最后是 {"type": "summary", ...}
+        """
+        if checkpoint_path is None and batch_id is not None:
+            checkpoint_path = self.checkpoint_path(batch_id)
+        checkpoint = BatchCheckpoint(checkpoint_path) if checkpoint_path else None
+        batch_id = batch_id or str(uuid.uuid4())
+        concurrency = max(1, min(concurrency or self.concurrency, self.max_concurrency))
+
+        completed = checkpoint.completed if checkpoint is not None else set()
+        pending = [item for item in items if item["id"] not in completed]
+        skipped = len(items) - len(pending)
+        self.counters["batches"] += 1
+        self.counters["skipped"] += skipped
+        self.active += 1
+        print(f"📦 批量推理 {batch_id}: {len(pending)} 个输入, 并发 {concurrency}, 检查点跳过 {skipped} 个")
+
+        started = time.perf_counter()
+        results: asyncio.Queue = asyncio.Queue()
+        source = iter(pending)
+
+        async def worker() -> None:
+            # 每个工作协程依次取下一个输入，同时进行的输入数不超过并发数
+            for item in source:
+                result = await self._run_item(item, f"batch:{batch_id}", create_threads)
+                if checkpoint is not None:
+                    checkpoint.record(result)
+                await results.put(result)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(pending)))]
+        summary = {"ok": 0, "error": 0}
+        try:
+            for _ in range(len(pending)):
+                result = await self._next_result(results, workers)
+                summary[result["status"]] += 1
+                yield result
+        finally:
+            # 客户端断开时取消剩余的输入，已完成的结果都在检查点中
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if checkpoint is not None:
+                checkpoint.close()
+            self.active -= 1
+
+        yield {
+            "type": "summary",
+            "batch_id": batch_id,
+            "total": len(items),
+            "skipped": skipped,
+            **summary,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "checkpoint": checkpoint_path,
+        }
+
+    @staticmethod
+    async def _next_result(results: asyncio.Queue, workers: List[asyncio.Task]) -> Dict[str, Any]:
+        """
+        等待下一个结果；工作协程意外退出（结果不会再到达）时抛出异常，而不是一直等待队列
+
+        Args:
+            results: 结果队列
+            workers: 工作协程
+
+        Returns:
+            结果
+
+        Raises:
+            RuntimeError: 工作协程异常退出，或全部退出后仍缺少结果
+        """
+        if not results.empty():
+            return results.get_nowait()
+        getter = asyncio.ensure_future(results.get())
+        try:
+            while True:
+                alive = [task for task in workers if not task.done()]
+                for task in workers:
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        raise RuntimeError(f"批量工作协程异常退出: {task.exception()}") from task.exception()
+                if not alive:
+                    # 工作协程结束前放入的结果先取走
+                    await asyncio.sleep(0)
+                    if getter.done():
+                        return getter.result()
+                    raise RuntimeError("批量工作协程已全部退出，仍有输入没有结果")
+                await asyncio.wait([getter, *alive], return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    return getter.result()
+        finally:
+            getter.cancel()
+
+    async def _run_item(self, item: Dict[str, Any], queue_key: str, create_threads: bool) -> Dict[str, Any]:
+        """
+        运行单个输入（经过准入控制，服务商限流时等待后重试）
+
+        Args:
+            item: 批量输入
+            queue_key: 准入排队的 key
+            create_threads: 是否创建线程并保存对话
+
+        Returns:
+            结果
+        """
+        run_id = str(uuid.uuid4())
+        thread_id = (item.get("thread_id") or str(uuid.uuid4())) if create_threads else None
+        metrics = metrics_service.start_run(run_id, thread_id)
+        result: Dict[str, Any] = {"type": "result", "id": item["id"], "run_id": run_id}
+        if thread_id is not None:
+            result["thread_id"] = thread_id
+        self.counters["items"] += 1
+
+        retries = 0
+        try:
+            # 输入转换失败也只是这一个输入失败
+            messages = to_messages(item)
+            prompt_tokens = sum(count_message_tokens(message) for message in messages)
+            # 批量输入自带对话，不加载历史
+            metrics.mark_history_loaded()
+            while True:
+                ticket = admission_controller.enqueue(
+                    queue_key, prompt_tokens + admission_controller.expected_completion_tokens
+                )
+                try:
+                    async for _ in admission_controller.wait(ticket):
+                        pass
+                    metrics.mark_admitted()
+                    state = await graph_service.graph.ainvoke(
+                        {"messages": messages}, {"metadata": {"app_run_id": run_id}}
+                    )
+                    break
+                except AdmissionTimeout:
+                    # 批量任务不因排队超时失败，继续排队
+                    continue
+                except Exception as e:
+                    retry_after = rate_limit_retry_after(e)
+                    if retry_after is None or retries >= self.max_retries:
+                        raise
+                    # 暂停准入放行，重新排队时会等到限流结束
+                    retries += 1
+                    self.counters["retries"] += 1
+                    print(f"🚦 批量输入 {item['id']} 被限流，{retry_after:.0f}s 后重试（第 {retries} 次）")
+                    admission_controller.on_rate_limited(retry_after)
+                finally:
+                    admission_controller.release(ticket, metrics.total_tokens)
+
+            reply = state["messages"][-1]
+            metrics.record_usage(reply)
+            output = flatten_content(reply.content)
+            metrics.estimate_usage(prompt_tokens, count_text_tokens(output))
+            if thread_id is not None:
+                with metrics.db_time():
+                    self._persist(thread_id, messages, output)
+                metrics.mark_persisted()
+            result.update({"status": "ok", "output": output})
+        except Exception as e:
+            metrics.status = "error"
+            self.counters["failed"] += 1
+            print(f"❌ 批量输入 {item['id']} 失败: {e}")
+            result.update({"status": "error", "error": str(e)})
+        finally:
+            metrics_service.finish_run(metrics)
+
+        result["retries"] = retries
+        result["usage"] = {"prompt_tokens": metrics.prompt_tokens, "completion_tokens": metrics.completion_tokens}
+        result["latency_ms"] = metrics.to_dict()["total_ms"]
+        return result
+
+    @staticmethod
+    def _persist(thread_id: str, messages: List[BaseMessage], output: str) -> None:
+        """把输入和回复保存到线程"""
+        if not thread_service.thread_exists(thread_id):
+            thread_service.create_thread(thread_id)
+        for message in messages:
+            if message.type not in ("human", "ai"):
+                continue
+            thread_service.save_message(thread_id, str(uuid.uuid4()), message.type, flatten_content(message.content))
+        thread_service.save_message(thread_id, str(uuid.uuid4()), "ai", output)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取批量推理统计
+
+        Returns:
+            进行中的批次数和计数器
+        """
+        return {"active": self.active, **self.counters}
+
+
+# 全局批量推理服务实例
+batch_service = BatchService(
+    concurrency=settings.batch_concurrency,
+    max_concurrency=settings.batch_max_concurrency,
+    max_retries=settings.batch_max_retries,
+    checkpoint_dir=settings.batch_checkpoint_dir,
+)
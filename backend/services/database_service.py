@@ -4,9 +4,10 @@ SQLite 数据库服务模块
 import sqlite3
 import json
 from contextlib import contextmanager
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 import os
+import threading
 
 
 class DatabaseService:
@@ -20,6 +21,9 @@ class DatabaseService:
             db_path: 数据库文件路径
         """
         self.db_path = db_path
+        # 专用于 PRAGMA data_version 轮询的长连接（data_version 只对同一连接有意义）
+        self._watch_conn: Optional[sqlite3.Connection] = None
+        self._watch_lock = threading.Lock()
         self.init_db()
         print(f"✅ 数据库初始化完成: {db_path}")
     
@@ -73,14 +77,141 @@ class DatabaseService:
                 CREATE INDEX IF NOT EXISTS idx_messages_created_at 
                 ON messages(created_at)
             """)
+
+            # 创建线程版本表（多进程缓存一致性：任何写入都会递增对应线程的版本号）
+            # 删除线程时保留版本行并继续递增，避免同 ID 线程重建后版本号回退
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS thread_versions (
+                    thread_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            """)
+
+            # 创建线程摘要表（watermark_seq 为摘要已覆盖的消息条数）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS thread_summaries (
+                    thread_id TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    watermark_seq INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+
+            # 创建消息向量表（检索记忆使用，checksum 用于发现被编辑过的消息）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS message_embeddings (
+                    message_id TEXT PRIMARY KEY,
+                    thread_id TEXT NOT NULL,
+                    checksum INTEGER NOT NULL,
+                    vector BLOB NOT NULL
+                )
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_message_embeddings_thread_id
+                ON message_embeddings (thread_id)
+            """)
+
+            # 创建长文本分块结果表（按分块内容哈希寻址，后续追问直接复用）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS chunk_results (
+                    chunk_hash TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            """)
+
+            # 创建运行指标表（各阶段耗时为相对收到请求的毫秒数，用于按时间聚合延迟分布）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    thread_id TEXT,
+                    created_at TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    cache_source TEXT,
+                    history_ms REAL,
+                    queue_ms REAL,
+                    ttft_ms REAL,
+                    generation_ms REAL,
+                    persist_ms REAL,
+                    total_ms REAL,
+                    db_ms REAL,
+                    chunk_count INTEGER NOT NULL,
+                    tokens_per_second REAL,
+                    prompt_tokens INTEGER NOT NULL,
+                    cached_prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL
+                )
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_runs_created_at
+                ON runs (created_at)
+            """)
+
+    def _bump_version(self, cursor: sqlite3.Cursor, thread_id: str) -> int:
+        """
+        在当前事务内递增线程版本号
+
+        Args:
+            cursor: 当前事务的游标
+            thread_id: 线程ID
+
+        Returns:
+            递增后的版本号
+        """
+        cursor.execute("""
+            INSERT INTO thread_versions (thread_id, version) VALUES (?, 1)
+            ON CONFLICT(thread_id) DO UPDATE SET version = version + 1
+        """, (thread_id,))
+        cursor.execute("""
+            SELECT version FROM thread_versions WHERE thread_id = ?
+        """, (thread_id,))
+        return cursor.fetchone()["version"]
+
+    def data_version(self) -> int:
+        """
+        读取 PRAGMA data_version
+
+        其他连接（包括其他进程）每次提交写入后该值都会变化，
+        值不变说明自上次读取以来数据库没有任何写入，缓存无需逐线程校验。
+
+        Returns:
+            当前 data_version
+        """
+        with self._watch_lock:
+            if self._watch_conn is None:
+                self._watch_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            return self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get_thread_version(self, thread_id: str) -> int:
+        """
+        获取线程版本号
+
+        Args:
+            thread_id: 线程ID
+
+        Returns:
+            版本号，从未写入过的线程返回 0
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT version FROM thread_versions WHERE thread_id = ?
+            """, (thread_id,))
+            row = cursor.fetchone()
+            return row["version"] if row else 0
     
-    def save_thread(self, thread_id: str, created_at: str = None) -> None:
+    def save_thread(self, thread_id: str, created_at: str = None) -> int:
         """
         保存线程到数据库
         
         Args:
             thread_id: 线程ID
             created_at: 创建时间（ISO格式字符串）
+
+        Returns:
+            写入后的线程版本号
         """
         if created_at is None:
             created_at = datetime.now().isoformat()
@@ -93,8 +224,10 @@ class DatabaseService:
                 INSERT OR REPLACE INTO threads (thread_id, created_at, updated_at)
                 VALUES (?, ?, ?)
             """, (thread_id, created_at, datetime.now().isoformat()))
+
+            return self._bump_version(cursor, thread_id)
     
-    def save_message(self, thread_id: str, msg_id: str, msg_type: str, content: str) -> None:
+    def save_message(self, thread_id: str, msg_id: str, msg_type: str, content: str) -> int:
         """
         保存消息到数据库
         
@@ -103,6 +236,9 @@ class DatabaseService:
             msg_id: 消息ID
             msg_type: 消息类型（human/ai）
             content: 消息内容
+
+        Returns:
+            写入后的线程版本号
         """
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -116,7 +252,55 @@ class DatabaseService:
             cursor.execute("""
                 UPDATE threads SET updated_at = ? WHERE thread_id = ?
             """, (datetime.now().isoformat(), thread_id))
+
+            return self._bump_version(cursor, thread_id)
     
+    def message_exists(self, msg_id: str) -> bool:
+        """
+        检查消息是否已存在（用于识别对已有消息的修改）
+
+        Args:
+            msg_id: 消息ID
+
+        Returns:
+            消息是否存在
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT 1 FROM messages WHERE id = ? LIMIT 1
+            """, (msg_id,))
+
+            return cursor.fetchone() is not None
+
+    def load_thread_index(self) -> List[Dict[str, Any]]:
+        """
+        加载所有线程的基本信息和版本号（不含消息）
+
+        Returns:
+            线程信息列表，按更新时间倒序
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT t.*, COALESCE(v.version, 0) AS version
+                FROM threads t
+                LEFT JOIN thread_versions v ON v.thread_id = t.thread_id
+                ORDER BY t.updated_at DESC
+            """)
+
+            return [
+                {
+                    "thread_id": row["thread_id"],
+                    "created_at": row["created_at"],
+                    "updated_at": row["updated_at"],
+                    "version": row["version"],
+                }
+                for row in cursor.fetchall()
+            ]
+
     def load_thread(self, thread_id: str) -> Optional[Dict[str, Any]]:
         """
         从数据库加载线程
@@ -129,6 +313,13 @@ class DatabaseService:
         """
         with self.get_connection() as conn:
             cursor = conn.cursor()
+
+            # 先读版本号：若读取期间有其他进程写入，缓存拿到的是偏旧的版本号，
+            # 下次校验时会触发重新加载，而不会把新数据标记成旧版本
+            cursor.execute("""
+                SELECT version FROM thread_versions WHERE thread_id = ?
+            """, (thread_id,))
+            version_row = cursor.fetchone()
             
             # 查询线程信息
             cursor.execute("""
@@ -158,52 +349,10 @@ class DatabaseService:
                 "thread_id": thread_row["thread_id"],
                 "created_at": thread_row["created_at"],
                 "updated_at": thread_row["updated_at"],
-                "messages": messages
+                "messages": messages,
+                "version": version_row["version"] if version_row else 0,
             }
     
-    def load_all_threads(self) -> List[Dict[str, Any]]:
-        """
-        从数据库加载所有线程
-        
-        Returns:
-            线程数据列表
-        """
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # 查询所有线程
-            cursor.execute("""
-                SELECT * FROM threads ORDER BY updated_at DESC
-            """)
-            
-            threads = []
-            for thread_row in cursor.fetchall():
-                thread_id = thread_row["thread_id"]
-                
-                # 查询该线程的所有消息
-                cursor.execute("""
-                    SELECT * FROM messages 
-                    WHERE thread_id = ? 
-                    ORDER BY created_at ASC
-                """, (thread_id,))
-                
-                messages = []
-                for msg_row in cursor.fetchall():
-                    messages.append({
-                        "id": msg_row["id"],
-                        "type": msg_row["type"],
-                        "content": msg_row["content"]
-                    })
-                
-                threads.append({
-                    "thread_id": thread_id,
-                    "created_at": thread_row["created_at"],
-                    "updated_at": thread_row["updated_at"],
-                    "messages": messages
-                })
-            
-            return threads
-    
     def delete_thread(self, thread_id: str) -> bool:
         """
         从数据库删除线程
@@ -221,9 +370,184 @@ class DatabaseService:
             cursor.execute("""
                 DELETE FROM threads WHERE thread_id = ?
             """, (thread_id,))
+            deleted = cursor.rowcount > 0
+
+            cursor.execute("""
+                DELETE FROM thread_summaries WHERE thread_id = ?
+            """, (thread_id,))
+
+            cursor.execute("""
+                DELETE FROM message_embeddings WHERE thread_id = ?
+            """, (thread_id,))
+
+            # 递增版本号，通知其他进程的缓存失效
+            if deleted:
+                self._bump_version(cursor, thread_id)
             
-            return cursor.rowcount > 0
+            return deleted
     
+    def save_summary(self, thread_id: str, summary: str, watermark_seq: int) -> None:
+        """
+        保存线程摘要（只会让水位线前进，避免旧任务覆盖新摘要）
+
+        Args:
+            thread_id: 线程ID
+            summary: 摘要内容
+            watermark_seq: 摘要覆盖的消息条数
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                INSERT INTO thread_summaries (thread_id, summary, watermark_seq, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(thread_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    watermark_seq = excluded.watermark_seq,
+                    updated_at = excluded.updated_at
+                WHERE excluded.watermark_seq > thread_summaries.watermark_seq
+            """, (thread_id, summary, watermark_seq, datetime.now().isoformat()))
+
+    def load_summary(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """
+        加载线程摘要
+
+        Args:
+            thread_id: 线程ID
+
+        Returns:
+            {"summary", "watermark_seq"}，没有摘要时返回 None
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT summary, watermark_seq FROM thread_summaries WHERE thread_id = ?
+            """, (thread_id,))
+
+            row = cursor.fetchone()
+            if not row:
+                return None
+            return {"summary": row["summary"], "watermark_seq": row["watermark_seq"]}
+
+    def save_embeddings(self, thread_id: str, rows: List[Tuple[str, int, bytes]]) -> None:
+        """
+        批量保存消息向量
+
+        Args:
+            thread_id: 线程ID
+            rows: (消息ID, 内容校验和, 向量字节) 列表
+        """
+        if not rows:
+            return
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.executemany("""
+                INSERT OR REPLACE INTO message_embeddings (message_id, thread_id, checksum, vector)
+                VALUES (?, ?, ?, ?)
+            """, [(msg_id, thread_id, checksum, vector) for msg_id, checksum, vector in rows])
+
+    def load_embeddings(self, thread_id: str) -> Dict[str, Tuple[int, bytes]]:
+        """
+        加载线程的全部消息向量
+
+        Args:
+            thread_id: 线程ID
+
+        Returns:
+            {消息ID: (内容校验和, 向量字节)}
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT message_id, checksum, vector FROM message_embeddings WHERE thread_id = ?
+            """, (thread_id,))
+
+            return {row["message_id"]: (row["checksum"], row["vector"]) for row in cursor.fetchall()}
+
+    def save_chunk_result(self, chunk_hash: str, result: str) -> None:
+        """
+        保存分块处理结果
+
+        Args:
+            chunk_hash: 分块内容哈希
+            result: 处理结果
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                INSERT OR REPLACE INTO chunk_results (chunk_hash, result, created_at)
+                VALUES (?, ?, ?)
+            """, (chunk_hash, result, datetime.now().isoformat()))
+
+    def load_chunk_results(self, chunk_hashes: List[str]) -> Dict[str, str]:
+        """
+        批量加载分块处理结果
+
+        Args:
+            chunk_hashes: 分块内容哈希列表
+
+        Returns:
+            {分块哈希: 处理结果}，只包含已有结果的分块
+        """
+        if not chunk_hashes:
+            return {}
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            placeholders = ",".join("?" * len(chunk_hashes))
+            cursor.execute(f"""
+                SELECT chunk_hash, result FROM chunk_results WHERE chunk_hash IN ({placeholders})
+            """, chunk_hashes)
+
+            return {row["chunk_hash"]: row["result"] for row in cursor.fetchall()}
+
+    RUN_COLUMNS = (
+        "run_id", "thread_id", "created_at", "status", "cache_source", "history_ms", "queue_ms", "ttft_ms",
+        "generation_ms", "persist_ms", "total_ms", "db_ms", "chunk_count", "tokens_per_second",
+        "prompt_tokens", "cached_prompt_tokens", "completion_tokens",
+    )
+
+    def save_run(self, run: Dict[str, Any]) -> None:
+        """
+        保存运行指标
+
+        Args:
+            run: 运行指标（RunMetrics.to_dict 的结果）
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(f"""
+                INSERT OR REPLACE INTO runs ({", ".join(self.RUN_COLUMNS)})
+                VALUES ({", ".join("?" * len(self.RUN_COLUMNS))})
+            """, [run.get(column) for column in self.RUN_COLUMNS])
+
+    def load_runs(self, since: Optional[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+        """
+        加载运行指标（按时间倒序）
+
+        Args:
+            since: 只加载该时间（ISO 格式）之后的运行
+            limit: 最多加载条数
+
+        Returns:
+            运行指标列表
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT * FROM runs WHERE created_at >= ? ORDER BY created_at DESC LIMIT ?
+            """, (since or "", limit))
+
+            return [dict(row) for row in cursor.fetchall()]
+
     def thread_exists(self, thread_id: str) -> bool:
         """
         检查线程是否存在
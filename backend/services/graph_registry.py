@@ -0,0 +1,276 @@
+"""
+多助手图注册表模块
+按 assistant_id 路由到不同的图。每个图在第一次使用时才导入模块并编译（记录冷启动耗时），
+所有图共用 llm_service 的模型客户端、同一个 SQLite 检查点和工具执行器；进程内存超过上限或加载的图过多时，
+卸载最久未用且空闲的图，下次使用时重新编译
+"""
+import asyncio
+import gc
+import importlib
+import importlib.util
+import inspect
+import os
+import sqlite3
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Union
+
+from ..config import settings
+from ..utils.checkpoint import AsyncSqliteCheckpointer
+from .llm_service import llm_service
+from .tool_executor import tool_executor
+
+
+# 项目根目录（"./文件.py:函数" 形式的路径相对于这里，与 langgraph.json 一致）
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def current_rss_mb() -> Optional[float]:
+    """
+    当前进程的常驻内存（MB）
+
+    Returns:
+        常驻内存，无法读取时返回 None
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def load_factory(target: str) -> Callable:
+    """
+    按 "模块路径:函数" 或 "./文件.py:函数" 导入图工厂函数
+
+    Args:
+        target: 工厂函数位置
+
+    Returns:
+        工厂函数
+
+    Raises:
+        ValueError: 格式不正确
+    """
+    path, sep, attr = target.rpartition(":")
+    if not sep or not path or not attr:
+        raise ValueError(f"图工厂的格式应为 '模块:函数' 或 './文件.py:函数': {target}")
+    if path.endswith(".py"):
+        file_path = os.path.normpath(os.path.join(PROJECT_ROOT, path))
+        module_name = "assistant_graph_" + os.path.splitext(os.path.basename(file_path))[0]
+        module = sys.modules.get(module_name)
+        if module is None:
+            spec = importlib.util.spec_from_file_location(module_name, file_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            sys.modules[module_name] = module
+    else:
+        module = importlib.import_module(path)
+    return getattr(module, attr)
+
+
+class GraphEntry:
+    """注册表中的一个助手"""
+
+    def __init__(self, assistant_id: str, factory: Union[str, Callable]):
+        self.assistant_id = assistant_id
+        self.factory = factory
+        self.graph: Any = None
+        self.lock = asyncio.Lock()
+        self.active = 0  # 正在使用该图的运行数
+        self.last_used = 0.0
+        self.loads = 0
+        self.unloads = 0
+        self.cold_start_ms: Optional[float] = None  # 最近一次编译耗时
+        self.total_cold_start_ms = 0.0
+
+
+class GraphRegistry:
+    """编译好的图的注册表"""
+
+    def __init__(
+        self,
+        graphs: Dict[str, Union[str, Callable]],
+        db_path: str = "checkpoints.sqlite",
+        memory_limit_mb: int = 0,
+        idle_seconds: float = 300.0,
+        max_loaded: int = 0,
+    ):
+        """
+        初始化注册表（只登记，不导入和编译）
+
+        Args:
+            graphs: assistant_id -> 图工厂（函数或 "模块:函数" / "./文件.py:函数"），工厂接收 llm 和 checkpointer，
+                声明了 tool_node 参数的工厂还会收到工具执行器的 tool_node（工具列表 -> 工具节点）
+            db_path: 共享检查点的 SQLite 数据库路径
+            memory_limit_mb: 进程内存超过该值时卸载空闲的图，0 表示不限制
+            idle_seconds: 内存压力下只卸载空闲超过该时间的图
+            max_loaded: 同时加载的图数量上限，0 表示不限制
+        """
+        self.db_path = db_path
+        self.memory_limit_mb = memory_limit_mb
+        self.idle_seconds = idle_seconds
+        self.max_loaded = max_loaded
+        self.entries: Dict[str, GraphEntry] = {}
+        self._checkpointer: Optional[AsyncSqliteCheckpointer] = None
+        for assistant_id, factory in graphs.items():
+            self.register(assistant_id, factory)
+
+    def register(self, assistant_id: str, factory: Union[str, Callable]) -> None:
+        """
+        登记一个助手（已加载的同名图会被替换）
+
+        Args:
+            assistant_id: 助手ID
+            factory: 图工厂
+        """
+        self.entries[assistant_id] = GraphEntry(assistant_id, factory)
+
+    def __contains__(self, assistant_id: str) -> bool:
+        return assistant_id in self.entries
+
+    @property
+    def checkpointer(self) -> AsyncSqliteCheckpointer:
+        """所有图共用的检查点（第一次编译图时创建）"""
+        if self._checkpointer is None:
+            # check_same_thread=False 允许多线程访问（SqliteSaver 内部有锁保证线程安全）
+            self._checkpointer = AsyncSqliteCheckpointer(sqlite3.connect(self.db_path, check_same_thread=False))
+        return self._checkpointer
+
+    async def get(self, assistant_id: str) -> Any:
+        """
+        获取编译好的图（未加载时导入并编译）
+
+        Args:
+            assistant_id: 助手ID
+
+        Returns:
+            编译好的图
+
+        Raises:
+            KeyError: 助手未登记
+        """
+        entry = self.entries[assistant_id]
+        if entry.graph is None:
+            async with entry.lock:
+                # 并发的首次请求只编译一次
+                if entry.graph is None:
+                    await self._load(entry)
+        entry.last_used = time.monotonic()
+        return entry.graph
+
+    @asynccontextmanager
+    async def acquire(self, assistant_id: str) -> AsyncIterator[Any]:
+        """
+        在一次运行期间使用图（使用中的图不会被卸载）
+
+        Args:
+            assistant_id: 助手ID
+
+        Yields:
+            编译好的图
+        """
+        entry = self.entries[assistant_id]
+        entry.active += 1
+        try:
+            yield await self.get(assistant_id)
+        finally:
+            entry.active -= 1
+            entry.last_used = time.monotonic()
+            self.unload_idle()
+
+    async def _load(self, entry: GraphEntry) -> None:
+        """导入工厂并编译图（在线程池中执行，不阻塞事件循环）"""
+        started = time.perf_counter()
+        factory = entry.factory
+        llm = llm_service.get_llm()
+        checkpointer = self.checkpointer
+
+        def build():
+            resolved = load_factory(factory) if isinstance(factory, str) else factory
+            kwargs = {"llm": llm, "checkpointer": checkpointer}
+            if "tool_node" in inspect.signature(resolved).parameters:
+                kwargs["tool_node"] = tool_executor.tool_node
+            return resolved(**kwargs)
+
+        # 先腾出空间再加载
+        self.unload_idle(reserve=1)
+        entry.graph = await asyncio.to_thread(build)
+        entry.cold_start_ms = round((time.perf_counter() - started) * 1000, 1)
+        entry.total_cold_start_ms += entry.cold_start_ms
+        entry.loads += 1
+        print(f"🧊 助手 {entry.assistant_id} 冷启动: {entry.cold_start_ms}ms（第 {entry.loads} 次加载）")
+
+    def unload_idle(self, reserve: int = 0) -> int:
+        """
+        按数量上限和内存压力卸载最久未用的空闲图（没有进行中的运行）
+
+        Args:
+            reserve: 为即将加载的图预留的数量
+
+        Returns:
+            卸载的图数量
+        """
+        now = time.monotonic()
+        candidates = sorted(
+            (entry for entry in self.entries.values() if entry.graph is not None and entry.active == 0),
+            key=lambda entry: entry.last_used,
+        )
+        loaded = sum(entry.graph is not None for entry in self.entries.values())
+        unloaded = 0
+        for entry in candidates:
+            over_count = self.max_loaded > 0 and loaded + reserve > self.max_loaded
+            # 内存压力只卸载空闲足够久的图，避免刚用过的图反复编译
+            rss = None
+            if not over_count and self.memory_limit_mb > 0 and now - entry.last_used >= self.idle_seconds:
+                rss = current_rss_mb()
+            over_memory = rss is not None and rss > self.memory_limit_mb
+            if not over_count and not over_memory:
+                break
+            entry.graph = None
+            entry.unloads += 1
+            loaded -= 1
+            unloaded += 1
+            # 编译好的图之间有循环引用，立即回收才能让内存回落，下一轮判断才准确
+            gc.collect()
+            reason = "数量上限" if over_count else f"内存 {rss:.0f}MB"
+            print(f"🧹 卸载空闲的助手图 {entry.assistant_id}（{reason}）")
+        return unloaded
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取注册表统计
+
+        Returns:
+            每个助手的加载状态、冷启动耗时和使用情况
+        """
+        now = time.monotonic()
+        rss = current_rss_mb()
+        return {
+            "rss_mb": round(rss, 1) if rss is not None else None,
+            "memory_limit_mb": self.memory_limit_mb,
+            "assistants": {
+                assistant_id: {
+                    "loaded": entry.graph is not None,
+                    "active": entry.active,
+                    "loads": entry.loads,
+                    "unloads": entry.unloads,
+                    "cold_start_ms": entry.cold_start_ms,
+                    "avg_cold_start_ms": round(entry.total_cold_start_ms / entry.loads, 1) if entry.loads else None,
+                    "idle_seconds": round(now - entry.last_used, 1) if entry.last_used else None,
+                }
+                for assistant_id, entry in self.entries.items()
+            },
+        }
+
+
+# 全局图注册表实例
+graph_registry = GraphRegistry(
+    settings.assistant_graphs,
+    db_path=settings.sqlite_db_path,
+    memory_limit_mb=settings.graph_registry_memory_limit_mb,
+    idle_seconds=settings.graph_registry_idle_seconds,
+    max_loaded=settings.graph_registry_max_loaded,
+)
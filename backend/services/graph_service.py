@@ -1,17 +1,30 @@
 """
 LangGraph 服务模块
 """
+import asyncio
 import uuid
 import json
 from typing import AsyncGenerator, Dict, Any
 from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages.ai import add_ai_message_chunks
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.runtime import Runtime
 
-from ..models.state import State
+from ..models.state import State, ChatContext
 from .llm_service import llm_service
 from .thread_service import thread_service
+from .response_cache import response_cache
+from .semantic_cache import semantic_cache
+from .metrics_service import metrics_service, RunMetrics
+from .summary_service import summary_service
+from .retrieval_memory import retrieval_memory
+from .map_reduce import map_reduce_service, RunCancelled
+from .admission import admission_controller, AdmissionTimeout, rate_limit_retry_after
+from .single_flight import single_flight, flight_key, is_duplicate_submit
+from .graph_registry import graph_registry
+from ..utils.streaming import astream_filtered
+from ..utils.tokens import count_text_tokens, flatten_content
 
 
 class GraphService:
@@ -19,13 +32,21 @@ class GraphService:
     
     def __init__(self):
         """初始化 Graph 服务"""
+        # 在线运行和批量推理共用：prompt 每轮由线程历史重新组装，图不保存检查点
         self.graph = self._create_graph()
+        # 进行中的运行：run_id -> 取消信号
+        self.cancel_events: Dict[str, asyncio.Event] = {}
         print("✅ Graph 服务初始化完成")
     
     def _create_graph(self):
-        """创建 LangGraph"""
+        """
+        创建 LangGraph
+
+        对话历史由 thread_service 持久化并在每轮组装成 prompt，不使用检查点：
+        检查点中的状态不会被读取，只会在每个 worker 的内存中无限增长。
+        """
         # 创建图
-        workflow = StateGraph(State)
+        workflow = StateGraph(State, context_schema=ChatContext)
         
         # 添加聊天节点
         workflow.add_node("chatbot", self._chatbot_node)
@@ -34,38 +55,154 @@ class GraphService:
         workflow.add_edge(START, "chatbot")
         workflow.add_edge("chatbot", END)
         
-        # 编译图（使用内存检查点）
-        memory = MemorySaver()
-        graph = workflow.compile(checkpointer=memory)
-        
-        return graph
+        return workflow.compile()
     
-    def _chatbot_node(self, state: State, config: RunnableConfig) -> Dict[str, Any]:
+    async def _chatbot_node(
+        self,
+        state: State,
+        config: RunnableConfig,
+        runtime: Runtime[ChatContext],
+    ) -> Dict[str, Any]:
         """
         聊天机器人节点
-        
+
+        流式调用模型，分块经 stream writer 进入图的 custom 流式模式（不经过 messages 模式的回调）；
+        全部分块在结束时合并一次写入状态。
+
         Args:
             state: 当前状态
             config: 运行配置
-            
+            runtime: 运行时上下文（带有组装好的 prompt 时直接使用）
+
         Returns:
             更新后的状态
         """
-        messages = state["messages"]
-        print(f"🤖 Chatbot node called with {len(messages)} messages")
-        
-        # 调用 LLM
-        llm = llm_service.get_llm()
-        response = llm.invoke(messages)
-        
-        return {"messages": [response]}
-    
+        context = runtime.context
+        if context is not None and context.prompt is not None:
+            messages = context.prompt
+        else:
+            messages, _ = llm_service.get_context_assembler().assemble(state["messages"])
+        print(f"🤖 Chatbot node called with {len(state['messages'])} messages")
+
+        # 传入 config 让模型调用关联到本次运行；逐个相加会为每个分块重建一次合并消息，结束时一次合并
+        writer = runtime.stream_writer
+        metrics = context.metrics if context is not None else None
+        chunks = []
+        async for chunk in llm_service.get_llm().astream(messages, config):
+            if metrics is not None:
+                metrics.record_usage(chunk)
+            writer(chunk)
+            chunks.append(chunk)
+
+        return {"messages": [add_ai_message_chunks(*chunks) if chunks else AIMessage(content="")]}
+
+    def cancel_run(self, run_id: str) -> bool:
+        """
+        取消进行中的运行
+
+        Args:
+            run_id: 运行ID
+
+        Returns:
+            运行是否存在
+        """
+        event = self.cancel_events.get(run_id)
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    async def _stream_graph(
+        self,
+        user_message: str | None,
+        prompt: list,
+        thread_id: str,
+        run_id: str,
+        metrics: RunMetrics,
+    ) -> AsyncGenerator[str, None]:
+        """
+        通过编译好的图流式生成（custom 流式模式只转发节点写出的模型分块，不序列化整个状态）
+
+        Args:
+            user_message: 本轮的用户消息（写入图状态）
+            prompt: 发送给模型的消息（上下文组装的结果）
+            thread_id: 线程ID（写入 metadata 用于追踪）
+            run_id: 运行ID
+            metrics: 运行指标（记录服务商返回的用量）
+
+        Yields:
+            非空的文本分块
+        """
+        # 运行ID只放在 metadata 中用于追踪：configurable 中的 run_id 会被 LangGraph 当作运行标识，重复时不再产出分块
+        config = {"metadata": {"thread_id": thread_id, "app_run_id": run_id}}
+        new_messages = [HumanMessage(content=user_message)] if user_message is not None else []
+        async for chunk in self.graph.astream(
+            {"messages": new_messages},
+            config,
+            stream_mode="custom",
+            context=ChatContext(prompt=prompt, metrics=metrics),
+        ):
+            if chunk.content:
+                yield str(chunk.content)
+
+    async def _admitted(
+        self,
+        token_stream: AsyncGenerator,
+        queue_key: str,
+        prompt_tokens: int,
+        metrics: RunMetrics,
+        cancel_event: asyncio.Event = None,
+        slots: int = 1,
+        requests: int = 1,
+    ) -> AsyncGenerator:
+        """
+        经过准入控制后再开始生成，超出并发或额度时排队并产出排队进度事件
+
+        Args:
+            token_stream: 生成流（放行后才开始读取）
+            queue_key: 公平排队的 key
+            prompt_tokens: prompt token 数
+            metrics: 运行指标（结束时按实际用量修正额度）
+            cancel_event: 取消信号
+            slots: 占用的并发名额
+            requests: 计入 RPM 的请求数
+
+        Yields:
+            排队进度事件（dict），之后是生成流的内容
+        """
+        ticket = admission_controller.enqueue(
+            queue_key, prompt_tokens + admission_controller.expected_completion_tokens, slots, requests
+        )
+        try:
+            async for update in admission_controller.wait(ticket, cancel_event):
+                yield update
+            if cancel_event is not None and cancel_event.is_set():
+                raise RunCancelled()
+            metrics.mark_admitted()
+
+            async for item in token_stream:
+                yield item
+        except Exception as e:
+            # 服务商限流：暂停放行后续请求
+            retry_after = rate_limit_retry_after(e)
+            if retry_after is not None:
+                print(f"🚦 LLM 服务商限流，{retry_after:.0f}s 后重试: {e}")
+                admission_controller.on_rate_limited(retry_after)
+            raise
+        finally:
+            admission_controller.release(ticket, metrics.total_tokens)
+            await token_stream.aclose()
+
     async def stream_response(
         self,
         input_messages: list,
         thread_id: str,
-        stream_mode: list = None
-    ) -> AsyncGenerator[str, None]:
+        stream_mode: list = None,
+        use_cache: bool = True,
+        user_id: str = None,
+        received_at: float = None,
+        include_metrics: bool = False,
+    ) -> AsyncGenerator[str | bytes, None]:
         """
         流式处理响应
 
@@ -73,6 +210,10 @@ class GraphService:
             input_messages: 输入消息列表
             thread_id: 线程ID
             stream_mode: 流式模式列表
+            use_cache: 是否允许使用响应缓存（线程/助手级别的关闭开关）
+            user_id: 用户ID（准入排队的公平单位，未提供时按线程）
+            received_at: 收到请求的时间（perf_counter），运行指标从这里开始计时
+            include_metrics: 是否在结束前发送包含运行指标的 metadata 事件
 
         Yields:
             SSE 格式的数据流
@@ -82,6 +223,9 @@ class GraphService:
 
         # 生成 run_id
         run_id = str(uuid.uuid4())
+        cancel_event = asyncio.Event()
+        self.cancel_events[run_id] = cancel_event
+        metrics = metrics_service.start_run(run_id, thread_id, received_at)
         print(f"🚀 开始流式处理，线程ID: {thread_id}, Run ID: {run_id}")
 
         # 发送元数据事件
@@ -89,100 +233,426 @@ class GraphService:
         yield f"data: {json.dumps({'run_id': run_id, 'thread_id': thread_id})}\n\n"
         
         # 加载线程历史
-        thread = thread_service.get_thread(thread_id)
-        if not thread:
-            # 线程不存在，创建新线程
-            thread_service.create_thread(thread_id)
+        with metrics.db_time():
             thread = thread_service.get_thread(thread_id)
+            if not thread:
+                # 线程不存在，创建新线程
+                thread_service.create_thread(thread_id)
+                thread = thread_service.get_thread(thread_id)
 
-        # 构建完整的对话历史
-        messages = []
-        for msg in thread["messages"]:
-            if msg["type"] == "human":
-                messages.append(HumanMessage(content=msg["content"], id=msg.get("id")))
-            elif msg["type"] == "ai":
-                messages.append(AIMessage(content=msg["content"], id=msg.get("id")))
-
-        # 添加新的用户消息
         user_message = None
         for msg in input_messages:
             if msg.get("role") == "user":
-                content = msg["content"]
-                if isinstance(content, list):
-                    # 处理复杂内容
-                    text_parts = [item.get("text", "") for item in content if item.get("type") == "text"]
-                    content = " ".join(text_parts)
-                user_message = content
-                user_msg_id = str(uuid.uuid4())
-                messages.append(HumanMessage(content=content, id=user_msg_id))
-
-                # 保存用户消息到数据库
-                thread_service.save_message(thread_id, user_msg_id, "human", content)
+                user_message = flatten_content(msg["content"])
                 break
 
-        print(f"📚 对话历史长度: {len(messages)} 条消息")
-        
-        # 配置
-        config = {
-            "configurable": {
-                "thread_id": thread_id,
-                "run_id": run_id,
-            }
-        }
+        # 同一对话已有生成在进行时（前端重试、连点发送），直接订阅它的输出，不再调用模型
+        # （合并键由保存新消息之前的对话滚动哈希和新消息计算，只哈希新消息）
+        flight = None
+        flight_id = None
+        duplicate_submit = False
+        if single_flight.enabled:
+            with metrics.db_time():
+                digest = thread_service.get_view(thread_id, "digest")
+            flight_id = flight_key(digest, user_message, llm_service.get_params())
+            if user_message is not None:
+                flight = single_flight.get(flight_id)
+                # 同一线程中还没有回复的相同消息不再重复保存
+                duplicate_submit = (
+                    flight is not None and thread_id in flight.message_ids and is_duplicate_submit(digest, user_message)
+                )
+        coalesced = flight is not None
+
+        # 添加新的用户消息（保存后会增量追加到预构建历史中）
+        with metrics.db_time():
+            if user_message is not None and not duplicate_submit:
+                thread_service.save_message(thread_id, str(uuid.uuid4()), "human", user_message)
+
+            # 取出预构建的对话历史（只转换新增消息，不再每轮重建）
+            history = thread_service.get_prepared_history(thread_id)
+        metrics.mark_history_loaded()
+        print(f"📚 对话历史长度: {len(history)} 条消息, 约 {history.total_tokens} tokens")
+
+        # 超长的用户消息走 Map-Reduce 子图，不直接发送给模型
+        document = None
+        if user_message is not None and not coalesced and map_reduce_service.should_split(history.token_counts[-1]):
+            document = user_message
+            print(f"📄 超长输入（约 {history.token_counts[-1]} tokens），使用 Map-Reduce 处理")
+
+        # 已有摘要时用 摘要 + 最近窗口 替代完整历史，历史中处理过的长文本替换为要点
+        context_messages, context_counts = summary_service.build_context(thread_id, history)
+        context_messages, context_counts = map_reduce_service.condense(context_messages, context_counts)
+        assembler = llm_service.get_context_assembler()
+        if coalesced:
+            # 合并的请求不调用模型，不需要组装上下文
+            messages, prompt_tokens = [], 0
+        elif document is not None:
+            # 只组装之前的对话，为分块要点预留预算
+            messages, prompt_tokens = assembler.assemble(
+                context_messages[:-1], context_counts[:-1],
+                budget=assembler.budget - map_reduce_service.reserve_tokens,
+            )
+        else:
+            # 启用检索记忆时先为召回内容预留预算，再把窗口之外的相关早期消息补回来
+            messages, prompt_tokens = assembler.assemble(
+                context_messages, context_counts, budget=assembler.budget - retrieval_memory.reserve_tokens
+            )
+            messages, prompt_tokens = await retrieval_memory.inject(
+                thread_id, history, messages, prompt_tokens, assembler.budget
+            )
         
         # 流式处理
         try:
-            chunk_count = 0
             ai_response_content = ""
             ai_msg_id = str(uuid.uuid4())
 
-            # 使用 LLM 直接流式生成（不使用 graph）
-            llm = llm_service.get_llm()
+            # 查询响应缓存
+            cache_key = None
+            cached_chunks = None
+            if use_cache and response_cache.enabled and document is None and not coalesced:
+                cache_key = response_cache.make_key(messages, llm_service.get_params())
+                cached_chunks = response_cache.get(cache_key)
 
-            print(f"🔄 开始流式生成回复...")
-            async for chunk in llm.astream(messages):
-                if hasattr(chunk, 'content') and chunk.content:
-                    content = str(chunk.content) if chunk.content else ""
-                    ai_response_content += content
-                    chunk_count += 1
+            # 精确匹配未命中时，首轮问题再做语义匹配（有上下文的问题答案依赖历史，不做语义复用）
+            semantic_question = None
+            if (
+                cached_chunks is None and use_cache and semantic_cache.enabled
+                and len(history) == 1 and document is None and not coalesced
+            ):
+                semantic_question = user_message
+                semantic_hit = await semantic_cache.alookup(semantic_question)
+                if semantic_hit is not None:
+                    cached_chunks, score = semantic_hit
+                    metrics.cache_source = "semantic_cache"
+                    print(f"🧭 命中语义缓存，相似度 {score:.3f}")
+            elif cached_chunks is not None:
+                metrics.cache_source = "response_cache"
 
-                    # 发送流式消息事件
-                    if "messages" in stream_mode:
-                        message_data = [{
-                            "id": ai_msg_id,
-                            "type": "ai",
-                            "content": ai_response_content
-                        }]
-                        yield f"event: messages/partial\n"
-                        yield f"data: {json.dumps(message_data)}\n\n"
+            # 调用模型前都经过准入控制，超出并发或额度时排队，排队进度作为 custom 事件发送
+            queue_key = user_id or thread_id
+            if coalesced:
+                print(f"🔗 合并到进行中的相同生成")
+                metrics.cache_source = "single_flight"
+                ai_msg_id = flight.message_id(thread_id, ai_msg_id)
+                token_stream = flight.subscribe(cancel_event)
+            elif cached_chunks is not None:
+                print(f"🎯 命中缓存，回放 {len(cached_chunks)} 个分块")
+                token_stream = response_cache.replay(cached_chunks)
+            elif document is not None:
+                # 按原文 + 各分块要点的预算准入，Map 阶段并行的分块调用占用相应的并发名额
+                run_tokens, slots, requests = map_reduce_service.admission(history.token_counts[-1], prompt_tokens)
+                token_stream = self._admitted(
+                    map_reduce_service.astream(document, messages, metrics, cancel_event),
+                    queue_key, run_tokens, metrics, cancel_event, slots, requests,
+                )
+            else:
+                # 通过编译好的图流式生成，生成在独立任务中运行，相同的请求可以订阅同一条输出
+                print(f"🔄 开始流式生成回复...")
+                flight = single_flight.start(
+                    flight_id,
+                    self._admitted(
+                        self._stream_graph(user_message, messages, thread_id, run_id, metrics),
+                        queue_key, prompt_tokens, metrics,
+                    ),
+                )
+                ai_msg_id = flight.message_id(thread_id, ai_msg_id)
+                token_stream = flight.subscribe(cancel_event)
+
+            response_chunks = []
+            cancelled = False
+            async for content in token_stream:
+                # 进度事件（排队位置、Map-Reduce 进度）
+                if isinstance(content, dict):
+                    yield f"event: custom\n"
+                    yield f"data: {json.dumps(content)}\n\n"
+                    continue
+
+                if cancel_event.is_set():
+                    cancelled = True
+                    break
+
+                metrics.mark_token()
+                ai_response_content += content
+                response_chunks.append(content)
+
+                # 发送流式消息事件
+                if "messages" in stream_mode:
+                    message_data = [{
+                        "id": ai_msg_id,
+                        "type": "ai",
+                        "content": ai_response_content
+                    }]
+                    yield f"event: messages/partial\n"
+                    yield f"data: {json.dumps(message_data)}\n\n"
+
+                print(f"📝 收到chunk: {content}")
+
+            # 订阅合并的生成时，取消信号会直接结束订阅
+            cancelled = cancelled or cancel_event.is_set()
+            # 缓存回放、合并的请求和不返回用量的服务商按本地估算记录用量
+            completion_tokens = count_text_tokens(ai_response_content)
+            metrics.estimate_usage(prompt_tokens, completion_tokens)
 
-                    print(f"📝 收到chunk: {content}")
+            # 完整生成的回复写入缓存
+            if cancelled:
+                metrics.status = "cancelled"
+                await token_stream.aclose()
+                print(f"🛑 运行已取消: {run_id}")
+            elif cache_key is not None and cached_chunks is None:
+                response_cache.put(
+                    cache_key,
+                    response_chunks,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                )
+            if semantic_question is not None and cached_chunks is None and not cancelled:
+                await semantic_cache.aadd(semantic_question, response_chunks)
 
             print(f"✅ AI流式回复完成: {ai_response_content[:100]}...")
 
-            # 保存 AI 回复到数据库
-            thread_service.save_message(thread_id, ai_msg_id, "ai", ai_response_content)
+            # 保存 AI 回复到数据库（取消时保存已生成的部分）
+            # 合并的请求在同一线程中共用一条回复，完整回复只保存一次，也不会被之后取消的订阅者覆盖
+            persisted = flight.persisted if flight is not None else set()
+            if thread_id not in persisted and (ai_response_content or not cancelled):
+                with metrics.db_time():
+                    thread_service.save_message(thread_id, ai_msg_id, "ai", ai_response_content)
+                if not cancelled:
+                    persisted.add(thread_id)
+            metrics.mark_persisted()
 
-            # 发送最终的 values 事件
+            # 历史过长时在后台生成摘要（不阻塞本次响应）
+            summary_service.maybe_schedule(thread_id)
+
+            # 发送最终的 values 事件（复用缓存的消息 JSON，不再重新序列化整个历史）
             if "values" in stream_mode:
-                final_messages = thread["messages"] + [
-                    {"id": user_msg_id, "type": "human", "content": user_message},
-                    {"id": ai_msg_id, "type": "ai", "content": ai_response_content}
-                ]
+                with metrics.db_time():
+                    serialized = thread_service.get_serialized_messages(thread_id)
                 yield f"event: values\n"
-                yield f"data: {json.dumps({'messages': final_messages})}\n\n"
+                yield serialized.wrap(b'data: {"messages":', b"}\n\n")
+
+            # 请求运行指标时在结束前再发送一个 metadata 事件
+            if include_metrics:
+                metrics.finish()
+                yield f"event: metadata\n"
+                yield f"data: {json.dumps({'run_id': run_id, 'thread_id': thread_id, 'run_metrics': metrics.to_dict()})}\n\n"
 
             # 发送结束事件
             yield f"event: end\n"
             yield f"data: {json.dumps({})}\n\n"
 
+        except RunCancelled:
+            metrics.status = "cancelled"
+            print(f"🛑 运行已取消: {run_id}")
+            yield f"event: end\n"
+            yield f"data: {json.dumps({})}\n\n"
+
+        except AdmissionTimeout:
+            metrics.status = "error"
+            print(f"⏳ 排队超时: {run_id}")
+            yield f"event: error\n"
+            yield f"data: {json.dumps({'error': '服务繁忙，请稍后重试', 'code': 'queue_timeout'}, ensure_ascii=False)}\n\n"
+
         except Exception as e:
+            metrics.status = "error"
+            retry_after = rate_limit_retry_after(e)
+            if retry_after is not None:
+                # 服务商限流：给用户可读的提示而不是原始错误
+                error = {"error": "服务繁忙，请稍后重试", "code": "rate_limited", "retry_after": retry_after}
+                yield f"event: error\n"
+                yield f"data: {json.dumps(error, ensure_ascii=False)}\n\n"
+                return
+
             print(f"❌ 流式处理错误: {e}")
             import traceback
             traceback.print_exc()
             yield f"event: error\n"
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
+        finally:
+            self.cancel_events.pop(run_id, None)
+            metrics_service.finish_run(metrics)
+
+
+    async def _stream_assistant(
+        self,
+        assistant_id: str,
+        user_message: str | None,
+        thread_id: str,
+        run_id: str,
+    ) -> AsyncGenerator:
+        """
+        通过注册表中的图流式生成（图在第一次使用时编译）
+
+        Args:
+            assistant_id: 助手ID
+            user_message: 本轮的用户消息
+            thread_id: 线程ID（对话状态保存在共享检查点中）
+            run_id: 运行ID
+
+        Yields:
+            ("token", 分块)、("tool_start", 数据) 或 ("tool_end", 数据)
+        """
+        config = {"configurable": {"thread_id": thread_id}, "metadata": {"app_run_id": run_id}}
+        new_messages = [HumanMessage(content=user_message)] if user_message is not None else []
+        async with graph_registry.acquire(assistant_id) as graph:
+            # 助手的图可能在节点内运行子 Agent，它们的工具事件也要输出
+            async for event in astream_filtered(
+                graph, {"messages": new_messages}, config, kinds=("tokens", "tools"), subgraphs=True
+            ):
+                yield event
+
+    async def stream_assistant_response(
+        self,
+        assistant_id: str,
+        input_messages: list,
+        thread_id: str,
+        stream_mode: list = None,
+        user_id: str = None,
+        received_at: float = None,
+        include_metrics: bool = False,
+    ) -> AsyncGenerator[str | bytes, None]:
+        """
+        使用注册表中的助手图流式处理响应
+
+        对话状态由图自己保存在共享检查点中；用户消息和回复同时写入线程表，线程列表和状态接口与默认助手一致。
+        不经过响应缓存、请求合并和摘要（这些依赖默认对话图的上下文组装），但同样经过准入控制并记录运行指标。
+
+        Args:
+            assistant_id: 助手ID（必须已在注册表中登记）
+            input_messages: 输入消息列表
+            thread_id: 线程ID
+            stream_mode: 流式模式列表
+            user_id: 用户ID（准入排队的公平单位，未提供时按线程）
+            received_at: 收到请求的时间（perf_counter）
+            include_metrics: 是否在结束前发送包含运行指标的 metadata 事件
+
+        Yields:
+            SSE 格式的数据流
+        """
+        if stream_mode is None:
+            stream_mode = ["messages", "values"]
+
+        run_id = str(uuid.uuid4())
+        cancel_event = asyncio.Event()
+        self.cancel_events[run_id] = cancel_event
+        metrics = metrics_service.start_run(run_id, thread_id, received_at)
+        print(f"🚀 开始流式处理，助手: {assistant_id}, 线程ID: {thread_id}, Run ID: {run_id}")
+
+        yield f"event: metadata\n"
+        yield f"data: {json.dumps({'run_id': run_id, 'thread_id': thread_id, 'assistant_id': assistant_id})}\n\n"
+
+        user_message = None
+        for msg in input_messages:
+            if msg.get("role") == "user":
+                user_message = flatten_content(msg["content"])
+                break
+
+        with metrics.db_time():
+            if not thread_service.thread_exists(thread_id):
+                thread_service.create_thread(thread_id)
+            if user_message is not None:
+                thread_service.save_message(thread_id, str(uuid.uuid4()), "human", user_message)
+        # 历史在图的检查点中，由图自己加载
+        metrics.mark_history_loaded()
+        prompt_tokens = count_text_tokens(user_message or "")
+
+        ai_response_content = ""
+        ai_msg_id = str(uuid.uuid4())
+        token_stream = self._admitted(
+            self._stream_assistant(assistant_id, user_message, thread_id, run_id),
+            user_id or thread_id, prompt_tokens, metrics, cancel_event,
+        )
+        try:
+            cancelled = False
+            async for item in token_stream:
+                # 排队进度事件
+                if isinstance(item, dict):
+                    yield f"event: custom\n"
+                    yield f"data: {json.dumps(item)}\n\n"
+                    continue
+
+                if cancel_event.is_set():
+                    cancelled = True
+                    break
+
+                kind, data = item
+                if kind == "token":
+                    metrics.mark_token()
+                    metrics.record_usage(data)
+                    ai_response_content += flatten_content(data.content)
+                    if "messages" in stream_mode:
+                        message_data = [{"id": ai_msg_id, "type": "ai", "content": ai_response_content}]
+                        yield f"event: messages/partial\n"
+                        yield f"data: {json.dumps(message_data)}\n\n"
+                else:
+                    # 工具事件（tool_start / tool_end）
+                    print(f"🔧 {kind}: {data['tool']}")
+                    event_data = {"tool": data["tool"]}
+                    if kind == "tool_end":
+                        event_data["output"] = str(data["output"])
+                        # 工具执行器的事件带有耗时、状态和缓存命中标记
+                        for key in ("status", "elapsed_ms", "cached"):
+                            if key in data:
+                                event_data[key] = data[key]
+                    yield f"event: {kind}\n"
+                    yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
+
+            if cancelled:
+                metrics.status = "cancelled"
+                print(f"🛑 运行已取消: {run_id}")
+            metrics.estimate_usage(prompt_tokens, count_text_tokens(ai_response_content))
+
+            if ai_response_content or not cancelled:
+                with metrics.db_time():
+                    thread_service.save_message(thread_id, ai_msg_id, "ai", ai_response_content)
+            metrics.mark_persisted()
+
+            if "values" in stream_mode:
+                with metrics.db_time():
+                    serialized = thread_service.get_serialized_messages(thread_id)
+                yield f"event: values\n"
+                yield serialized.wrap(b'data: {"messages":', b"}\n\n")
+
+            if include_metrics:
+                metrics.finish()
+                yield f"event: metadata\n"
+                yield f"data: {json.dumps({'run_id': run_id, 'thread_id': thread_id, 'run_metrics': metrics.to_dict()})}\n\n"
+
+            yield f"event: end\n"
+            yield f"data: {json.dumps({})}\n\n"
+
+        except RunCancelled:
+            metrics.status = "cancelled"
+            print(f"🛑 运行已取消: {run_id}")
+            yield f"event: end\n"
+            yield f"data: {json.dumps({})}\n\n"
+
+        except AdmissionTimeout:
+            metrics.status = "error"
+            print(f"⏳ 排队超时: {run_id}")
+            yield f"event: error\n"
+            yield f"data: {json.dumps({'error': '服务繁忙，请稍后重试', 'code': 'queue_timeout'}, ensure_ascii=False)}\n\n"
+
+        except Exception as e:
+            metrics.status = "error"
+            retry_after = rate_limit_retry_after(e)
+            if retry_after is not None:
+                error = {"error": "服务繁忙，请稍后重试", "code": "rate_limited", "retry_after": retry_after}
+                yield f"event: error\n"
+                yield f"data: {json.dumps(error, ensure_ascii=False)}\n\n"
+                return
+
+            print(f"❌ 流式处理错误（助手 {assistant_id}）: {e}")
+            import traceback
+            traceback.print_exc()
+            yield f"event: error\n"
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+        finally:
+            await token_stream.aclose()
+            self.cancel_events.pop(run_id, None)
+            metrics_service.finish_run(metrics)
+
 
 # 全局 Graph 服务实例
 graph_service = GraphService()
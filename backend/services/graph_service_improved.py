@@ -4,16 +4,21 @@
 """
 import uuid
 import json
-from typing import AsyncGenerator
+import sqlite3
+from typing import AsyncGenerator, Iterable
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langchain_core.tools import tool
 
 from .llm_service import llm_service
+from .tool_executor import tool_executor
 from ..config import settings
+from ..utils.checkpoint import AsyncSqliteCheckpointer
+from ..utils.streaming import astream_filtered
+from ..utils.tool_cache import cache_tools, no_cache
 
 
-# 定义工具
+# 定义工具（结果取决于调用时刻，不能缓存）
+@no_cache
 @tool
 def get_current_time() -> str:
     """获取当前时间"""
@@ -36,32 +41,46 @@ class ImprovedGraphService:
     
     def __init__(self):
         """初始化 Graph 服务"""
-        self.tools = [get_current_time, calculator]
-        self.checkpointer = SqliteSaver.from_conn_string(settings.database_path)
+        # 相同参数的调用在有效期内直接返回缓存的结果（声明了 no_cache 的工具除外）
+        self.tools = cache_tools(
+            [get_current_time, calculator],
+            ttl=settings.tool_cache_ttl_seconds,
+            maxsize=settings.tool_cache_max_entries,
+        )
+        # check_same_thread=False 允许多线程访问（SqliteSaver 内部有锁保证线程安全）
+        self.checkpointer = AsyncSqliteCheckpointer(sqlite3.connect(settings.sqlite_db_path, check_same_thread=False))
         self.graph = self._create_graph()
         print("✅ 改进版 Graph 服务初始化完成")
         print(f"   - 工具数量: {len(self.tools)}")
-        print(f"   - Checkpointer: SQLite ({settings.database_path})")
+        print(f"   - Checkpointer: SQLite ({settings.sqlite_db_path})")
     
     def _create_graph(self):
         """创建 LangGraph（使用预构建 ReAct Agent）"""
         llm = llm_service.get_llm()
         
-        # 使用预构建的 ReAct Agent
+        # 使用预构建的 ReAct Agent（工具节点由执行器并发、限时执行工具调用）
         graph = create_react_agent(
             model=llm,
-            tools=self.tools,
+            tools=tool_executor.tool_node(self.tools),
             checkpointer=self.checkpointer,
+            # 模型调用前按 token 预算组装上下文
+            pre_model_hook=self._assemble_context,
             # 可选：添加系统提示
             # state_modifier="你是一个有帮助的AI助手"
         )
         
         return graph
+
+    def _assemble_context(self, state: dict) -> dict:
+        """模型调用前的钩子：按 token 预算组装上下文，不修改图状态中的完整历史"""
+        messages, _ = llm_service.get_context_assembler().assemble(state["messages"])
+        return {"llm_input_messages": messages}
     
     async def stream_response(
         self,
         input_messages: list,
-        thread_id: str
+        thread_id: str,
+        events: Iterable[str] = ("tokens", "tools"),
     ) -> AsyncGenerator[str, None]:
         """
         流式处理响应（使用 LangGraph 的原生流式 API）
@@ -69,6 +88,7 @@ class ImprovedGraphService:
         Args:
             input_messages: 输入消息列表
             thread_id: 线程ID
+            events: 客户端需要的事件种类（tokens: messages/partial，tools: tool_start/tool_end），只订阅这些事件
 
         Yields:
             SSE 格式的数据流
@@ -88,47 +108,44 @@ class ImprovedGraphService:
         }
         
         try:
-            # 使用 astream_events 进行流式处理
+            # 只订阅需要的事件种类，不为每个 runnable 和回调构造事件
             ai_response_content = ""
             ai_msg_id = str(uuid.uuid4())
             
-            async for event in self.graph.astream_events(
+            async for kind, data in astream_filtered(
+                self.graph,
                 {"messages": input_messages},
-                config=config,
-                version="v2"
+                config,
+                kinds=events,
             ):
-                kind = event["event"]
-                
                 # LLM 输出的每个 token
-                if kind == "on_chat_model_stream":
-                    chunk = event["data"]["chunk"]
-                    if hasattr(chunk, 'content') and chunk.content:
-                        content = str(chunk.content)
-                        ai_response_content += content
-                        
-                        # 发送流式消息事件
-                        message_data = [{
-                            "id": ai_msg_id,
-                            "type": "ai",
-                            "content": ai_response_content
-                        }]
-                        yield f"event: messages/partial\n"
-                        yield f"data: {json.dumps(message_data)}\n\n"
+                if kind == "token":
+                    ai_response_content += str(data.content)
+                    
+                    # 发送流式消息事件
+                    message_data = [{
+                        "id": ai_msg_id,
+                        "type": "ai",
+                        "content": ai_response_content
+                    }]
+                    yield f"event: messages/partial\n"
+                    yield f"data: {json.dumps(message_data)}\n\n"
                 
                 # 工具调用开始
-                elif kind == "on_tool_start":
-                    tool_name = event.get("name", "unknown")
-                    print(f"🔧 调用工具: {tool_name}")
+                elif kind == "tool_start":
+                    print(f"🔧 调用工具: {data['tool']}")
                     yield f"event: tool_start\n"
-                    yield f"data: {json.dumps({'tool': tool_name})}\n\n"
+                    yield f"data: {json.dumps({'tool': data['tool']})}\n\n"
                 
-                # 工具调用结束
-                elif kind == "on_tool_end":
-                    tool_name = event.get("name", "unknown")
-                    tool_output = event["data"].get("output", "")
-                    print(f"✅ 工具完成: {tool_name} -> {tool_output}")
+                # 工具调用结束（按实际完成顺序到达，执行器的事件带有耗时和状态）
+                elif kind == "tool_end":
+                    print(f"✅ 工具完成: {data['tool']} -> {data['output']}")
+                    tool_end = {'tool': data['tool'], 'output': str(data['output'])}
+                    for key in ("status", "elapsed_ms", "cached"):
+                        if key in data:
+                            tool_end[key] = data[key]
                     yield f"event: tool_end\n"
-                    yield f"data: {json.dumps({'tool': tool_name, 'output': str(tool_output)})}\n\n"
+                    yield f"data: {json.dumps(tool_end)}\n\n"
             
             print(f"✅ 流式处理完成")
             
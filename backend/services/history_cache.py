@@ -0,0 +1,124 @@
+"""
+线程历史预构建缓存模块
+把线程缓存中的消息字典增量转换为 LangChain 消息对象和 JSON 字节，避免每轮对话/每次轮询重建整个历史
+"""
+import json
+from typing import Any, Dict, List, Optional
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from ..utils.tokens import count_message_tokens, flatten_content
+
+
+def encode_json(obj: Any) -> bytes:
+    """
+    按 FastAPI JSONResponse 的格式编码 JSON
+
+    Args:
+        obj: 可序列化对象
+
+    Returns:
+        UTF-8 编码的 JSON 字节
+    """
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def to_langchain_message(msg: Dict[str, Any]) -> Optional[BaseMessage]:
+    """
+    将消息字典转换为 LangChain 消息
+
+    Args:
+        msg: {"id", "type", "content"} 格式的消息字典
+
+    Returns:
+        LangChain 消息，未知类型返回 None
+    """
+    content = flatten_content(msg.get("content", ""))
+    msg_type = msg.get("type")
+    if msg_type == "human":
+        return HumanMessage(content=content, id=msg.get("id"))
+    if msg_type == "ai":
+        return AIMessage(content=content, id=msg.get("id"))
+    if msg_type == "system":
+        return SystemMessage(content=content, id=msg.get("id"))
+    return None
+
+
+class PreparedHistory:
+    """线程的预构建消息列表（只追加）"""
+
+    def __init__(self, messages: List[Dict[str, Any]]):
+        """
+        初始化预构建历史
+
+        Args:
+            messages: 线程缓存中的消息字典列表
+        """
+        self.messages: List[BaseMessage] = []
+        self.token_counts: List[int] = []
+        self.total_tokens = 0
+        for msg in messages:
+            self.append(msg)
+
+    def append(self, msg: Dict[str, Any]) -> None:
+        """
+        追加一条新保存的消息
+
+        Args:
+            msg: 消息字典
+        """
+        message = to_langchain_message(msg)
+        if message is None:
+            return
+
+        tokens = count_message_tokens(message)
+        self.messages.append(message)
+        self.token_counts.append(tokens)
+        self.total_tokens += tokens
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+
+class SerializedMessages:
+    """线程消息列表的 JSON 编码缓存（只追加）"""
+
+    def __init__(self, messages: List[Dict[str, Any]]):
+        """
+        初始化编码缓存
+
+        Args:
+            messages: 线程缓存中的消息字典列表
+        """
+        # 不含结尾 "]" 的 JSON 数组，追加时只编码新消息
+        self.buffer = bytearray(b"[")
+        self.count = 0
+        for msg in messages:
+            self.append(msg)
+
+    def append(self, msg: Dict[str, Any]) -> None:
+        """
+        追加一条新保存的消息
+
+        Args:
+            msg: 消息字典
+        """
+        if self.count:
+            self.buffer += b","
+        self.buffer += encode_json(msg)
+        self.count += 1
+
+    def wrap(self, prefix: bytes = b"", suffix: bytes = b"") -> bytes:
+        """
+        拼接出完整的响应字节
+
+        Args:
+            prefix: 数组前的字节
+            suffix: 数组后的字节
+
+        Returns:
+            prefix + 消息 JSON 数组 + suffix
+        """
+        return b"".join((prefix, self.buffer, b"]", suffix))
+
+    def __len__(self) -> int:
+        return self.count
@@ -0,0 +1,177 @@
+"""
+共享 HTTP 连接池模块
+所有 OpenAI 兼容后端共用一组调优过的 httpx 客户端：启动时预先建立连接，
+通过 httpcore trace 统计连接复用率，并按新建/复用连接分别统计首 token 延迟
+"""
+import asyncio
+import importlib.util
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterable, Optional
+
+import httpx
+
+from ..config import settings
+from .metrics_service import percentile
+
+
+# 当前请求的连接跟踪信息（由调用方在发起请求前设置，trace 回调发现新建连接时写入）
+connection_trace: ContextVar[Optional[Dict[str, bool]]] = ContextVar("connection_trace", default=None)
+
+
+class HttpClientPool:
+    """共享 HTTP 客户端类"""
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 120.0,
+        http2: bool = True,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        warm_connections: int = 2,
+        sample_size: int = 1000,
+    ):
+        """
+        初始化共享客户端
+
+        Args:
+            max_connections: 最大连接数
+            max_keepalive_connections: 最多保持的空闲连接数
+            keepalive_expiry: 空闲连接保持时间（秒）
+            http2: 是否启用 HTTP/2（需要安装 h2）
+            connect_timeout: 建立连接超时（秒）
+            read_timeout: 读取超时（秒，流式响应中两个分块之间的最长间隔）
+            warm_connections: 预热时为每个后端建立的连接数
+            sample_size: 首 token 延迟样本的保留条数
+        """
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            print("⚠️  未安装 h2，HTTP/2 已关闭（pip install 'httpx[http2]'）")
+
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.warm_connections = warm_connections
+        self.counters = {"requests": 0, "new_connections": 0, "tls_handshakes": 0, "warmups": 0}
+        self.ttft_new: Deque[float] = deque(maxlen=sample_size)
+        self.ttft_reused: Deque[float] = deque(maxlen=sample_size)
+
+        self.async_client = httpx.AsyncClient(
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=self.http2,
+            event_hooks={"request": [self._attach_trace_async]},
+        )
+        self.sync_client = httpx.Client(
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=self.http2,
+            event_hooks={"request": [self._attach_trace_sync]},
+        )
+
+    def _on_trace(self, event_name: str) -> None:
+        """统计 httpcore 连接事件"""
+        if event_name == "connection.connect_tcp.complete":
+            self.counters["new_connections"] += 1
+            trace = connection_trace.get()
+            if trace is not None:
+                trace["new_connection"] = True
+        elif event_name == "connection.start_tls.complete":
+            self.counters["tls_handshakes"] += 1
+        elif event_name.endswith(".send_request_headers.started"):
+            self.counters["requests"] += 1
+
+    async def _trace_async(self, event_name: str, info: Dict[str, Any]) -> None:
+        self._on_trace(event_name)
+
+    def _trace_sync(self, event_name: str, info: Dict[str, Any]) -> None:
+        self._on_trace(event_name)
+
+    async def _attach_trace_async(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._trace_async
+
+    def _attach_trace_sync(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._trace_sync
+
+    async def warm(self, base_urls: Iterable[str], headers: Optional[Dict[str, str]] = None) -> None:
+        """
+        预热连接：并发请求各后端的 /models，提前完成 DNS、TCP 和 TLS 握手
+
+        Args:
+            base_urls: OpenAI 兼容接口地址
+            headers: 请求头
+        """
+        urls = sorted({url.rstrip("/") for url in base_urls if url})
+        if not urls:
+            return
+
+        started = time.perf_counter()
+        requests = [
+            self.async_client.get(f"{url}/models", headers=headers or {})
+            for url in urls
+            for _ in range(max(1, self.warm_connections))
+        ]
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        self.counters["warmups"] += 1
+        failed = sum(1 for result in results if isinstance(result, Exception))
+        print(f"🔥 预热 LLM 连接: {len(urls)} 个后端, {len(results) - failed}/{len(results)} 成功, "
+              f"用时 {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    def record_ttft(self, ttft_ms: float, new_connection: bool) -> None:
+        """
+        记录首 token 延迟（按是否新建连接分开统计）
+
+        Args:
+            ttft_ms: 首 token 延迟（毫秒）
+            new_connection: 本次请求是否新建了连接
+        """
+        (self.ttft_new if new_connection else self.ttft_reused).append(ttft_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取连接池统计
+
+        Returns:
+            请求数、新建连接数、复用率和按连接类型划分的首 token 延迟
+        """
+        requests = self.counters["requests"]
+        return {
+            **self.counters,
+            "http2": self.http2,
+            "connection_reuse_rate": (
+                round(1 - self.counters["new_connections"] / requests, 4) if requests else None
+            ),
+            "ttft_ms_new_connection": {
+                "count": len(self.ttft_new),
+                "p50": percentile(self.ttft_new, 50),
+                "p95": percentile(self.ttft_new, 95),
+            },
+            "ttft_ms_reused_connection": {
+                "count": len(self.ttft_reused),
+                "p50": percentile(self.ttft_reused, 50),
+                "p95": percentile(self.ttft_reused, 95),
+            },
+        }
+
+    async def aclose(self) -> None:
+        """关闭客户端"""
+        await self.async_client.aclose()
+        self.sync_client.close()
+
+
+# 全局共享客户端实例
+http_client_pool = HttpClientPool(
+    max_connections=settings.llm_http_max_connections,
+    max_keepalive_connections=settings.llm_http_max_keepalive,
+    keepalive_expiry=settings.llm_http_keepalive_expiry,
+    http2=settings.llm_http2,
+    connect_timeout=settings.llm_http_connect_timeout,
+    read_timeout=settings.llm_http_read_timeout,
+    warm_connections=settings.llm_http_warm_connections,
+)
@@ -0,0 +1,532 @@
+"""
+LLM 后端池模块
+多个 OpenAI 兼容后端组成一个聊天模型：按 EWMA 首 token 延迟和吞吐路由到最快的健康后端，
+熔断连续失败的后端，并在收到首个分块之前自动切换到下一个后端；可选对冲请求降低首 token 长尾延迟
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Sequence
+
+import httpx
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import ConfigDict
+
+from ..providers import StreamingChatModel, inner_astream, inner_stream
+from .http_client import connection_trace
+from .metrics_service import percentile
+
+
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后打开，冷却后放行一次试探请求"""
+
+    def __init__(self, failure_threshold: int = 3, cooldown_seconds: float = 30.0):
+        """
+        初始化熔断器
+
+        Args:
+            failure_threshold: 打开熔断所需的连续失败次数
+            cooldown_seconds: 打开后多久允许试探
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        """熔断状态（closed/open/half_open）"""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """
+        是否放行一次请求（半开状态只放行一个试探请求）
+
+        Returns:
+            是否放行
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        """记录成功，关闭熔断"""
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        """记录失败，达到阈值或试探失败时打开熔断"""
+        self.failures += 1
+        if self.trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+    def release(self) -> None:
+        """请求被取消、没有结果时释放试探名额"""
+        self.trial_in_flight = False
+
+
+class LLMBackend:
+    """后端池中的单个后端"""
+
+    def __init__(
+        self,
+        name: str,
+        llm: BaseChatModel,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        ewma_alpha: float = 0.3,
+        breaker: Optional[CircuitBreaker] = None,
+        stale_after: float = 60.0,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ):
+        """
+        初始化后端
+
+        Args:
+            name: 后端名称
+            llm: 聊天模型
+            base_url: OpenAI 兼容接口地址（用于健康检查）
+            api_key: API Key（用于健康检查）
+            ewma_alpha: EWMA 平滑系数，越大越看重最近的样本
+            breaker: 熔断器
+            stale_after: 超过该秒数没有新样本时重新探测（让恢复的后端有机会被选中）
+            http_client: 健康检查使用的共享客户端（同时让连接保持常热），为 None 时每次新建
+        """
+        self.name = name
+        self.llm = llm
+        self.base_url = base_url
+        self.api_key = api_key
+        self.ewma_alpha = ewma_alpha
+        self.breaker = breaker or CircuitBreaker()
+        self.healthy = True
+        self.ewma_ttft_ms: Optional[float] = None
+        self.ewma_tokens_per_second: Optional[float] = None
+        self.stale_after = stale_after
+        self.http_client = http_client
+        self.last_sample_at = 0.0
+        self.counters = {"requests": 0, "failures": 0, "failovers": 0}
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        """更新指数加权移动平均"""
+        if current is None:
+            return sample
+        return self.ewma_alpha * sample + (1 - self.ewma_alpha) * current
+
+    def record_ttft(self, ttft_ms: float) -> None:
+        """记录首 token 延迟"""
+        self.ewma_ttft_ms = self._ewma(self.ewma_ttft_ms, ttft_ms)
+        self.last_sample_at = time.monotonic()
+
+    def record_throughput(self, tokens: int, seconds: float) -> None:
+        """记录生成吞吐（首个分块之后的部分）"""
+        if tokens > 1 and seconds > 0:
+            self.ewma_tokens_per_second = self._ewma(self.ewma_tokens_per_second, tokens / seconds)
+
+    def expected_latency_ms(self, typical_tokens: int) -> float:
+        """
+        预计生成一条典型回复所需的时间
+
+        没有样本或样本已过期的后端返回 0，优先被选中以获得（新的）测量数据。
+
+        Args:
+            typical_tokens: 典型回复的 token 数
+
+        Returns:
+            预计耗时（毫秒）
+        """
+        if self.ewma_ttft_ms is None or time.monotonic() - self.last_sample_at > self.stale_after:
+            return 0.0
+        latency = self.ewma_ttft_ms
+        if self.ewma_tokens_per_second:
+            latency += typical_tokens / self.ewma_tokens_per_second * 1000
+        return latency
+
+    @property
+    def routable(self) -> bool:
+        """是否可以参与路由（健康且熔断未打开）"""
+        return self.healthy and self.breaker.state != "open"
+
+    async def check_health(self, timeout: float = 5.0) -> bool:
+        """
+        健康检查：请求 OpenAI 兼容接口的 /models
+
+        Args:
+            timeout: 超时秒数
+
+        Returns:
+            是否健康
+        """
+        if not self.base_url:
+            return self.healthy
+
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        client = self.http_client or httpx.AsyncClient()
+        try:
+            response = await client.get(f"{self.base_url.rstrip('/')}/models", headers=headers, timeout=timeout)
+            healthy = response.status_code < 500
+        except httpx.HTTPError:
+            healthy = False
+        finally:
+            if self.http_client is None:
+                await client.aclose()
+
+        if healthy != self.healthy:
+            print(f"{'✅' if healthy else '⚠️ '} LLM 后端 {self.name} {'恢复健康' if healthy else '健康检查失败'}")
+        self.healthy = healthy
+        return healthy
+
+    def stats(self) -> Dict[str, Any]:
+        """获取后端统计"""
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "breaker": self.breaker.state,
+            "ewma_ttft_ms": None if self.ewma_ttft_ms is None else round(self.ewma_ttft_ms, 1),
+            "ewma_tokens_per_second": (
+                None if self.ewma_tokens_per_second is None else round(self.ewma_tokens_per_second, 1)
+            ),
+            **self.counters,
+        }
+
+
+class HedgePolicy:
+    """对冲请求策略：首 token 超过近期延迟的指定百分位时再发一个请求，额外请求数受预算限制"""
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        min_delay_ms: float = 300.0,
+        initial_delay_ms: float = 3000.0,
+        budget: float = 0.05,
+        sample_size: int = 1000,
+        min_samples: int = 20,
+    ):
+        """
+        初始化对冲策略
+
+        Args:
+            percentile: 对冲延迟取近期首 token 延迟的百分位
+            min_delay_ms: 对冲延迟下限
+            initial_delay_ms: 样本不足时的对冲延迟
+            budget: 对冲请求占总请求的比例上限（每个请求积累 budget 个额度，对冲消耗 1 个）
+            sample_size: 首 token 延迟样本的保留条数
+            min_samples: 使用百分位所需的最少样本数
+        """
+        self.percentile = percentile
+        self.min_delay_ms = min_delay_ms
+        self.initial_delay_ms = initial_delay_ms
+        self.budget = budget
+        self.min_samples = min_samples
+        self.samples: Deque[float] = deque(maxlen=sample_size)
+        # 初始额度允许冷启动阶段也能对冲少量请求
+        self.credits = 1.0
+        self.counters = {"requests": 0, "hedges": 0, "hedge_wins": 0, "budget_exhausted": 0}
+
+    def delay(self) -> float:
+        """当前的对冲延迟（秒）"""
+        if len(self.samples) < self.min_samples:
+            return self.initial_delay_ms / 1000
+        return max(self.min_delay_ms, percentile(self.samples, self.percentile)) / 1000
+
+    def record_request(self) -> None:
+        """记录一次请求，积累对冲额度"""
+        self.counters["requests"] += 1
+        self.credits = min(10.0, self.credits + self.budget)
+
+    def record_ttft(self, ttft_ms: float) -> None:
+        """记录一次请求（而不是单次尝试）的首 token 延迟"""
+        self.samples.append(ttft_ms)
+
+    def try_acquire(self) -> bool:
+        """
+        申请一次对冲
+
+        Returns:
+            预算是否允许
+        """
+        if self.credits < 1:
+            self.counters["budget_exhausted"] += 1
+            return False
+        self.credits -= 1
+        self.counters["hedges"] += 1
+        return True
+
+    def record_win(self) -> None:
+        """对冲请求先拿到首个分块"""
+        self.counters["hedge_wins"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取对冲统计
+
+        Returns:
+            对冲率、对冲胜出率和当前延迟阈值
+        """
+        requests = self.counters["requests"]
+        hedges = self.counters["hedges"]
+        return {
+            **self.counters,
+            "hedge_rate": round(hedges / requests, 4) if requests else None,
+            "win_rate": round(self.counters["hedge_wins"] / hedges, 4) if hedges else None,
+            "delay_ms": round(self.delay() * 1000, 1),
+        }
+
+
+class _Attempt:
+    """已拿到首个分块的请求"""
+
+    def __init__(self, backend: LLMBackend, stream: Any, buffered: List[AIMessageChunk], first_token_at: float):
+        self.backend = backend
+        self.stream = stream
+        self.buffered = buffered
+        self.first_token_at = first_token_at
+
+    async def close(self) -> None:
+        """放弃这个请求"""
+        await self.stream.aclose()
+        self.backend.breaker.release()
+
+
+class PooledChatModel(StreamingChatModel):
+    """由多个后端组成的聊天模型（对调用方透明，可直接替换单个 ChatOpenAI）"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    backends: List[Any]
+    first_token_timeout: float = 20.0
+    typical_completion_tokens: int = 256
+    # 按新建/复用连接统计首 token 延迟（HttpClientPool），为 None 时不统计
+    connection_stats: Any = None
+    # 对冲请求策略（HedgePolicy），为 None 时不对冲
+    hedge: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "pooled-chat-model"
+
+    def candidates(self) -> List[LLMBackend]:
+        """
+        按预计耗时排序的候选后端
+
+        所有后端都不可路由时仍尝试全部后端（忽略熔断），而不是直接失败。
+
+        Returns:
+            候选后端列表
+        """
+        routable = [backend for backend in self.backends if backend.routable] or list(self.backends)
+        return sorted(routable, key=lambda b: b.expected_latency_ms(self.typical_completion_tokens))
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        """绑定工具（按 OpenAI 格式转发给各后端）"""
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        started = time.perf_counter()
+        errors: List[str] = []
+        last_error: Optional[BaseException] = None
+        forced = not any(backend.routable for backend in self.backends)
+        candidates = iter(self.candidates())
+
+        def next_backend() -> Optional[LLMBackend]:
+            for candidate in candidates:
+                if forced or candidate.breaker.allow():
+                    return candidate
+            return None
+
+        if self.hedge is not None:
+            self.hedge.record_request()
+
+        # 首个有内容的分块到达之前出错或超时，可以无感切换到下一个后端；
+        # 启用对冲时，主请求超过延迟阈值还没有首个分块，就在备用后端再发一个请求，先出分块的胜出
+        attempt: Optional[_Attempt] = None
+        tasks: set = set()
+        try:
+            backend = next_backend()
+            while attempt is None and backend is not None:
+                primary = asyncio.create_task(self._open(backend, messages, stop, kwargs))
+                tasks = {primary}
+                hedged = None
+                if self.hedge is not None:
+                    done, _ = await asyncio.wait(tasks, timeout=self.hedge.delay())
+                    if not done and self.hedge.try_acquire():
+                        alternate = next_backend() or backend
+                        print(f"🪞 LLM 后端 {backend.name} 首个分块超过 {self.hedge.delay() * 1000:.0f}ms，"
+                              f"对冲到 {alternate.name}")
+                        hedged = asyncio.create_task(self._open(alternate, messages, stop, kwargs))
+                        tasks.add(hedged)
+
+                while tasks and attempt is None:
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is not None:
+                            last_error = task.exception()
+                            errors.append(f"{type(last_error).__name__}: {last_error}")
+                        elif attempt is None:
+                            attempt = task.result()
+                            if task is hedged:
+                                self.hedge.record_win()
+                        else:
+                            # 两个请求同时拿到首个分块，多出的一个直接关闭
+                            await task.result().close()
+
+                if attempt is None:
+                    backend = next_backend()
+        finally:
+            # 对冲中落败（或调用方已放弃）的请求取消掉，不再占用上游
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        if attempt is None:
+            # 保留最后一个原始错误，便于上层识别限流（429）等错误类型
+            raise RuntimeError(f"所有 LLM 后端均不可用: {'; '.join(errors) or '熔断中'}") from last_error
+
+        # 对冲延迟按调用方看到的首 token 延迟计算（从请求开始算起，包括切换后端和对冲的等待），每个请求记录一次；
+        # 只记录各次尝试自身的耗时会漏掉主请求被对冲取消的慢请求，阈值随之偏低
+        if self.hedge is not None:
+            self.hedge.record_ttft((time.perf_counter() - started) * 1000)
+
+        backend = attempt.backend
+        settled = False
+        try:
+            for chunk in attempt.buffered:
+                yield ChatGenerationChunk(message=chunk)
+
+            # 已经开始输出，之后的错误不能再切换后端
+            chunks = 0
+            try:
+                async for chunk in attempt.stream:
+                    chunks += 1
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception:
+                backend.counters["failures"] += 1
+                backend.breaker.record_failure()
+                settled = True
+                raise
+
+            backend.record_throughput(chunks, time.perf_counter() - attempt.first_token_at)
+            backend.breaker.record_success()
+            settled = True
+        finally:
+            if not settled:
+                backend.breaker.release()
+                await attempt.stream.aclose()
+
+    async def _open(
+        self,
+        backend: LLMBackend,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]],
+        kwargs: Dict[str, Any],
+    ) -> "_Attempt":
+        """
+        向一个后端发起请求，等到首个有内容的分块
+
+        Args:
+            backend: 后端
+            messages: 输入消息
+            stop: 停止词
+            kwargs: 其他调用参数
+
+        Returns:
+            已拿到首个分块的请求
+
+        Raises:
+            首个分块之前的错误或超时（已记录失败）
+        """
+        backend.counters["requests"] += 1
+        started = time.perf_counter()
+        stream = inner_astream(backend.llm, messages, stop=stop, **kwargs)
+        buffered: List[AIMessageChunk] = []
+        trace = {"new_connection": False}
+        token = connection_trace.set(trace)
+        try:
+            async with asyncio.timeout(self.first_token_timeout):
+                async for chunk in stream:
+                    buffered.append(chunk)
+                    if chunk.content or chunk.tool_call_chunks:
+                        break
+        except asyncio.CancelledError:
+            # 对冲落败被取消，不算后端失败
+            await stream.aclose()
+            backend.breaker.release()
+            raise
+        except Exception as e:
+            await stream.aclose()
+            backend.counters["failures"] += 1
+            backend.counters["failovers"] += 1
+            backend.breaker.record_failure()
+            print(f"⚠️  LLM 后端 {backend.name} 首个分块前失败，切换后端: {type(e).__name__}: {e}")
+            raise
+        finally:
+            connection_trace.reset(token)
+
+        first_token_at = time.perf_counter()
+        ttft_ms = (first_token_at - started) * 1000
+        backend.record_ttft(ttft_ms)
+        if self.connection_stats is not None:
+            self.connection_stats.record_ttft(ttft_ms, trace["new_connection"])
+        return _Attempt(backend, stream, buffered, first_token_at)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        # 同步调用（graph.invoke 等）不做延迟路由，依次尝试可用后端
+        errors = []
+        last_error: Optional[BaseException] = None
+        forced = not any(backend.routable for backend in self.backends)
+        for backend in self.candidates():
+            if not backend.breaker.allow() and not forced:
+                continue
+            backend.counters["requests"] += 1
+            emitted = False
+            try:
+                for chunk in inner_stream(backend.llm, messages, stop=stop, **kwargs):
+                    emitted = True
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception as e:
+                backend.counters["failures"] += 1
+                backend.breaker.record_failure()
+                if emitted:
+                    raise
+                last_error = e
+                errors.append(f"{backend.name}: {type(e).__name__}: {e}")
+                continue
+            backend.breaker.record_success()
+            return
+
+        raise RuntimeError(f"所有 LLM 后端均不可用: {'; '.join(errors) or '熔断中'}") from last_error
+
+    async def check_health(self) -> None:
+        """对所有后端做一次健康检查"""
+        await asyncio.gather(*(backend.check_health() for backend in self.backends))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """获取所有后端的统计"""
+        return [backend.stats() for backend in self.backends]
@@ -1,8 +1,16 @@
 """
 LLM 服务模块
 """
+import asyncio
+import os
+from typing import Any, Dict, Optional
+
 from langchain_openai import ChatOpenAI
 from ..config import settings
+from ..providers import FAKE_LLM_SETTINGS, CassetteWriter, FakeChatModel, RecordingChatModel, ReplayChatModel
+from ..utils.context import ContextAssembler
+from .http_client import http_client_pool
+from .llm_pool import CircuitBreaker, HedgePolicy, LLMBackend, PooledChatModel
 
 
 class LLMService:
@@ -10,20 +18,201 @@ class LLMService:
     
     def __init__(self):
         """初始化 LLM 服务"""
-        self.llm = ChatOpenAI(
-            model=settings.deepseek_model,
-            api_key=settings.deepseek_api_key,
-            base_url=settings.deepseek_base_url,
+        # 设置录制目录时，所有后端的 token 流都写入 cassette
+        self.recorder = (
+            CassetteWriter(settings.llm_record_dir, settings.llm_record_prompts) if settings.llm_record_dir else None
+        )
+
+        # DeepSeek（或压测用的假模型/回放模型）为默认后端，LLM_BACKENDS 中的后端一起参与路由和故障切换
+        if settings.llm_provider == "fake":
+            default_backend = {"name": "fake", "provider": "fake", **self._fake_config()}
+        elif settings.llm_provider == "replay":
+            default_backend = {"name": "replay", "provider": "replay", "path": settings.llm_replay_path}
+        else:
+            default_backend = {
+                "name": "deepseek",
+                "model": settings.deepseek_model,
+                "base_url": settings.deepseek_base_url,
+                "api_key": settings.deepseek_api_key,
+            }
+        backends = [self._create_backend(default_backend)]
+        backends.extend(self._create_backend(config) for config in settings.llm_backends)
+
+        self.llm = PooledChatModel(
+            backends=backends,
+            first_token_timeout=settings.llm_first_token_timeout,
+            connection_stats=http_client_pool,
+            hedge=HedgePolicy(
+                percentile=settings.llm_hedge_percentile,
+                min_delay_ms=settings.llm_hedge_min_delay_ms,
+                initial_delay_ms=settings.llm_hedge_initial_delay_ms,
+                budget=settings.llm_hedge_budget,
+            ) if settings.llm_hedge_enabled else None,
+        )
+        self.health_task: Optional[asyncio.Task] = None
+        self.summary_llm = None
+        # 所有图和服务共用的上下文组装器（token 计数缓存也随之共享）
+        self.context = ContextAssembler(
+            context_window=settings.llm_context_window,
+            max_tokens=settings.llm_max_tokens,
+            reserve_tokens=settings.llm_context_reserve_tokens,
+            strategy=settings.llm_context_strategy,
+            block_size=settings.llm_context_block_size,
+        )
+        print(f"✅ LLM 服务初始化完成: {', '.join(b.name for b in backends)}")
+        if self.recorder is not None:
+            print(f"📼 录制模型 token 流: {self.recorder.path}")
+
+    @staticmethod
+    def _fake_config() -> Dict[str, Any]:
+        """假模型配置（FAKE_LLM_* 设置，与 FakeChatModel.from_env 读取相同的字段）"""
+        return {name: getattr(settings, f"fake_llm_{name}") for name in FAKE_LLM_SETTINGS}
+
+    def _create_backend(self, config: Dict[str, Any]) -> LLMBackend:
+        """
+        根据配置创建后端
+
+        Args:
+            config: {"name", "model", "base_url", "api_key" 或 "api_key_env", 可选 "max_retries"}；
+                "provider" 为 "fake" 时其余字段作为 FakeChatModel 的参数；
+                "provider" 为 "replay" 时 "path" 指定 cassette（默认 LLM_REPLAY_PATH）
+
+        Returns:
+            后端
+        """
+        backend = self._build_backend(config)
+        if self.recorder is not None:
+            backend.llm = RecordingChatModel(inner=backend.llm, writer=self.recorder, name=backend.name)
+        return backend
+
+    def _build_backend(self, config: Dict[str, Any]) -> LLMBackend:
+        """按 provider 创建后端（见 _create_backend）"""
+        breaker = CircuitBreaker(settings.llm_breaker_failures, settings.llm_breaker_cooldown_seconds)
+        if config.get("provider") == "fake":
+            options = {k: v for k, v in config.items() if k not in ("name", "provider")}
+            return LLMBackend(
+                name=config.get("name") or "fake",
+                llm=FakeChatModel(max_tokens=settings.llm_max_tokens, **options),
+                ewma_alpha=settings.llm_ewma_alpha,
+                breaker=breaker,
+            )
+        if config.get("provider") == "replay":
+            path = config.get("path") or settings.llm_replay_path
+            if not path:
+                raise ValueError("回放模式需要设置 LLM_REPLAY_PATH")
+            return LLMBackend(
+                name=config.get("name") or "replay",
+                llm=ReplayChatModel.from_path(
+                    path,
+                    time_scale=config.get("time_scale", settings.llm_replay_time_scale),
+                    match=config.get("match", settings.llm_replay_match),
+                ),
+                ewma_alpha=settings.llm_ewma_alpha,
+                breaker=breaker,
+            )
+
+        api_key = config.get("api_key") or os.getenv(config.get("api_key_env", ""), "")
+        # 多后端时由后端池负责重试（切换到其他后端），单个后端内不再重试
+        max_retries = config.get("max_retries", 0 if settings.llm_backends else 2)
+        llm = ChatOpenAI(
+            model=config["model"],
+            api_key=api_key,
+            base_url=config.get("base_url"),
             temperature=settings.llm_temperature,
             max_tokens=settings.llm_max_tokens,
             streaming=settings.llm_streaming,
+            stream_usage=True,  # 流式最后一个分块返回用量（含前缀缓存命中的 token 数）
+            max_retries=max_retries,
+            timeout=http_client_pool.timeout,
+            http_client=http_client_pool.sync_client,
+            http_async_client=http_client_pool.async_client,
+        )
+        return LLMBackend(
+            name=config.get("name") or config["model"],
+            llm=llm,
+            base_url=config.get("base_url"),
+            api_key=api_key,
+            ewma_alpha=settings.llm_ewma_alpha,
+            breaker=breaker,
+            http_client=http_client_pool.async_client,
         )
-        print(f"✅ LLM 服务初始化完成: {settings.deepseek_model}")
+
+    async def warm_up(self) -> None:
+        """预热所有后端的连接（应用启动时调用）"""
+        await http_client_pool.warm(backend.base_url for backend in self.llm.backends)
+
+    async def _health_check_loop(self) -> None:
+        """定期检查所有后端（经共享客户端发出，同时让空闲连接保持常热）"""
+        while True:
+            await self.llm.check_health()
+            await asyncio.sleep(settings.llm_health_check_interval)
+
+    def start_health_checks(self) -> None:
+        """启动后台健康检查（应用启动时调用）"""
+        if settings.llm_health_check_interval > 0 and self.health_task is None:
+            self.health_task = asyncio.create_task(self._health_check_loop())
+
+    def stop_health_checks(self) -> None:
+        """停止后台健康检查"""
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+
+    def get_backend_stats(self) -> list:
+        """获取各后端的路由统计"""
+        return self.llm.stats()
+
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        """获取对冲请求统计"""
+        if self.llm.hedge is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.llm.hedge.stats()}
     
     def get_llm(self):
         """获取 LLM 实例"""
         return self.llm
 
+    def get_summary_llm(self):
+        """
+        获取摘要用的 LLM（首次使用时创建）
+
+        与对话模型相同的后端池（故障切换、熔断、录制，假模型/回放模式同样生效），按摘要的输出上限和温度调用；
+        设置了 SUMMARY_MODEL 时默认后端换成该模型，LLM_BACKENDS 中的后端仍参与故障切换。
+        """
+        if self.summary_llm is None:
+            pool = self.llm
+            if (
+                settings.llm_provider not in ("fake", "replay")
+                and settings.summary_model and settings.summary_model != settings.deepseek_model
+            ):
+                summary_backend = self._create_backend({
+                    "name": "deepseek-summary",
+                    "model": settings.summary_model,
+                    "base_url": settings.deepseek_base_url,
+                    "api_key": settings.deepseek_api_key,
+                })
+                pool = PooledChatModel(
+                    backends=[summary_backend, *self.llm.backends[1:]],
+                    first_token_timeout=settings.llm_first_token_timeout,
+                    connection_stats=http_client_pool,
+                )
+            self.summary_llm = pool.bind(
+                max_tokens=settings.summary_max_tokens, temperature=settings.summary_temperature
+            )
+        return self.summary_llm
+
+    def get_context_assembler(self) -> ContextAssembler:
+        """获取上下文组装器"""
+        return self.context
+
+    def get_params(self) -> dict:
+        """获取影响生成结果的模型参数（用于缓存键）"""
+        return {
+            "model": settings.llm_provider if settings.llm_provider in ("fake", "replay") else settings.deepseek_model,
+            "temperature": settings.llm_temperature,
+            "max_tokens": settings.llm_max_tokens,
+        }
+
 
 # 全局 LLM 服务实例
 llm_service = LLMService()
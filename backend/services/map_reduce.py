@@ -0,0 +1,379 @@
+"""
+超长输入的 Map-Reduce 处理模块
+单条消息超过 token 阈值时，用 LangGraph 子图 切分 -> 并行整理各部分要点 -> 基于要点流式生成回复
+"""
+import asyncio
+import hashlib
+import math
+import operator
+from collections import OrderedDict
+from typing import Annotated, Any, AsyncGenerator, Dict, List, Optional, Tuple, Union
+
+from typing_extensions import TypedDict
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langgraph.config import get_stream_writer
+from langgraph.graph import StateGraph, START, END
+from langgraph.runtime import Runtime
+from langgraph.types import Send
+
+from ..config import settings
+from ..models.state import ChatContext
+from ..utils.chunking import split_document
+from ..utils.tokens import count_message_tokens, count_text_tokens, flatten_content
+from .database_service import database_service
+from .llm_service import llm_service
+from .metrics_service import RunMetrics
+
+
+MAP_INSTRUCTIONS = (
+    "你是文档分析助手。下面是一份长文本的第 {index}/{total} 部分。"
+    "请忠实、简洁地整理这一部分的要点，保留关键事实、数字、名称、结论和代码接口，"
+    "不要添加原文没有的信息。只输出要点。"
+)
+
+# 要点之外保留原文开头和结尾，用户的问题通常写在这两处
+EXCERPT_CHARS = 600
+
+
+class RunCancelled(Exception):
+    """运行被取消"""
+
+
+class MapReduceState(TypedDict):
+    """Map-Reduce 子图状态"""
+    document: str
+    context: List[BaseMessage]
+    chunks: List[str]
+    notes: Annotated[List[Tuple[int, str]], operator.add]
+
+
+class ChunkTask(TypedDict):
+    """单个分块的处理任务"""
+    index: int
+    total: int
+    chunk: str
+    key: str
+
+
+def chunk_key(chunk: str) -> str:
+    """计算分块缓存键（分块内容 + 整理要点所用的模型）"""
+    model = settings.summary_model or settings.deepseek_model
+    return hashlib.sha256(f"{model}\x00{chunk}".encode("utf-8")).hexdigest()
+
+
+def render_notes(document: str, notes: List[str]) -> str:
+    """
+    用各部分要点替代原文，生成发送给模型的消息内容
+
+    Args:
+        document: 原文
+        notes: 按顺序排列的各部分要点
+
+    Returns:
+        消息内容
+    """
+    sections = "\n\n".join(f"## 第 {i + 1} 部分要点\n{note}" for i, note in enumerate(notes))
+    return (
+        f"[用户发送了一份长文本（约 {count_text_tokens(document)} tokens），"
+        f"原文过长，已分 {len(notes)} 部分整理要点]\n\n"
+        f"### 原文开头\n{document[:EXCERPT_CHARS]}\n\n"
+        f"### 原文结尾\n{document[-EXCERPT_CHARS:]}\n\n"
+        f"{sections}\n\n"
+        "请根据以上内容回应用户的请求（用户的问题通常写在原文开头或结尾）。"
+    )
+
+
+class MapReduceService:
+    """超长输入 Map-Reduce 服务类"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        threshold_tokens: int = 16000,
+        chunk_tokens: int = 4000,
+        max_concurrency: int = 4,
+        notes_tokens: int = 12000,
+    ):
+        """
+        初始化 Map-Reduce 服务
+
+        Args:
+            enabled: 是否启用
+            threshold_tokens: 单条消息超过该 token 数时走 Map-Reduce
+            chunk_tokens: 每个分块的 token 上限
+            max_concurrency: 同时处理的分块数
+            notes_tokens: 全部要点的 token 预算（决定每个分块要点的长度）
+        """
+        self.enabled = enabled
+        self.threshold_tokens = threshold_tokens
+        self.chunk_tokens = chunk_tokens
+        self.max_concurrency = max_concurrency
+        self.notes_tokens = notes_tokens
+        self.db = database_service
+        # 历史中的长消息 -> 分块缓存键 / 已渲染的要点（避免每轮重新切分）
+        self.chunk_keys: "OrderedDict[str, List[str]]" = OrderedDict()
+        self.condensed: "OrderedDict[str, str]" = OrderedDict()
+        self.counters = {"runs": 0, "chunks": 0, "cached_chunks": 0, "cancelled": 0, "condensed": 0}
+        self.graph = self._create_graph()
+
+    def _create_graph(self):
+        """创建 Map-Reduce 子图"""
+        workflow = StateGraph(MapReduceState, context_schema=ChatContext)
+
+        workflow.add_node("split", self._split_node)
+        workflow.add_node("map_chunk", self._map_chunk_node)
+        workflow.add_node("reduce", self._reduce_node)
+
+        workflow.add_edge(START, "split")
+        workflow.add_conditional_edges("split", self._fan_out, ["map_chunk", "reduce"])
+        workflow.add_edge("map_chunk", "reduce")
+        workflow.add_edge("reduce", END)
+
+        return workflow.compile()
+
+    @property
+    def reserve_tokens(self) -> int:
+        """Map-Reduce 运行时需要为要点预留的上下文 token 数"""
+        return self.notes_tokens + count_text_tokens("x" * EXCERPT_CHARS) * 2
+
+    def _notes_budget(self, total: int) -> int:
+        """单个分块要点的 token 上限"""
+        return max(128, min(settings.summary_max_tokens, self.notes_tokens // total))
+
+    def admission(self, document_tokens: int, prompt_tokens: int) -> Tuple[int, int, int]:
+        """
+        估算一次运行需要的准入额度
+
+        Map 阶段的每个分块各调用一次模型（最多 max_concurrency 个同时进行），Reduce 阶段再调用一次。
+
+        Args:
+            document_tokens: 超长消息的 token 数
+            prompt_tokens: 之前对话的 token 数
+
+        Returns:
+            (预估 token 数（不含 Reduce 的输出）, 占用的并发名额, 请求数)
+        """
+        chunks = max(1, math.ceil(document_tokens / self.chunk_tokens))
+        instructions = count_text_tokens(MAP_INSTRUCTIONS)
+        map_tokens = document_tokens + chunks * (instructions + self._notes_budget(chunks))
+        return map_tokens + prompt_tokens + self.reserve_tokens, min(self.max_concurrency, chunks), chunks + 1
+
+    def should_split(self, tokens: int) -> bool:
+        """
+        判断消息是否需要走 Map-Reduce
+
+        Args:
+            tokens: 消息 token 数
+
+        Returns:
+            是否超长
+        """
+        return self.enabled and tokens > self.threshold_tokens
+
+    def _split_node(self, state: MapReduceState) -> Dict[str, Any]:
+        """切分节点：按结构边界切分，已有结果的分块直接复用"""
+        writer = get_stream_writer()
+        chunks = split_document(state["document"], self.chunk_tokens)
+        keys = [chunk_key(chunk) for chunk in chunks]
+        cached = self.db.load_chunk_results(keys)
+
+        writer({"stage": "split", "total": len(chunks), "cached": len(cached)})
+        notes = []
+        for index, key in enumerate(keys):
+            if key in cached:
+                notes.append((index, cached[key]))
+                writer({"stage": "map", "index": index, "total": len(chunks), "cached": True})
+
+        self.counters["chunks"] += len(chunks)
+        self.counters["cached_chunks"] += len(cached)
+        return {"chunks": chunks, "notes": notes}
+
+    def _fan_out(self, state: MapReduceState) -> Union[List[Send], str]:
+        """为没有缓存结果的分块创建并行任务"""
+        done = {index for index, _ in state["notes"]}
+        total = len(state["chunks"])
+        tasks = [
+            Send("map_chunk", {"index": index, "total": total, "chunk": chunk, "key": chunk_key(chunk)})
+            for index, chunk in enumerate(state["chunks"])
+            if index not in done
+        ]
+        return tasks or "reduce"
+
+    async def _map_chunk_node(self, task: ChunkTask, runtime: Runtime[ChatContext]) -> Dict[str, Any]:
+        """Map 节点：整理单个分块的要点并写入缓存，用量计入本次运行"""
+        llm = llm_service.get_summary_llm().bind(max_tokens=self._notes_budget(task["total"]))
+        prompt = [
+            SystemMessage(content=MAP_INSTRUCTIONS.format(index=task["index"] + 1, total=task["total"])),
+            HumanMessage(content=task["chunk"]),
+        ]
+        response = await llm.ainvoke(prompt)
+
+        notes = flatten_content(response.content)
+        if runtime.context is not None and runtime.context.metrics is not None:
+            runtime.context.metrics.record_extra_usage(
+                response, sum(count_message_tokens(m) for m in prompt), count_text_tokens(notes)
+            )
+        self.db.save_chunk_result(task["key"], notes)
+        get_stream_writer()({"stage": "map", "index": task["index"], "total": task["total"], "cached": False})
+        return {"notes": [(task["index"], notes)]}
+
+    async def _reduce_node(self, state: MapReduceState) -> Dict[str, Any]:
+        """Reduce 节点：基于要点流式生成回复，分块通过 stream writer 逐个送出"""
+        writer = get_stream_writer()
+        writer({"stage": "reduce"})
+
+        notes = [note for _, note in sorted(state["notes"])]
+        messages = state["context"] + [HumanMessage(content=render_notes(state["document"], notes))]
+        async for chunk in llm_service.get_llm().astream(messages):
+            writer({"stage": "token", "chunk": chunk})
+        return {}
+
+    async def astream(
+        self,
+        document: str,
+        context: List[BaseMessage],
+        metrics: RunMetrics,
+        cancel_event: Optional[asyncio.Event] = None,
+    ) -> AsyncGenerator[Union[str, Dict[str, Any]], None]:
+        """
+        运行 Map-Reduce 子图
+
+        取消时直接取消运行子图的任务，未完成的分块随之取消；已完成分块的结果保留在缓存中。
+
+        Args:
+            document: 超长的用户消息
+            context: 之前的对话（已按预算组装）
+            metrics: 运行指标
+            cancel_event: 取消信号
+
+        Yields:
+            进度事件（dict）或回复文本分块（str）
+
+        Raises:
+            RunCancelled: 收到取消信号
+        """
+        self.counters["runs"] += 1
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def produce() -> None:
+            """在独立任务中运行子图，事件经队列送出（取消时直接取消该任务）"""
+            try:
+                async for event in self.graph.astream(
+                    {"document": document, "context": context, "chunks": [], "notes": []},
+                    {"max_concurrency": self.max_concurrency},
+                    context=ChatContext(metrics=metrics),
+                    stream_mode="custom",
+                ):
+                    queue.put_nowait(event)
+                queue.put_nowait(None)
+            except Exception as e:
+                queue.put_nowait(e)
+
+        producer = asyncio.create_task(produce())
+        waiter = asyncio.ensure_future((cancel_event or asyncio.Event()).wait())
+        completed = 0
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    self.counters["cancelled"] += 1
+                    raise RunCancelled()
+
+                event = getter.result()
+                if event is None:
+                    return
+                if isinstance(event, Exception):
+                    raise event
+
+                if event["stage"] == "token":
+                    metrics.record_usage(event["chunk"])
+                    if event["chunk"].content:
+                        yield str(event["chunk"].content)
+                    continue
+
+                if event["stage"] == "map":
+                    completed += 1
+                    event = {**event, "completed": completed}
+                yield {"type": "map_reduce", **event}
+        finally:
+            producer.cancel()
+            waiter.cancel()
+            # 等子图任务真正结束（未完成的分块调用随之取消并释放），再把控制权交还调用方
+            await asyncio.gather(producer, waiter, return_exceptions=True)
+
+    def _notes_for(self, message: BaseMessage) -> Optional[str]:
+        """查找历史中长消息已缓存的要点（全部分块都有结果时才可用）"""
+        key = message.id or hashlib.sha256(flatten_content(message.content).encode("utf-8")).hexdigest()
+        if key in self.condensed:
+            self.condensed.move_to_end(key)
+            return self.condensed[key]
+
+        document = flatten_content(message.content)
+        keys = self.chunk_keys.get(key)
+        if keys is None:
+            keys = [chunk_key(chunk) for chunk in split_document(document, self.chunk_tokens)]
+            self.chunk_keys[key] = keys
+            if len(self.chunk_keys) > 256:
+                self.chunk_keys.popitem(last=False)
+
+        results = self.db.load_chunk_results(keys)
+        if len(results) < len(set(keys)):
+            return None
+
+        rendered = render_notes(document, [results[k] for k in keys])
+        self.condensed[key] = rendered
+        if len(self.condensed) > 256:
+            self.condensed.popitem(last=False)
+        return rendered
+
+    def condense(
+        self,
+        messages: List[BaseMessage],
+        token_counts: List[int],
+    ) -> Tuple[List[BaseMessage], List[int]]:
+        """
+        把历史中已处理过的超长消息替换为要点（最新一条消息除外），后续追问不再重复处理原文
+
+        Args:
+            messages: 消息列表
+            token_counts: 对应的 token 数
+
+        Returns:
+            (消息列表, token 数)
+        """
+        if not self.enabled:
+            return messages, token_counts
+
+        messages = list(messages)
+        token_counts = list(token_counts)
+        for i in range(len(messages) - 1):
+            if messages[i].type != "human" or not self.should_split(token_counts[i]):
+                continue
+            rendered = self._notes_for(messages[i])
+            if rendered is None:
+                continue
+            messages[i] = HumanMessage(content=rendered, id=messages[i].id)
+            token_counts[i] = count_message_tokens(messages[i])
+            self.counters["condensed"] += 1
+        return messages, token_counts
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取 Map-Reduce 统计
+
+        Returns:
+            运行次数、分块数和缓存复用数
+        """
+        return {"enabled": self.enabled, **self.counters}
+
+
+# 全局 Map-Reduce 服务实例
+map_reduce_service = MapReduceService(
+    enabled=settings.map_reduce_enabled,
+    threshold_tokens=settings.map_reduce_threshold_tokens,
+    chunk_tokens=settings.map_reduce_chunk_tokens,
+    max_concurrency=settings.map_reduce_max_concurrency,
+    notes_tokens=settings.map_reduce_notes_tokens,
+)
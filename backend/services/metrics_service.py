@@ -0,0 +1,304 @@
+"""
+运行指标模块
+记录每次运行各阶段的时间点（收到请求、历史加载、准入放行、首 token、末 token、保存完成）、
+数据库耗时和 token 用量（含服务商前缀缓存命中情况），结束后写入 runs 表用于按时间聚合
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from ..config import settings
+from .database_service import database_service
+
+
+def parse_usage(chunk: Any) -> Optional[Dict[str, int]]:
+    """
+    从流式分块中解析 token 用量
+
+    OpenAI 兼容接口在最后一个分块返回 usage：LangChain 把 prompt_tokens_details.cached_tokens
+    映射到 usage_metadata.input_token_details.cache_read；DeepSeek 另外返回
+    prompt_cache_hit_tokens / prompt_cache_miss_tokens。
+
+    Args:
+        chunk: LLM 流式分块
+
+    Returns:
+        {"prompt_tokens", "cached_prompt_tokens", "completion_tokens"}，分块不含用量时返回 None
+    """
+    usage = getattr(chunk, "usage_metadata", None)
+    metadata = getattr(chunk, "response_metadata", None) or {}
+    raw = metadata.get("token_usage") or metadata.get("usage") or {}
+    if not usage and not raw:
+        return None
+
+    usage = usage or {}
+    prompt_tokens = usage.get("input_tokens", raw.get("prompt_tokens", 0))
+    cached = (usage.get("input_token_details") or {}).get("cache_read")
+    if cached is None:
+        cached = raw.get("prompt_cache_hit_tokens", 0)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "cached_prompt_tokens": cached or 0,
+        "completion_tokens": usage.get("output_tokens", raw.get("completion_tokens", 0)),
+    }
+
+
+def percentile(samples: List[float], p: float) -> Optional[float]:
+    """计算百分位数（最近邻法），无样本时返回 None"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return round(ordered[index], 1)
+
+
+class RunMetrics:
+    """单次运行的指标（时间点使用 perf_counter，输出时换算为相对收到请求的毫秒数）"""
+
+    def __init__(self, run_id: str, thread_id: str, received_at: Optional[float] = None):
+        """
+        初始化运行指标
+
+        Args:
+            run_id: 运行ID
+            thread_id: 线程ID
+            received_at: 收到请求的时间（perf_counter），未提供时为当前时间
+        """
+        self.run_id = run_id
+        self.thread_id = thread_id
+        self.started_at = received_at if received_at is not None else time.perf_counter()
+        self.created_at = datetime.now().isoformat()
+        self.history_loaded_at: Optional[float] = None
+        self.admitted_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.last_token_at: Optional[float] = None
+        self.persisted_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.db_seconds = 0.0
+        self.chunk_count = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        # 同一运行中主生成之外的模型调用（如 Map-Reduce 的分块整理），逐次累加
+        self.extra_prompt_tokens = 0
+        self.extra_completion_tokens = 0
+        self.usage_reported = False  # 服务商是否返回了用量（否则用本地估算）
+        self.status = "ok"  # ok / cancelled / error
+        self.cache_source: Optional[str] = None  # 响应来自本地缓存时记录来源
+
+    def mark_history_loaded(self) -> None:
+        """记录历史加载完成时间"""
+        self.history_loaded_at = time.perf_counter()
+
+    def mark_admitted(self) -> None:
+        """记录准入放行时间（之前的时间为排队时间）"""
+        self.admitted_at = time.perf_counter()
+
+    def mark_first_token(self) -> None:
+        """记录首 token 时间（只记录第一次）"""
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def mark_token(self) -> None:
+        """记录一个输出分块（首个分块同时记录首 token 时间）"""
+        self.mark_first_token()
+        self.last_token_at = time.perf_counter()
+        self.chunk_count += 1
+
+    def mark_persisted(self) -> None:
+        """记录回复保存完成时间"""
+        self.persisted_at = time.perf_counter()
+
+    @contextmanager
+    def db_time(self) -> Iterator[None]:
+        """累计数据库操作耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.db_seconds += time.perf_counter() - start
+
+    def record_usage(self, chunk: Any) -> None:
+        """
+        从流式分块中记录用量
+
+        Args:
+            chunk: LLM 流式分块
+        """
+        usage = parse_usage(chunk)
+        if usage is None:
+            return
+        self.usage_reported = True
+        self.prompt_tokens = usage["prompt_tokens"] or self.prompt_tokens
+        self.cached_prompt_tokens = usage["cached_prompt_tokens"] or self.cached_prompt_tokens
+        self.completion_tokens = usage["completion_tokens"] or self.completion_tokens
+
+    def estimate_usage(self, prompt_tokens: int, completion_tokens: int) -> None:
+        """
+        服务商没有返回用量时使用本地估算
+
+        Args:
+            prompt_tokens: 估算的 prompt token 数
+            completion_tokens: 估算的输出 token 数
+        """
+        if not self.usage_reported:
+            self.prompt_tokens = prompt_tokens
+            self.completion_tokens = completion_tokens
+
+    def record_extra_usage(self, message: Any, prompt_tokens: int, completion_tokens: int) -> None:
+        """
+        累加主生成之外的一次模型调用的用量（服务商没有返回用量时使用本地估算）
+
+        Args:
+            message: 模型返回的消息
+            prompt_tokens: 估算的 prompt token 数
+            completion_tokens: 估算的输出 token 数
+        """
+        usage = parse_usage(message)
+        self.extra_prompt_tokens += (usage and usage["prompt_tokens"]) or prompt_tokens
+        self.extra_completion_tokens += (usage and usage["completion_tokens"]) or completion_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        """本次运行的全部 token 用量（准入控制按它修正 TPM 额度）"""
+        return (
+            self.prompt_tokens + self.completion_tokens
+            + self.extra_prompt_tokens + self.extra_completion_tokens
+        )
+
+    def finish(self) -> None:
+        """记录结束时间（只记录第一次）"""
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    def _since(self, start: Optional[float], end: Optional[float]) -> Optional[float]:
+        """两个时间点之间的毫秒数，任一时间点缺失时返回 None"""
+        if start is None or end is None:
+            return None
+        return round((end - start) * 1000, 1)
+
+    @property
+    def ttft_ms(self) -> Optional[float]:
+        """首 token 延迟（毫秒）"""
+        if self.first_token_at is None:
+            return None
+        return (self.first_token_at - self.started_at) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        generation_ms = self._since(self.first_token_at, self.last_token_at)
+        tokens_per_second = None
+        if generation_ms and self.completion_tokens:
+            tokens_per_second = round(self.completion_tokens / (generation_ms / 1000), 1)
+        return {
+            "run_id": self.run_id,
+            "thread_id": self.thread_id,
+            "created_at": self.created_at,
+            "status": self.status,
+            "history_ms": self._since(self.started_at, self.history_loaded_at),
+            "queue_ms": self._since(self.history_loaded_at, self.admitted_at),
+            "ttft_ms": round(self.ttft_ms, 1) if self.ttft_ms is not None else None,
+            "generation_ms": generation_ms,
+            "persist_ms": self._since(self.last_token_at, self.persisted_at),
+            "total_ms": self._since(self.started_at, self.finished_at),
+            "db_ms": round(self.db_seconds * 1000, 1),
+            "chunk_count": self.chunk_count,
+            "tokens_per_second": tokens_per_second,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "uncached_prompt_tokens": max(0, self.prompt_tokens - self.cached_prompt_tokens),
+            "completion_tokens": self.completion_tokens,
+            "extra_prompt_tokens": self.extra_prompt_tokens,
+            "extra_completion_tokens": self.extra_completion_tokens,
+            "cache_source": self.cache_source,
+        }
+
+
+class MetricsService:
+    """运行指标服务类"""
+
+    def __init__(self, history_size: int = 1000, store: Any = None):
+        """
+        初始化运行指标服务
+
+        Args:
+            history_size: 保留最近多少次运行用于统计
+            store: 运行指标的持久化存储（提供 save_run），为 None 时只保留在内存中
+        """
+        self.store = store
+        self.recent: Deque[RunMetrics] = deque(maxlen=history_size)
+        self.totals = {
+            "runs": 0,
+            "prompt_tokens": 0,
+            "cached_prompt_tokens": 0,
+            "completion_tokens": 0,
+            "extra_prompt_tokens": 0,
+            "extra_completion_tokens": 0,
+        }
+
+    def start_run(self, run_id: str, thread_id: str, received_at: Optional[float] = None) -> RunMetrics:
+        """
+        创建运行指标
+
+        Args:
+            run_id: 运行ID
+            thread_id: 线程ID
+            received_at: 收到请求的时间（perf_counter）
+
+        Returns:
+            运行指标对象
+        """
+        return RunMetrics(run_id, thread_id, received_at)
+
+    def finish_run(self, metrics: RunMetrics) -> None:
+        """
+        结束运行并计入统计
+
+        Args:
+            metrics: 运行指标对象
+        """
+        metrics.finish()
+        self.recent.append(metrics)
+        self.totals["runs"] += 1
+        self.totals["prompt_tokens"] += metrics.prompt_tokens
+        self.totals["cached_prompt_tokens"] += metrics.cached_prompt_tokens
+        self.totals["completion_tokens"] += metrics.completion_tokens
+        self.totals["extra_prompt_tokens"] += metrics.extra_prompt_tokens
+        self.totals["extra_completion_tokens"] += metrics.extra_completion_tokens
+
+        summary = metrics.to_dict()
+        if self.store is not None:
+            try:
+                self.store.save_run(summary)
+            except Exception as e:
+                print(f"⚠️  保存运行指标失败: {e}")
+        print(f"📏 运行指标: TTFT {summary['ttft_ms']}ms, 排队 {summary['queue_ms']}ms, "
+              f"数据库 {summary['db_ms']}ms, {summary['tokens_per_second']} tokens/s, "
+              f"prompt {summary['prompt_tokens']} (缓存命中 {summary['cached_prompt_tokens']}), "
+              f"completion {summary['completion_tokens']}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取聚合统计
+
+        Returns:
+            token 用量、前缀缓存命中率，以及按是否命中前缀缓存分组的 TTFT 百分位
+        """
+        upstream = [m for m in self.recent if m.cache_source is None and m.ttft_ms is not None]
+        with_hit = [m.ttft_ms for m in upstream if m.cached_prompt_tokens > 0]
+        without_hit = [m.ttft_ms for m in upstream if m.cached_prompt_tokens == 0]
+        prompt_tokens = self.totals["prompt_tokens"]
+        return {
+            **self.totals,
+            "prompt_cache_hit_rate": round(self.totals["cached_prompt_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0,
+            "ttft_ms_p50": percentile(with_hit + without_hit, 50),
+            "ttft_ms_p95": percentile(with_hit + without_hit, 95),
+            "ttft_ms_p50_prefix_hit": percentile(with_hit, 50),
+            "ttft_ms_p50_prefix_miss": percentile(without_hit, 50),
+        }
+
+
+# 全局运行指标服务实例
+metrics_service = MetricsService(store=database_service if settings.run_metrics_persist else None)
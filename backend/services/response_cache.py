@@ -0,0 +1,231 @@
+"""
+LLM 响应缓存模块
+按模型参数 + 规范化对话历史的哈希精确匹配，命中时以 token 流的形式回放
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+
+from ..config import settings
+from ..utils.tokens import flatten_content
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：去掉首尾空白并合并连续空白"""
+    return " ".join(text.split())
+
+
+def conversation_hash(messages: List[BaseMessage], params: Dict[str, Any]) -> str:
+    """
+    计算对话哈希
+
+    Args:
+        messages: 发送给模型的消息（包括系统提示）
+        params: 模型参数（模型名、temperature、max_tokens 等）
+
+    Returns:
+        十六进制哈希值
+    """
+    payload = {
+        "params": params,
+        "messages": [
+            [message.type, normalize_text(flatten_content(message.content))]
+            for message in messages
+        ],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LLM 响应缓存类（内存 LRU + 可选 SQLite 持久层）"""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        max_entries: int = 1024,
+        ttl_seconds: int = 3600,
+        db_path: Optional[str] = None,
+    ):
+        """
+        初始化响应缓存
+
+        Args:
+            enabled: 是否启用
+            max_entries: 内存层最大条目数
+            ttl_seconds: 条目有效期（秒）
+            db_path: SQLite 持久层路径，为 None 时只使用内存层
+        """
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        # key -> (过期时间, 回复分块, prompt tokens, completion tokens)
+        self.entries: "OrderedDict[str, Tuple[float, List[str], int, int]]" = OrderedDict()
+        self.counters = {
+            "hits": 0,
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "saved_prompt_tokens": 0,
+            "saved_completion_tokens": 0,
+        }
+        if self.enabled and self.db_path:
+            self._init_db()
+        if self.enabled:
+            print(f"✅ 响应缓存已启用: 内存 {max_entries} 条, TTL {ttl_seconds}s"
+                  + (f", 持久层 {db_path}" if db_path else ""))
+
+    @contextmanager
+    def _get_connection(self):
+        """获取持久层连接"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _init_db(self) -> None:
+        """初始化持久层表"""
+        with self._get_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_response_cache (
+                    key TEXT PRIMARY KEY,
+                    chunks TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _remember(self, key: str, entry: Tuple[float, List[str], int, int]) -> None:
+        """写入内存层并按 LRU 淘汰"""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def make_key(self, messages: List[BaseMessage], params: Dict[str, Any]) -> str:
+        """
+        生成缓存键
+
+        Args:
+            messages: 发送给模型的消息
+            params: 模型参数
+
+        Returns:
+            缓存键
+        """
+        return conversation_hash(messages, params)
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """
+        查询缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            回复分块列表，未命中返回 None
+        """
+        now = time.time()
+        entry = self.entries.get(key)
+        source = "memory_hits"
+        if entry is not None and entry[0] <= now:
+            del self.entries[key]
+            entry = None
+
+        if entry is None and self.db_path:
+            with self._get_connection() as conn:
+                row = conn.execute("""
+                    SELECT chunks, prompt_tokens, completion_tokens, expires_at
+                    FROM llm_response_cache WHERE key = ?
+                """, (key,)).fetchone()
+                if row and row[3] > now:
+                    entry = (row[3], json.loads(row[0]), row[1], row[2])
+                    source = "db_hits"
+                elif row:
+                    conn.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+
+        self._remember(key, entry)
+        self.counters["hits"] += 1
+        self.counters[source] += 1
+        self.counters["saved_prompt_tokens"] += entry[2]
+        self.counters["saved_completion_tokens"] += entry[3]
+        return entry[1]
+
+    def put(self, key: str, chunks: List[str], prompt_tokens: int, completion_tokens: int) -> None:
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            chunks: 回复分块（按原始流式分块保存，回放时保持相同节奏）
+            prompt_tokens: 该请求的 prompt token 数
+            completion_tokens: 回复的 token 数
+        """
+        if not chunks:
+            return
+
+        entry = (time.time() + self.ttl_seconds, list(chunks), prompt_tokens, completion_tokens)
+        self._remember(key, entry)
+        self.counters["stores"] += 1
+
+        if self.db_path:
+            with self._get_connection() as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO llm_response_cache
+                    (key, chunks, prompt_tokens, completion_tokens, expires_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (key, json.dumps(entry[1], ensure_ascii=False), prompt_tokens, completion_tokens, entry[0]))
+
+    async def replay(self, chunks: List[str]) -> AsyncGenerator[str, None]:
+        """
+        以 token 流的形式回放缓存的回复
+
+        Args:
+            chunks: 回复分块
+
+        Yields:
+            回复分块
+        """
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(0)  # 让出控制权，保持与真实流式一致的分块发送
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计
+
+        Returns:
+            命中率、节省的 token 数等统计信息
+        """
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+# 全局响应缓存实例
+response_cache = ResponseCache(
+    enabled=settings.response_cache_enabled,
+    max_entries=settings.response_cache_max_entries,
+    ttl_seconds=settings.response_cache_ttl_seconds,
+    db_path=settings.response_cache_db_path,
+)
@@ -0,0 +1,470 @@
+"""
+线程检索记忆模块
+对线程自身的历史消息建立本地向量索引，把窗口之外与当前问题相关的早期消息召回到 prompt 中
+"""
+import asyncio
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from ..config import settings
+from ..utils.tokens import count_message_tokens, flatten_content
+from .database_service import database_service
+from .history_cache import PreparedHistory
+from .thread_service import thread_service
+
+try:
+    import numpy as np
+    from ..utils.embeddings import HashingVectorizer
+except ImportError:  # numpy 是可选依赖
+    np = None
+
+
+RETRIEVAL_PREFIX = "以下是本次对话中与当前问题相关的早期消息（按时间顺序）：\n"
+
+ROLE_LABELS = {"human": "用户", "ai": "助手", "system": "系统"}
+
+
+# 索引重建时与上一份索引对应，超过这么多处不连续时其余消息重新计算
+MAX_ADOPT_MISSES = 64
+
+
+def content_checksum(content: str) -> int:
+    """计算消息内容校验和（用于发现被编辑过的消息）"""
+    return zlib.crc32(content.encode("utf-8"))
+
+
+def _common_run(a: List[Any], b: List[Any], i: int, j: int, limit: int) -> int:
+    """a[i:] 与 b[j:] 开头相同部分的长度（不超过 limit），按倍数扩大再二分，每次比较一个切片"""
+    if limit <= 0 or a[i] != b[j]:
+        return 0
+    good, bad = 1, limit + 1
+    while good < limit:
+        size = min(good * 2, limit)
+        if a[i:i + size] != b[j:j + size]:
+            bad = size
+            break
+        good = size
+    while bad - good > 1:
+        size = (good + bad) // 2
+        if a[i:i + size] == b[j:j + size]:
+            good = size
+        else:
+            bad = size
+    return good
+
+
+class VectorStore:
+    """线程的向量存储：按计算顺序分配行，只追加；线程缓存失效重建索引时整体沿用，不复制"""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        """
+        初始化向量存储
+
+        Args:
+            dim: 向量维度
+            capacity: 初始容量（行数）
+        """
+        self.vectors = np.zeros((max(capacity, 64), dim), dtype=np.float32)
+        self.size = 0
+
+    def add(self, vectors: "np.ndarray") -> "np.ndarray":
+        """
+        追加一批向量（容量按倍数扩容）
+
+        Args:
+            vectors: 向量矩阵
+
+        Returns:
+            分配到的行号
+        """
+        needed = self.size + len(vectors)
+        if needed > self.vectors.shape[0]:
+            grown = np.zeros((max(needed, self.vectors.shape[0] * 2), self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        self.vectors[self.size:needed] = vectors
+        slots = np.arange(self.size, needed)
+        self.size = needed
+        return slots
+
+
+class RetrievalIndex:
+    """线程消息向量索引（只追加，作为线程派生视图维护）"""
+
+    def __init__(self, messages: List[Dict[str, Any]]):
+        """
+        初始化向量索引
+
+        消息只在追加时登记，向量在下一次检索前计算，保存消息的路径上没有额外开销。
+        每条消息对应向量存储中的一行（slots），尚未计算的消息为 -1，检索时被排除。
+
+        Args:
+            messages: 线程缓存中的消息字典列表
+        """
+        indexed = [msg for msg in messages if msg.get("type") in ROLE_LABELS]
+        self.ids: List[str] = [msg.get("id") for msg in indexed]
+        self.contents: List[str] = [
+            content if isinstance(content, str) else flatten_content(content)
+            for content in (msg.get("content", "") for msg in indexed)
+        ]
+        self.store: Optional[VectorStore] = None
+        self.slots = np.full(max(len(self.ids), 64), -1, dtype=np.int64)
+        # 尚未计算向量的行（追加可能与后台线程中的 sync 同时发生，用锁保护）
+        self.pending: List[int] = list(range(len(self.ids)))
+        self.lock = threading.Lock()
+        # 是否已读取过数据库中保存的向量
+        self.loaded = False
+        # 后台线程正在计算向量，期间不检索
+        self.syncing = False
+
+    def append(self, msg: Dict[str, Any]) -> None:
+        """
+        追加一条新保存的消息（与 PreparedHistory 保持相同的下标）
+
+        Args:
+            msg: 消息字典
+        """
+        if msg.get("type") not in ROLE_LABELS:
+            return
+        with self.lock:
+            self.ids.append(msg.get("id"))
+            self.contents.append(flatten_content(msg.get("content", "")))
+            row = len(self.ids) - 1
+            if row >= len(self.slots):
+                self.slots = np.concatenate([self.slots, np.full(len(self.slots), -1, dtype=np.int64)])
+            self.pending.append(row)
+
+    def adopt(self, previous: "RetrievalIndex") -> None:
+        """
+        沿用同一线程上一份索引的向量
+
+        线程缓存失效（编辑消息、其他 worker 写入）后索引随视图重建：按消息ID对应，内容没变的消息直接指向
+        上一份索引的向量存储中的同一行，只有新增和被编辑的消息需要重新计算，不复制向量，
+        也不再从数据库重新读取整个线程的向量。
+
+        Args:
+            previous: 上一份索引（不能正在后台计算；之后不再使用）
+        """
+        if previous.store is None:
+            return
+        # 编辑过的消息在存储中留下失效的行；失效的行太多时不再沿用，重新构建（从数据库读取）
+        if previous.store.size > 2 * len(self.ids) + 64:
+            return
+        self.loaded = True
+        self.store = previous.store
+        # 按连续相同的区段对应（切片比较在 C 中进行），不逐行比较：
+        # 只有追加时整个线程是一段；编辑过的消息排到最后，前后各一段；
+        # 区段之间的消息是新增、被编辑或移动过的，需要重新计算
+        ids, contents = self.ids, self.contents
+        old_ids, old_contents = previous.ids, previous.contents
+        n, m = len(ids), len(old_ids)
+        runs = []
+        i = j = misses = 0
+        while i < n and j < m and misses <= MAX_ADOPT_MISSES:
+            length = _common_run(ids, old_ids, i, j, min(n - i, m - j))
+            length = _common_run(contents, old_contents, i, j, length)
+            if length:
+                runs.append((i, j, length))
+                i += length
+                j += length
+                continue
+            misses += 1
+            if ids[i] == old_ids[j]:
+                # 原地编辑
+                i += 1
+                j += 1
+                continue
+            try:
+                # 上一份索引中间的消息被删除或移到了后面
+                j = old_ids.index(ids[i], j)
+            except ValueError:
+                # 新消息，或从前面移过来的消息
+                i += 1
+
+        for i, j, length in runs:
+            self.slots[i:i + length] = previous.slots[j:j + length]
+        with self.lock:
+            self.pending = np.flatnonzero(self.slots[:len(self.ids)] < 0).tolist()
+
+    def sync(self, thread_id: str, vectorizer: "HashingVectorizer", load: bool = True) -> List[Tuple[str, int, bytes]]:
+        """
+        为尚未向量化的消息计算向量
+
+        首次同步时先读取数据库中已保存的向量，只计算缺失或内容已变化的消息。
+
+        Args:
+            thread_id: 线程ID
+            vectorizer: 向量化器
+            load: 尚未读取过数据库时是否读取（只有少量消息待计算时直接计算更快）
+
+        Returns:
+            新计算的 (消息ID, 内容校验和, 向量字节)，由调用方写入数据库
+        """
+        with self.lock:
+            pending = list(self.pending)
+        if not pending:
+            return []
+
+        stored: Dict[str, Tuple[int, bytes]] = {}
+        if load and not self.loaded:
+            stored = database_service.load_embeddings(thread_id)
+            self.loaded = True
+
+        dim = vectorizer.dim
+        if self.store is None:
+            # 为之后追加的消息留出余量，避免下一轮就整体扩容
+            self.store = VectorStore(dim, capacity=len(self.ids) + len(self.ids) // 4)
+
+        found, found_vectors, missing = [], [], []
+        for row in pending:
+            checksum, vector = stored.get(self.ids[row], (None, b""))
+            if checksum == content_checksum(self.contents[row]) and len(vector) == dim * 4:
+                found.append(row)
+                found_vectors.append(vector)
+            else:
+                missing.append(row)
+
+        # 向量在锁外计算；写回 slots 时加锁（append 扩容会替换 slots 数组，锁外写入的行会丢失）
+        rows, vectors, saved = [], [], []
+        if found:
+            rows.append(found)
+            vectors.append(np.frombuffer(b"".join(found_vectors), dtype=np.float32).reshape(len(found), dim))
+        if missing:
+            computed = vectorizer.transform([self.contents[row] for row in missing])
+            rows.append(missing)
+            vectors.append(computed)
+            saved = [
+                (self.ids[row], content_checksum(self.contents[row]), vector.tobytes())
+                for row, vector in zip(missing, computed)
+            ]
+        slots = [self.store.add(block) for block in vectors]
+
+        done = set(pending)
+        with self.lock:
+            for block, block_slots in zip(rows, slots):
+                self.slots[block] = block_slots
+            self.pending = [row for row in self.pending if row not in done]
+        return saved
+
+    def search(self, query: "np.ndarray", limit: int, k: int) -> List[Tuple[int, float]]:
+        """
+        在前 limit 条消息中检索最相似的 k 条
+
+        Args:
+            query: 归一化的查询向量
+            limit: 只检索下标小于 limit 的消息
+            k: 返回条数
+
+        Returns:
+            [(消息下标, 相似度)]，按相似度从高到低
+        """
+        limit = min(limit, len(self.ids))
+        if limit <= 0 or k <= 0 or self.store is None:
+            return []
+
+        # 对整个存储计算相似度（连续内存上的矩阵乘法），再按行号取出各消息的分数
+        slots = self.slots[:limit]
+        scores = (self.store.vectors[:self.store.size] @ query)[np.maximum(slots, 0)]
+        scores[slots < 0] = -np.inf
+        if limit > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(limit)
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class RetrievalMemory:
+    """线程检索记忆服务类"""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        top_k: int = 4,
+        max_tokens: int = 1024,
+        min_score: float = 0.3,
+        dim: int = 256,
+        inline_limit: int = 64,
+        resident_threads: int = 32,
+    ):
+        """
+        初始化检索记忆
+
+        Args:
+            enabled: 是否启用
+            top_k: 最多召回的消息条数
+            max_tokens: 召回内容的 token 上限
+            min_score: 召回所需的最低余弦相似度
+            dim: 向量维度
+            inline_limit: 待计算的消息不超过该数量时在请求中直接计算，否则在后台线程中构建（本轮不召回）
+            resident_threads: 常驻内存的线程索引数量（线程缓存失效重建索引时沿用其中的向量）
+        """
+        if enabled and np is None:
+            print("⚠️  未安装 numpy，检索记忆已禁用")
+            enabled = False
+
+        self.enabled = enabled
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.min_score = min_score
+        self.inline_limit = inline_limit
+        self.resident_threads = resident_threads
+        # 线程ID -> 最近使用的索引（LRU）
+        self.resident: "OrderedDict[str, RetrievalIndex]" = OrderedDict()
+        # 后台构建索引和保存向量的任务
+        self.tasks: set = set()
+        self.counters = {"queries": 0, "recalled_messages": 0, "background_builds": 0, "skipped_building": 0}
+
+        if not self.enabled:
+            return
+
+        self.vectorizer = HashingVectorizer(dim=dim)
+        thread_service.register_view("retrieval", RetrievalIndex)
+        print(f"✅ 检索记忆已启用: top_k={top_k}, 最多 {max_tokens} tokens")
+
+    @property
+    def reserve_tokens(self) -> int:
+        """需要从上下文预算中为召回内容预留的 token 数"""
+        return self.max_tokens if self.enabled else 0
+
+    def _resident_index(self, thread_id: str) -> Optional[RetrievalIndex]:
+        """取出线程的索引；索引随线程缓存重建过时，沿用上一份索引中的向量"""
+        index = thread_service.get_view(thread_id, "retrieval")
+        if index is None:
+            return None
+        previous = self.resident.get(thread_id)
+        if previous is not None and previous is not index and not previous.syncing:
+            index.adopt(previous)
+        self.resident[thread_id] = index
+        self.resident.move_to_end(thread_id)
+        while len(self.resident) > self.resident_threads:
+            self.resident.popitem(last=False)
+        return index
+
+    def _spawn(self, coroutine) -> None:
+        """启动后台任务（保留引用直到完成）"""
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _save(self, thread_id: str, rows: List[Tuple[str, int, bytes]]) -> None:
+        """在线程池中保存新计算的向量"""
+        try:
+            await asyncio.to_thread(database_service.save_embeddings, thread_id, rows)
+        except Exception as e:
+            print(f"⚠️  保存消息向量失败: {e}")
+
+    async def _build(self, thread_id: str, index: RetrievalIndex) -> None:
+        """在线程池中读取已保存的向量并计算其余消息的向量"""
+        try:
+            rows = await asyncio.to_thread(index.sync, thread_id, self.vectorizer)
+            print(f"🔎 检索索引构建完成: {thread_id}（{len(index)} 条消息，新计算 {len(rows)} 条）")
+            await self._save(thread_id, rows)
+        except Exception as e:
+            print(f"⚠️  构建检索索引失败: {e}")
+        finally:
+            index.syncing = False
+
+    async def inject(
+        self,
+        thread_id: str,
+        history: PreparedHistory,
+        messages: List[BaseMessage],
+        prompt_tokens: int,
+        budget: int,
+    ) -> Tuple[List[BaseMessage], int]:
+        """
+        召回窗口之外的相关早期消息，插入到最新一条消息之前
+
+        插在末尾而不是开头，窗口前缀保持不变，不影响服务商的前缀缓存。
+        向量常驻内存，请求中只计算新增和被编辑的消息；冷启动（大量消息待计算）时在后台线程中构建索引，
+        本轮不召回。读写数据库都不在事件循环中进行。
+
+        Args:
+            thread_id: 线程ID
+            history: 预构建历史
+            messages: 已组装好的上下文
+            prompt_tokens: 上下文的 token 数
+            budget: 上下文总预算
+
+        Returns:
+            (消息列表, prompt token 数)
+        """
+        if not self.enabled or not messages:
+            return messages, prompt_tokens
+
+        # 窗口之外（被截断或已被摘要覆盖）的消息才需要召回
+        window = sum(1 for m in messages if m.type != "system")
+        limit = len(history) - window
+        if limit <= 0:
+            return messages, prompt_tokens
+
+        index = self._resident_index(thread_id)
+        if index is None:
+            return messages, prompt_tokens
+        if index.syncing:
+            self.counters["skipped_building"] += 1
+            return messages, prompt_tokens
+        if len(index.pending) > self.inline_limit:
+            index.syncing = True
+            self.counters["background_builds"] += 1
+            self.counters["skipped_building"] += 1
+            self._spawn(self._build(thread_id, index))
+            return messages, prompt_tokens
+        rows = index.sync(thread_id, self.vectorizer, load=False)
+        if rows:
+            self._spawn(self._save(thread_id, rows))
+
+        self.counters["queries"] += 1
+        query = self.vectorizer.transform_one(flatten_content(messages[-1].content))
+        available = min(self.max_tokens, budget - prompt_tokens)
+
+        chosen = []
+        used = 0
+        for row, score in index.search(query, limit, self.top_k):
+            if score < self.min_score:
+                break
+            if used + history.token_counts[row] > available:
+                continue
+            chosen.append(row)
+            used += history.token_counts[row]
+
+        if not chosen:
+            return messages, prompt_tokens
+
+        lines = [
+            f"{ROLE_LABELS[history.messages[row].type]}: {flatten_content(history.messages[row].content)}"
+            for row in sorted(chosen)
+        ]
+        recalled = SystemMessage(content=RETRIEVAL_PREFIX + "\n".join(lines))
+        self.counters["recalled_messages"] += len(chosen)
+        print(f"🔎 检索记忆: 召回 {len(chosen)} 条早期消息")
+        return messages[:-1] + [recalled] + messages[-1:], prompt_tokens + count_message_tokens(recalled)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取检索统计
+
+        Returns:
+            查询次数、召回条数、后台构建次数和常驻的线程索引数
+        """
+        return {"enabled": self.enabled, "resident_threads": len(self.resident), **self.counters}
+
+
+# 全局检索记忆实例
+retrieval_memory = RetrievalMemory(
+    enabled=settings.retrieval_enabled,
+    top_k=settings.retrieval_top_k,
+    max_tokens=settings.retrieval_max_tokens,
+    min_score=settings.retrieval_min_score,
+    dim=settings.retrieval_dim,
+    inline_limit=settings.retrieval_inline_limit,
+    resident_threads=settings.retrieval_resident_threads,
+)
@@ -0,0 +1,268 @@
+"""
+语义缓存模块
+用本地哈希 n-gram 向量对首轮问题做相似度检索，命中时直接回放已缓存的回答。
+检索和写入在线程池中执行（alookup/aadd），不阻塞事件循环；
+持久化文件由一个进程独占写入（文件锁），其他 worker 加载只读快照，新条目只保存在各自内存中
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..config import settings
+
+try:
+    import numpy as np
+    from numpy.lib.format import open_memmap
+    from ..utils.embeddings import HashingVectorizer
+except ImportError:  # numpy 是可选依赖
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，按单进程处理
+    fcntl = None
+
+
+class SemanticCache:
+    """语义缓存类（NumPy 相似度索引，容量满时按最近最少使用淘汰）"""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        capacity: int = 100_000,
+        threshold: float = 0.75,
+        dim: int = 256,
+        index_path: Optional[str] = None,
+    ):
+        """
+        初始化语义缓存
+
+        Args:
+            enabled: 是否启用
+            capacity: 最大条目数
+            threshold: 命中所需的最低余弦相似度
+            dim: 向量维度
+            index_path: 持久化路径前缀（生成 .npy 向量文件和 .json 元数据），为 None 时只在内存中
+        """
+        if enabled and np is None:
+            print("⚠️  未安装 numpy，语义缓存已禁用")
+            enabled = False
+
+        self.enabled = enabled
+        self.capacity = capacity
+        self.threshold = threshold
+        self.dim = dim
+        self.index_path = index_path
+        self.size = 0
+        self.questions: List[Optional[str]] = []
+        self.answers: List[Optional[List[str]]] = []
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.dirty = 0
+        # 检索、写入和保存快照互斥（都在线程池中执行）；保存文件另用一把锁，后台保存与关闭时的保存不会同时写
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        # 是否独占持久化文件（只有独占的进程写入 .npy 和 .json）
+        self.owner = False
+        self.owner_file = None
+        self.saving: Optional[asyncio.Task] = None
+
+        if not self.enabled:
+            return
+
+        self.vectorizer = HashingVectorizer(dim=dim)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        if index_path:
+            self._load()
+        else:
+            self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        print(f"✅ 语义缓存已启用: 容量 {capacity}, 阈值 {threshold}, 已有 {self.size} 条")
+
+    def _acquire_owner(self) -> bool:
+        """尝试独占持久化文件（多个 uvicorn worker 共用同一路径时只有一个能拿到）"""
+        if fcntl is None:
+            return True
+        self.owner_file = open(f"{self.index_path}.lock", "a")
+        try:
+            fcntl.flock(self.owner_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.owner_file.close()
+            self.owner_file = None
+            return False
+        return True
+
+    def _load(self) -> None:
+        """
+        从持久化文件加载
+
+        独占文件的进程以 mmap 读写方式打开向量矩阵（写入直接落盘）；
+        其他进程以写时复制方式打开（只读快照，新条目不写回文件），避免多个进程按各自的 size 互相覆盖
+        """
+        vectors_path = f"{self.index_path}.npy"
+        meta_path = f"{self.index_path}.json"
+        self.owner = self._acquire_owner()
+        exists = os.path.exists(vectors_path)
+        if self.owner:
+            mode = "r+" if exists else "w+"
+            self.vectors = open_memmap(vectors_path, mode=mode, dtype=np.float32, shape=(self.capacity, self.dim))
+        elif exists:
+            self.vectors = np.load(vectors_path, mmap_mode="c")
+        else:
+            self.vectors = np.zeros((self.capacity, self.dim), dtype=np.float32)
+        if not self.owner:
+            print(f"⚠️  语义缓存文件已被其他进程占用，本进程只读取快照: {self.index_path}")
+
+        if exists and os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.size = min(meta["size"], self.capacity)
+            self.questions = meta["questions"][:self.size]
+            self.answers = meta["answers"][:self.size]
+            self.last_used[:self.size] = meta["last_used"][:self.size]
+
+    def save(self) -> None:
+        """把向量和元数据写入持久化文件（阻塞，事件循环中用 save_in_background）"""
+        if not self.enabled or not self.index_path or not self.owner:
+            return
+
+        with self.save_lock:
+            # 持锁只复制元数据的快照，序列化和写文件在锁外进行
+            with self.lock:
+                meta = {
+                    "size": self.size,
+                    "questions": list(self.questions),
+                    "answers": list(self.answers),
+                    "last_used": self.last_used[:self.size].tolist(),
+                }
+                self.dirty = 0
+            self.vectors.flush()
+            tmp_path = f"{self.index_path}.json.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_path, f"{self.index_path}.json")
+
+    def save_in_background(self) -> None:
+        """在后台线程中保存（已有保存在进行时跳过）"""
+        if self.saving is not None and not self.saving.done():
+            return
+        self.saving = asyncio.create_task(asyncio.to_thread(self.save))
+
+    def search(self, queries: "np.ndarray", k: int = 1) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        批量余弦相似度 top-k 检索
+
+        Args:
+            queries: 形状为 (n, dim) 的归一化查询向量
+            k: 每个查询返回的结果数
+
+        Returns:
+            (scores, indices)，形状均为 (n, k)，按相似度降序
+        """
+        k = min(k, self.size)
+        if k == 0:
+            empty = np.zeros((len(queries), 0))
+            return empty, empty.astype(np.int64)
+
+        # 向量已归一化，点积即余弦相似度
+        scores = queries @ self.vectors[:self.size].T
+        if k == 1:
+            top = np.argmax(scores, axis=1)[:, None]
+        elif k < self.size:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(self.size), (len(queries), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+    def lookup(self, question: str) -> Optional[Tuple[List[str], float]]:
+        """
+        查询语义缓存（阻塞，事件循环中用 alookup）
+
+        Args:
+            question: 用户问题
+
+        Returns:
+            (回答分块, 相似度)，未命中返回 None
+        """
+        query = self.vectorizer.transform([question])
+        with self.lock:
+            scores, indices = self.search(query, k=1)
+            if scores.shape[1] and scores[0, 0] >= self.threshold:
+                index = int(indices[0, 0])
+                self.last_used[index] = time.time()
+                self.counters["hits"] += 1
+                return self.answers[index], float(scores[0, 0])
+
+            self.counters["misses"] += 1
+            return None
+
+    async def alookup(self, question: str) -> Optional[Tuple[List[str], float]]:
+        """在线程池中查询语义缓存（检索整个矩阵，大容量时耗时数十毫秒，不能阻塞事件循环）"""
+        return await asyncio.to_thread(self.lookup, question)
+
+    def add(self, question: str, chunks: List[str]) -> None:
+        """
+        写入语义缓存（阻塞，事件循环中用 aadd）
+
+        Args:
+            question: 用户问题
+            chunks: 回答分块
+        """
+        vector = self.vectorizer.transform_one(question)
+        if not chunks or not vector.any():
+            return
+
+        with self.lock:
+            if self.size < self.capacity:
+                index = self.size
+                self.size += 1
+                self.questions.append(question)
+                self.answers.append(list(chunks))
+            else:
+                # 淘汰最近最少使用的条目
+                index = int(np.argmin(self.last_used))
+                self.questions[index] = question
+                self.answers[index] = list(chunks)
+                self.counters["evictions"] += 1
+
+            self.vectors[index] = vector
+            self.last_used[index] = time.time()
+            self.counters["stores"] += 1
+            self.dirty += 1
+
+    async def aadd(self, question: str, chunks: List[str]) -> None:
+        """在线程池中写入语义缓存，定期在后台落盘（避免进程退出时丢失太多条目）"""
+        await asyncio.to_thread(self.add, question, chunks)
+        if self.dirty >= 100:
+            self.save_in_background()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计
+
+        Returns:
+            命中率、条目数等统计信息
+        """
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "enabled": self.enabled,
+            "entries": self.size,
+            "persisted": self.owner,
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+# 全局语义缓存实例
+semantic_cache = SemanticCache(
+    enabled=settings.semantic_cache_enabled,
+    capacity=settings.semantic_cache_capacity,
+    threshold=settings.semantic_cache_threshold,
+    dim=settings.semantic_cache_dim,
+    index_path=settings.semantic_cache_path,
+)
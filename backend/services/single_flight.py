@@ -0,0 +1,249 @@
+"""
+相同生成请求合并模块（single-flight）
+同一对话（对话哈希 + 模型参数相同）已有生成在进行时，新请求作为订阅者共享同一条上游 token 流，
+不再重复调用模型（前端重试、用户连点发送）
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional, Set
+
+from ..config import settings
+from ..utils.tokens import flatten_content
+from .response_cache import normalize_text
+from .thread_service import thread_service
+
+
+def message_digest(msg_type: str, content: Any) -> bytes:
+    """单条消息的哈希（内容先规范化）"""
+    raw = f"{msg_type}\x00{normalize_text(flatten_content(content))}"
+    return hashlib.sha256(raw.encode("utf-8")).digest()
+
+
+class ConversationDigest:
+    """
+    线程对话的滚动哈希（线程派生视图，只追加）
+
+    每条新消息只哈希它自己并与之前的哈希链接，不再每轮哈希整个历史；
+    线程缓存版本变化（编辑、其他 worker 写入）时随缓存一起重建。
+    哈希只由消息内容决定，不同线程中相同的对话得到相同的哈希。
+    """
+
+    def __init__(self, messages: List[Dict[str, Any]]):
+        """
+        初始化滚动哈希
+
+        Args:
+            messages: 线程缓存中的消息字典列表
+        """
+        self.count = 0
+        self.current = b""  # 全部消息的哈希
+        self.previous = b""  # 除最后一条之外的消息的哈希
+        self.last = b""  # 最后一条消息的哈希
+        for msg in messages:
+            self.append(msg)
+
+    def append(self, msg: Dict[str, Any]) -> None:
+        """
+        追加一条新保存的消息
+
+        Args:
+            msg: 消息字典
+        """
+        self.last = message_digest(msg.get("type", ""), msg.get("content", ""))
+        self.previous = self.current
+        self.current = hashlib.sha256(self.current + self.last).digest()
+        self.count += 1
+
+
+def flight_key(digest: ConversationDigest, message: Optional[str], params: Dict[str, Any]) -> str:
+    """
+    计算合并键：模型参数 + 之前对话的滚动哈希 + 新用户消息的哈希
+
+    之前对话的最后一条如果是内容相同、还没有回复的用户消息（连点发送），
+    不计入哈希，这样重复提交与正在进行的生成得到相同的键。
+
+    Args:
+        digest: 线程对话（不含新消息）的滚动哈希
+        message: 新的用户消息（没有新消息时为 None）
+        params: 模型参数
+
+    Returns:
+        合并键
+    """
+    prefix, item = digest.current, b""
+    if message is not None:
+        item = message_digest("human", message)
+        if is_duplicate_submit(digest, message):
+            prefix = digest.previous
+    raw = json.dumps(params, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(raw + prefix + item).hexdigest()
+
+
+def is_duplicate_submit(digest: ConversationDigest, message: str) -> bool:
+    """判断之前对话的最后一条是否为与新消息内容相同的用户消息"""
+    return digest.count > 0 and digest.last == message_digest("human", message)
+
+
+class Flight:
+    """一次进行中的上游生成（一个生产任务，多个订阅者）"""
+
+    def __init__(self, key: Optional[str], source: AsyncIterator[Any], on_done):
+        """
+        初始化并启动生产任务
+
+        Args:
+            key: 合并键（未启用合并时为 None）
+            source: 上游数据流（文本分块或进度事件）
+            on_done: 生产任务结束时的回调
+        """
+        self.key = key
+        self.chunks: List[str] = []
+        self.subscribers: Set[asyncio.Queue] = set()
+        # 各线程中这条回复的消息ID，以及已经保存完整回复的线程
+        self.message_ids: Dict[str, str] = {}
+        self.persisted: Set[str] = set()
+        self.done = False
+        self.abandoned = False  # 所有订阅者都已离开，上游被取消
+        self.task = asyncio.create_task(self._produce(source, on_done))
+
+    def _publish(self, item: Any) -> None:
+        for queue in self.subscribers:
+            queue.put_nowait(item)
+
+    async def _produce(self, source: AsyncIterator[Any], on_done) -> None:
+        """读取上游并分发给所有订阅者（文本分块同时留存，供后加入的订阅者补齐）"""
+        try:
+            async for item in source:
+                if isinstance(item, str):
+                    self.chunks.append(item)
+                self._publish(item)
+            self._publish(None)
+        except asyncio.CancelledError:
+            self.abandoned = True
+            raise
+        except Exception as e:
+            self._publish(e)
+        finally:
+            self.done = True
+            on_done(self)
+
+    async def subscribe(self, cancel_event: Optional[asyncio.Event] = None) -> AsyncGenerator[Any, None]:
+        """
+        订阅生成结果：先补齐已生成的分块，再接收新的分块
+
+        订阅者各自有独立的缓冲队列，慢的订阅者不会阻塞其他订阅者；
+        订阅者取消时只是自己退订，最后一个订阅者离开时才取消上游生成。
+
+        Args:
+            cancel_event: 订阅者的取消信号（收到后直接结束，由调用方检查信号）
+
+        Yields:
+            文本分块或进度事件
+
+        Raises:
+            上游生成抛出的异常
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        backlog = list(self.chunks)
+        self.subscribers.add(queue)
+        waiter = asyncio.ensure_future((cancel_event or asyncio.Event()).wait())
+        try:
+            for chunk in backlog:
+                yield chunk
+            while True:
+                if queue.empty():
+                    getter = asyncio.ensure_future(queue.get())
+                    await asyncio.wait({getter, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                    if not getter.done():
+                        getter.cancel()
+                        return
+                    item = getter.result()
+                else:
+                    item = queue.get_nowait()
+
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            waiter.cancel()
+            self.subscribers.discard(queue)
+            if not self.subscribers and not self.done:
+                self.task.cancel()
+
+    def message_id(self, thread_id: str, default: str) -> str:
+        """获取这条回复在指定线程中的消息ID（同一线程的订阅者共用一条消息）"""
+        return self.message_ids.setdefault(thread_id, default)
+
+
+class SingleFlight:
+    """相同生成请求合并服务类"""
+
+    def __init__(self, enabled: bool = True):
+        """
+        初始化合并服务
+
+        Args:
+            enabled: 是否启用
+        """
+        self.enabled = enabled
+        self.flights: Dict[str, Flight] = {}
+        self.counters = {"leaders": 0, "followers": 0, "abandoned": 0}
+        if self.enabled:
+            thread_service.register_view("digest", ConversationDigest)
+
+    def get(self, key: str) -> Optional[Flight]:
+        """
+        查找进行中的生成
+
+        Args:
+            key: 合并键
+
+        Returns:
+            进行中的生成，没有时返回 None
+        """
+        if not self.enabled:
+            return None
+        flight = self.flights.get(key)
+        if flight is None or flight.done:
+            return None
+        self.counters["followers"] += 1
+        return flight
+
+    def start(self, key: Optional[str], source: AsyncIterator[Any]) -> Flight:
+        """
+        启动一次可被合并的生成
+
+        Args:
+            key: 合并键（未启用合并时为 None）
+            source: 上游数据流
+
+        Returns:
+            新的生成
+        """
+        flight = Flight(key, source, self._on_done)
+        if self.enabled:
+            self.flights[key] = flight
+        self.counters["leaders"] += 1
+        return flight
+
+    def _on_done(self, flight: Flight) -> None:
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+        if flight.abandoned:
+            self.counters["abandoned"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取合并统计
+
+        Returns:
+            进行中的生成数、发起和合并的请求数
+        """
+        return {"enabled": self.enabled, "in_flight": len(self.flights), **self.counters}
+
+
+# 全局合并服务实例
+single_flight = SingleFlight(enabled=settings.single_flight_enabled)
@@ -0,0 +1,209 @@
+"""
+后台滚动摘要模块
+长线程超过 token 阈值后，在请求路径之外把较早的对话压缩成摘要，后续轮次使用 摘要 + 最近窗口
+"""
+import asyncio
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from ..config import settings
+from ..utils.tokens import count_message_tokens, count_text_tokens, flatten_content
+from .admission import admission_controller, rate_limit_retry_after
+from .database_service import database_service
+from .history_cache import PreparedHistory
+from .llm_service import llm_service
+from .metrics_service import parse_usage
+from .thread_service import thread_service
+
+
+SUMMARY_INSTRUCTIONS = (
+    "你是对话摘要助手。请把给出的对话整理成简洁的中文摘要，"
+    "保留用户的目标、已确认的事实和数据、做出的决定以及尚未解决的问题。"
+    "如果提供了已有摘要，请把新内容合并进去，输出一份完整的新摘要。只输出摘要正文。"
+)
+
+SUMMARY_PREFIX = "以下是本次对话较早部分的摘要：\n"
+
+# 摘要任务共用一个准入队列 key：与用户请求一起计入并发和 RPM/TPM 额度，轮转时只占一个位置
+SUMMARY_QUEUE_KEY = "background:summary"
+
+
+class SummaryService:
+    """后台滚动摘要服务类"""
+
+    def __init__(self):
+        """初始化摘要服务"""
+        self.enabled = settings.summary_enabled
+        self.trigger_tokens = settings.summary_trigger_tokens
+        self.keep_recent_tokens = settings.summary_keep_recent_tokens
+        self.db = database_service
+        # 进行中的摘要任务：同一线程同时只有一个
+        self.jobs: Dict[str, asyncio.Task] = {}
+        self.counters = {"scheduled": 0, "deduplicated": 0, "completed": 0, "failed": 0}
+        if self.enabled:
+            print(f"✅ 后台摘要已启用: 触发阈值 {self.trigger_tokens} tokens")
+
+    def build_context(self, thread_id: str, history: PreparedHistory) -> Tuple[List[BaseMessage], List[int]]:
+        """
+        用摘要替换已覆盖的历史
+
+        Args:
+            thread_id: 线程ID
+            history: 预构建历史
+
+        Returns:
+            (消息列表, 对应的 token 数)
+        """
+        record = self.db.load_summary(thread_id) if self.enabled else None
+        if record is None or record["watermark_seq"] > len(history):
+            return history.messages, history.token_counts
+
+        watermark = record["watermark_seq"]
+        summary_message = SystemMessage(content=SUMMARY_PREFIX + record["summary"])
+        return (
+            [summary_message] + history.messages[watermark:],
+            [count_message_tokens(summary_message)] + history.token_counts[watermark:],
+        )
+
+    def _choose_watermark(self, messages: List[BaseMessage], token_counts: List[int], current: int) -> int:
+        """
+        选择新的水位线：保留最近 keep_recent_tokens 的原文，其余纳入摘要
+
+        Args:
+            messages: 完整历史
+            token_counts: 完整历史的 token 数
+            current: 当前水位线
+
+        Returns:
+            新水位线（不大于 current 时表示无需摘要）
+        """
+        watermark = len(token_counts)
+        recent = 0
+        while watermark > current and recent + token_counts[watermark - 1] <= self.keep_recent_tokens:
+            watermark -= 1
+            recent += token_counts[watermark]
+        # 水位线向前退到一条用户消息上，摘要后的窗口从用户消息开始（不假设用户/助手消息严格交替）
+        while watermark > current and (watermark == len(messages) or messages[watermark].type != "human"):
+            watermark -= 1
+        return watermark
+
+    def maybe_schedule(self, thread_id: str) -> None:
+        """
+        未摘要部分超过阈值时，在后台启动摘要任务（不阻塞当前请求）
+
+        Args:
+            thread_id: 线程ID
+        """
+        if not self.enabled:
+            return
+
+        history = thread_service.get_prepared_history(thread_id)
+        if history is None:
+            return
+
+        record = self.db.load_summary(thread_id)
+        watermark = record["watermark_seq"] if record else 0
+        if sum(history.token_counts[watermark:]) < self.trigger_tokens:
+            return
+
+        job = self.jobs.get(thread_id)
+        if job is not None and not job.done():
+            self.counters["deduplicated"] += 1
+            return
+
+        self.counters["scheduled"] += 1
+        task = asyncio.create_task(self._summarize(thread_id))
+        self.jobs[thread_id] = task
+        task.add_done_callback(lambda _: self.jobs.pop(thread_id, None))
+
+    async def _summarize(self, thread_id: str) -> None:
+        """
+        生成并保存摘要
+
+        Args:
+            thread_id: 线程ID
+        """
+        try:
+            history = thread_service.get_prepared_history(thread_id)
+            if history is None:
+                return
+
+            # 取快照，摘要期间新增的消息不影响本次任务
+            messages = list(history.messages)
+            token_counts = list(history.token_counts)
+            record = self.db.load_summary(thread_id)
+            current = record["watermark_seq"] if record else 0
+
+            watermark = self._choose_watermark(messages, token_counts, current)
+            if watermark <= current:
+                return
+
+            transcript = "\n".join(
+                f"{'用户' if m.type == 'human' else '助手'}: {flatten_content(m.content)}"
+                for m in messages[current:watermark]
+            )
+            request = "新的对话：\n" + transcript
+            if record:
+                request = f"已有摘要：\n{record['summary']}\n\n" + request
+
+            print(f"📝 开始后台摘要: {thread_id}, 消息 {current}-{watermark}")
+            prompt = [SystemMessage(content=SUMMARY_INSTRUCTIONS), HumanMessage(content=request)]
+            response = await self._invoke(prompt)
+
+            self.db.save_summary(thread_id, flatten_content(response.content), watermark)
+            self.counters["completed"] += 1
+            print(f"✅ 后台摘要完成: {thread_id}, 水位线 {watermark}")
+
+        except Exception as e:
+            self.counters["failed"] += 1
+            print(f"❌ 后台摘要失败: {thread_id}: {e}")
+
+    async def _invoke(self, prompt: List[BaseMessage]) -> BaseMessage:
+        """
+        经过准入控制调用摘要模型
+
+        Args:
+            prompt: 摘要请求
+
+        Returns:
+            模型回复
+        """
+        prompt_tokens = sum(count_message_tokens(message) for message in prompt)
+        ticket = admission_controller.enqueue(SUMMARY_QUEUE_KEY, prompt_tokens + settings.summary_max_tokens)
+        actual_tokens = None
+        try:
+            async for _ in admission_controller.wait(ticket):
+                pass
+            response = await llm_service.get_summary_llm().ainvoke(prompt)
+            usage = parse_usage(response)
+            actual_tokens = (
+                usage["prompt_tokens"] + usage["completion_tokens"] if usage
+                else prompt_tokens + count_text_tokens(flatten_content(response.content))
+            )
+            return response
+        except Exception as e:
+            # 服务商限流：暂停放行后续请求
+            retry_after = rate_limit_retry_after(e)
+            if retry_after is not None:
+                admission_controller.on_rate_limited(retry_after)
+            raise
+        finally:
+            admission_controller.release(ticket, actual_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取摘要统计
+
+        Returns:
+            任务计数和进行中的任务数
+        """
+        return {
+            "enabled": self.enabled,
+            "running": sum(1 for job in self.jobs.values() if not job.done()),
+            **self.counters,
+        }
+
+
+# 全局摘要服务实例
+summary_service = SummaryService()
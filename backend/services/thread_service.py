@@ -1,10 +1,11 @@
 """
 线程管理服务模块
 """
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable
 from datetime import datetime
 from ..models.schemas import ThreadInfo
 from .database_service import database_service
+from .history_cache import PreparedHistory, SerializedMessages
 
 
 class ThreadService:
@@ -14,8 +15,91 @@ class ThreadService:
         """初始化线程服务"""
         # 内存缓存，用于快速访问
         self.thread_cache: Dict[str, Dict[str, Any]] = {}
+        # 缓存对应的数据库版本号（多 worker 时用于判断缓存是否过期）
+        self.cache_versions: Dict[str, int] = {}
+        # 缓存最近一次校验通过时的 PRAGMA data_version
+        self.cache_checked_at: Dict[str, int] = {}
+        # 基于缓存消息增量维护的派生视图：{thread_id: {视图名: 视图}}
+        # 视图需实现 append(msg)，缓存失效时随之丢弃
+        self.view_factories: Dict[str, Callable[[List[Dict[str, Any]]], Any]] = {}
+        self.thread_views: Dict[str, Dict[str, Any]] = {}
         self.db = database_service
+        self.register_view("prepared", PreparedHistory)
+        self.register_view("json", SerializedMessages)
         print("✅ 线程服务初始化完成")
+
+    def register_view(self, name: str, factory: Callable[[List[Dict[str, Any]]], Any]) -> None:
+        """
+        注册线程派生视图
+
+        Args:
+            name: 视图名称
+            factory: 由完整消息列表构建视图的工厂函数
+        """
+        self.view_factories[name] = factory
+
+    def _cache_put(self, thread_id: str, thread_data: Dict[str, Any], data_version: int) -> None:
+        """写入缓存并记录版本号"""
+        self.cache_versions[thread_id] = thread_data.pop("version", 0)
+        self.cache_checked_at[thread_id] = data_version
+        self.thread_cache[thread_id] = thread_data
+        self.thread_views.pop(thread_id, None)
+
+    def _cache_drop(self, thread_id: str) -> None:
+        """移除线程缓存"""
+        self.thread_cache.pop(thread_id, None)
+        self.thread_views.pop(thread_id, None)
+        self.cache_versions.pop(thread_id, None)
+        self.cache_checked_at.pop(thread_id, None)
+
+    def _cache_is_fresh(self, thread_id: str) -> bool:
+        """
+        校验线程缓存是否仍然有效
+
+        先比较 PRAGMA data_version：没有任何连接写过数据库时直接命中；
+        否则再比较该线程的版本号，只有版本号变化才需要重新加载。
+
+        Args:
+            thread_id: 线程ID
+
+        Returns:
+            缓存是否有效
+        """
+        if thread_id not in self.thread_cache:
+            return False
+
+        data_version = self.db.data_version()
+        if self.cache_checked_at.get(thread_id) == data_version:
+            return True
+
+        if self.db.get_thread_version(thread_id) != self.cache_versions.get(thread_id):
+            self._cache_drop(thread_id)
+            print(f"♻️ 线程缓存已过期: {thread_id}")
+            return False
+
+        self.cache_checked_at[thread_id] = data_version
+        return True
+
+    def _cache_advance(self, thread_id: str, new_version: int) -> bool:
+        """
+        本进程写入后推进缓存版本号
+
+        写入前后版本号恰好相差 1 说明期间没有其他进程写入，缓存可以继续使用；
+        否则丢弃缓存，下次读取时重新加载。
+
+        Args:
+            thread_id: 线程ID
+            new_version: 写入后的版本号
+
+        Returns:
+            缓存是否仍然有效
+        """
+        if self.cache_versions.get(thread_id) != new_version - 1:
+            self._cache_drop(thread_id)
+            return False
+
+        self.cache_versions[thread_id] = new_version
+        return True
     
     def create_thread(self, thread_id: str) -> None:
         """
@@ -26,16 +110,18 @@ class ThreadService:
         """
         created_at = datetime.now().isoformat()
 
-        # 保存到数据库
-        self.db.save_thread(thread_id, created_at)
+        # 保存到数据库（先取 data_version，写入期间其他进程的提交会在下次读取时被校验到）
+        data_version = self.db.data_version()
+        version = self.db.save_thread(thread_id, created_at)
 
         # 更新缓存
-        self.thread_cache[thread_id] = {
+        self._cache_put(thread_id, {
             "thread_id": thread_id,
             "messages": [],
             "created_at": created_at,
             "updated_at": created_at,
-        }
+            "version": version,
+        }, data_version)
 
         print(f"🆕 创建新线程: {thread_id}")
 
@@ -49,18 +135,28 @@ class ThreadService:
             msg_type: 消息类型（human/ai）
             content: 消息内容
         """
+        # 覆盖已有消息属于修改，派生视图无法增量更新
+        is_edit = thread_id in self.thread_cache and self.db.message_exists(msg_id)
+
         # 保存到数据库
-        self.db.save_message(thread_id, msg_id, msg_type, content)
+        version = self.db.save_message(thread_id, msg_id, msg_type, content)
 
         # 更新缓存
-        if thread_id in self.thread_cache:
-            self.thread_cache[thread_id]["messages"].append({
+        if is_edit:
+            self._cache_drop(thread_id)
+        elif thread_id in self.thread_cache and self._cache_advance(thread_id, version):
+            message = {
                 "id": msg_id,
                 "type": msg_type,
                 "content": content
-            })
+            }
+            self.thread_cache[thread_id]["messages"].append(message)
             self.thread_cache[thread_id]["updated_at"] = datetime.now().isoformat()
 
+            # 增量更新派生视图
+            for view in self.thread_views.get(thread_id, {}).values():
+                view.append(message)
+
         print(f"💾 保存消息到数据库: {msg_type} - {content[:50]}...")
     
     def get_thread(self, thread_id: str) -> Optional[Dict[str, Any]]:
@@ -73,19 +169,64 @@ class ThreadService:
         Returns:
             线程信息字典，如果不存在则返回 None
         """
-        # 先检查缓存
-        if thread_id in self.thread_cache:
+        # 先检查缓存（只做廉价的版本校验）
+        if self._cache_is_fresh(thread_id):
             return self.thread_cache[thread_id]
 
-        # 从数据库加载
+        # 从数据库加载（先取 data_version，保证之后的写入一定会触发重新校验）
+        data_version = self.db.data_version()
         thread_data = self.db.load_thread(thread_id)
         if thread_data:
             # 更新缓存
-            self.thread_cache[thread_id] = thread_data
+            self._cache_put(thread_id, thread_data, data_version)
             print(f"📥 从数据库加载线程: {thread_id}")
 
         return thread_data
     
+    def get_view(self, thread_id: str, name: str) -> Optional[Any]:
+        """
+        获取线程派生视图，不存在时由当前缓存构建
+
+        Args:
+            thread_id: 线程ID
+            name: 视图名称
+
+        Returns:
+            视图对象，线程不存在时返回 None
+        """
+        thread = self.get_thread(thread_id)
+        if thread is None:
+            return None
+
+        views = self.thread_views.setdefault(thread_id, {})
+        if name not in views:
+            views[name] = self.view_factories[name](thread["messages"])
+        return views[name]
+
+    def get_prepared_history(self, thread_id: str) -> Optional[PreparedHistory]:
+        """
+        获取线程的预构建 LangChain 消息列表
+
+        Args:
+            thread_id: 线程ID
+
+        Returns:
+            预构建历史，线程不存在时返回 None
+        """
+        return self.get_view(thread_id, "prepared")
+
+    def get_serialized_messages(self, thread_id: str) -> Optional[SerializedMessages]:
+        """
+        获取线程消息列表的 JSON 编码缓存
+
+        Args:
+            thread_id: 线程ID
+
+        Returns:
+            编码缓存，线程不存在时返回 None
+        """
+        return self.get_view(thread_id, "json")
+
     def get_all_threads(self) -> List[Dict[str, Any]]:
         """
         获取所有线程
@@ -93,12 +234,21 @@ class ThreadService:
         Returns:
             线程信息列表
         """
-        # 从数据库加载所有线程
-        threads = self.db.load_all_threads()
+        # 只读取线程列表和版本号，版本未变的线程直接复用缓存
+        data_version = self.db.data_version()
+        threads = []
+        for info in self.db.load_thread_index():
+            thread_id = info["thread_id"]
+            if thread_id in self.thread_cache and self.cache_versions.get(thread_id) == info["version"]:
+                self.cache_checked_at[thread_id] = data_version
+                threads.append(self.thread_cache[thread_id])
+                continue
 
-        # 更新缓存
-        for thread in threads:
-            self.thread_cache[thread["thread_id"]] = thread
+            # 版本变化或未缓存的线程才重新加载
+            thread_data = self.db.load_thread(thread_id)
+            if thread_data:
+                self._cache_put(thread_id, thread_data, data_version)
+                threads.append(thread_data)
 
         print(f"📋 搜索线程: 找到 {len(threads)} 个线程")
         return threads
@@ -117,8 +267,7 @@ class ThreadService:
         success = self.db.delete_thread(thread_id)
 
         # 从缓存删除
-        if thread_id in self.thread_cache:
-            del self.thread_cache[thread_id]
+        self._cache_drop(thread_id)
 
         if success:
             print(f"🗑️ 删除线程: {thread_id}")
@@ -136,7 +285,7 @@ class ThreadService:
             线程是否存在
         """
         # 先检查缓存
-        if thread_id in self.thread_cache:
+        if self._cache_is_fresh(thread_id):
             return True
 
         # 检查数据库
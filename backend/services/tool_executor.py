@@ -0,0 +1,167 @@
+"""
+工具执行模块
+ReAct Agent 的工具节点（ToolNode）通过 awrap_tool_call 接入这里：
+- 同一步的多个工具调用并发执行，每个调用有独立的超时（超时返回错误结果给模型，不中断整个运行）
+- 同步工具在有上限的专用线程池中执行，异步工具直接在事件循环中执行
+- 每个调用开始和结束时通过 custom 流写出 tool_start / tool_end 事件，按实际完成顺序到达客户端
+- 带缓存的工具（utils.tool_cache）命中缓存时，tool_end 事件带 cached 标记
+"""
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import BaseTool, StructuredTool
+from langgraph.prebuilt import ToolNode
+from langgraph.prebuilt.tool_node import ToolCallRequest
+
+from ..config import settings
+from ..utils.tool_cache import tool_cache_status
+
+
+class ToolExecutor:
+    """并发、限时的工具执行器"""
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        default_timeout: float = 30.0,
+        timeouts: Optional[Dict[str, float]] = None,
+    ):
+        """
+        初始化工具执行器
+
+        Args:
+            max_workers: 同步工具线程池大小
+            default_timeout: 默认的单个工具调用超时（秒），0 表示不限制
+            timeouts: 按工具名配置的超时（优先于工具 metadata 中的 timeout 和默认值）
+        """
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.timeouts = timeouts or {}
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self.in_flight = 0
+        self.counters = {"calls": 0, "errors": 0, "timeouts": 0, "cache_hits": 0}
+
+    def timeout_for(self, tool: Optional[BaseTool], name: str) -> float:
+        """
+        工具调用的超时时间
+
+        Args:
+            tool: 工具（未注册的工具为 None）
+            name: 工具名
+
+        Returns:
+            超时秒数，0 表示不限制
+        """
+        if name in self.timeouts:
+            return self.timeouts[name]
+        metadata = (tool.metadata or {}) if tool is not None else {}
+        return metadata.get("timeout", self.default_timeout)
+
+    def tool_node(self, tools: Sequence[BaseTool], **kwargs: Any) -> ToolNode:
+        """
+        创建使用本执行器的工具节点（可直接传给 create_react_agent 的 tools 参数）
+
+        Args:
+            tools: 工具列表
+            **kwargs: 透传给 ToolNode 的其他参数
+
+        Returns:
+            工具节点
+        """
+        return ToolNode([self._pooled(tool) for tool in tools], awrap_tool_call=self.wrap_tool_call, **kwargs)
+
+    def _pooled(self, tool: BaseTool) -> BaseTool:
+        """同步函数工具改为在专用线程池中执行（默认会进入事件循环的共享线程池，没有上限也无法区分）"""
+        if not isinstance(tool, StructuredTool) or tool.coroutine is not None or tool.func is None:
+            return tool
+        func = tool.func
+        pool = self.pool
+
+        @functools.wraps(func)
+        async def coroutine(*args, **kwargs):
+            # 复制上下文，工具内的回调和 get_stream_writer() 在线程中照常可用
+            context = contextvars.copy_context()
+            call = functools.partial(context.run, func, *args, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(pool, call)
+
+        return tool.model_copy(update={"coroutine": coroutine})
+
+    async def wrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        execute: Callable[[ToolCallRequest], Awaitable[Any]],
+    ) -> Any:
+        """
+        执行单个工具调用（ToolNode 对同一步的多个调用并发调用本方法）
+
+        Args:
+            request: 工具调用请求
+            execute: ToolNode 的执行函数（参数注入、校验和错误处理）
+
+        Returns:
+            ToolMessage（或工具返回的 Command）
+        """
+        call = request.tool_call
+        name = call["name"]
+        timeout = self.timeout_for(request.tool, name)
+        write = request.runtime.stream_writer
+        self.counters["calls"] += 1
+        self.in_flight += 1
+        write({"type": "tool_start", "tool": name, "id": call["id"], "args": call["args"]})
+        started = time.perf_counter()
+        # 缓存在工具函数内部把命中情况写入这里（线程池中的同步工具复制了上下文，写入的是同一个 dict）
+        cache_status: Dict[str, bool] = {}
+        token = tool_cache_status.set(cache_status)
+        try:
+            result = await asyncio.wait_for(execute(request), timeout or None)
+        except asyncio.TimeoutError:
+            # 同步工具的线程无法强制结束，会在后台跑完，结果被丢弃
+            self.counters["timeouts"] += 1
+            print(f"⏱️ 工具 {name} 超时（{timeout:g}s）")
+            result = ToolMessage(
+                content=f"工具 {name} 超时（{timeout:g}s 未返回），请稍后重试或换一种方式回答",
+                name=name,
+                tool_call_id=call["id"],
+                status="error",
+            )
+        finally:
+            tool_cache_status.reset(token)
+            self.in_flight -= 1
+
+        # 工具也可以返回 Command（直接更新状态），这时没有文本结果
+        is_message = isinstance(result, ToolMessage)
+        status = result.status if is_message else "success"
+        if status == "error":
+            self.counters["errors"] += 1
+        event = {
+            "type": "tool_end", "tool": name, "id": call["id"], "output": result.content if is_message else "",
+            "status": status, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        # 命中缓存或合并到进行中的相同调用，都没有再访问后端
+        if cache_status:
+            self.counters["cache_hits"] += 1
+            event["cached"] = True
+        write(event)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取工具执行统计
+
+        Returns:
+            线程池大小、进行中的调用数和计数器
+        """
+        return {"max_workers": self.max_workers, "in_flight": self.in_flight, **self.counters}
+
+
+# 全局工具执行器实例
+tool_executor = ToolExecutor(
+    max_workers=settings.tool_max_workers,
+    default_timeout=settings.tool_timeout_seconds,
+    timeouts=settings.tool_timeouts,
+)
@@ -0,0 +1,25 @@
+"""
+Utils module
+不依赖配置和全局服务，可以被 graph.py 等独立入口直接导入
+"""
+from .tokens import count_text_tokens, count_message_tokens, flatten_content
+from .context import ContextAssembler
+from .chunking import split_document
+from .checkpoint import AsyncSqliteCheckpointer
+from .streaming import astream_filtered, STREAM_MODES
+from .tool_cache import cached_tool, no_cache, cache_tools, tool_cache_stats
+
+__all__ = [
+    "ContextAssembler",
+    "count_text_tokens",
+    "count_message_tokens",
+    "flatten_content",
+    "split_document",
+    "AsyncSqliteCheckpointer",
+    "astream_filtered",
+    "STREAM_MODES",
+    "cached_tool",
+    "no_cache",
+    "cache_tools",
+    "tool_cache_stats",
+]
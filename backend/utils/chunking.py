@@ -0,0 +1,69 @@
+"""
+长文本切分模块
+按结构边界（标题 > 段落 > 行 > 句子）递归切分，再把相邻小片段合并到 token 上限以内
+"""
+import re
+from typing import List
+
+from .tokens import count_text_tokens
+
+# 零宽切分点，切分后直接拼接即可还原原文
+SEPARATORS = [
+    re.compile(r"(?<=\n)(?=#{1,6}\s)"),      # Markdown 标题之前
+    re.compile(r"(?<=\n\n)(?!\n)"),           # 空行（段落）之后
+    re.compile(r"(?<=\n)(?!\n)"),             # 换行之后
+    re.compile(r"(?<=[。！？；!?;])|(?<=\. )"),  # 句末标点之后
+]
+
+
+def _hard_split(text: str, tokens: int, max_tokens: int) -> List[str]:
+    """没有结构边界可用时按字符数等分"""
+    parts = -(-tokens // max_tokens)
+    size = -(-len(text) // parts)
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _split_recursive(text: str, max_tokens: int, level: int) -> List[str]:
+    """逐级使用更细的分隔符，直到每个片段都不超过上限"""
+    tokens = count_text_tokens(text)
+    if tokens <= max_tokens:
+        return [text]
+    if level >= len(SEPARATORS):
+        return _hard_split(text, tokens, max_tokens)
+
+    parts = [part for part in SEPARATORS[level].split(text) if part]
+    if len(parts) == 1:
+        return _split_recursive(text, max_tokens, level + 1)
+
+    pieces: List[str] = []
+    for part in parts:
+        pieces.extend(_split_recursive(part, max_tokens, level + 1))
+    return pieces
+
+
+def split_document(text: str, max_tokens: int) -> List[str]:
+    """
+    把长文本切分为不超过 max_tokens 的片段
+
+    优先在标题、段落、行、句子边界处切分，片段按原文顺序排列，拼接后等于原文。
+
+    Args:
+        text: 原始文本
+        max_tokens: 每个片段的 token 上限
+
+    Returns:
+        片段列表
+    """
+    chunks: List[str] = []
+    current = ""
+    current_tokens = 0
+    for piece in _split_recursive(text, max_tokens, 0):
+        piece_tokens = count_text_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = "", 0
+        current += piece
+        current_tokens += piece_tokens
+    if current:
+        chunks.append(current)
+    return chunks
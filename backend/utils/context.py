@@ -0,0 +1,171 @@
+"""
+上下文组装模块
+按 token 预算组装上下文，替代固定条数的历史截断
+
+支持两种窗口策略：
+- newest: 从最新消息往前逐条填充，尽量用满预算
+- block: 按固定条数的块整体丢弃最早的历史，窗口起点只在跨过块边界时移动，
+  相邻轮次的 prompt 前缀保持逐字节一致，可以命中服务商的前缀缓存
+"""
+import os
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage
+
+from .tokens import count_message_tokens
+
+
+class ContextAssembler:
+    """基于 token 预算的上下文组装器"""
+
+    def __init__(
+        self,
+        context_window: int = 64000,
+        max_tokens: int = 4096,
+        reserve_tokens: int = 1024,
+        cache_size: int = 10000,
+        strategy: str = "block",
+        block_size: int = 8,
+    ):
+        """
+        初始化上下文组装器
+
+        Args:
+            context_window: 模型上下文窗口大小
+            max_tokens: 为回复预留的最大输出 token 数
+            reserve_tokens: 额外预留（工具定义、格式开销等）
+            cache_size: token 计数缓存的最大条目数
+            strategy: 窗口策略（newest/block）
+            block_size: block 策略下每块的消息条数（取偶数可让窗口从用户消息开始）
+        """
+        if strategy not in ("newest", "block"):
+            raise ValueError(f"未知的上下文窗口策略: {strategy}")
+
+        self.context_window = context_window
+        self.max_tokens = max_tokens
+        self.reserve_tokens = reserve_tokens
+        self.strategy = strategy
+        self.block_size = max(1, block_size)
+        self.cache_size = cache_size
+        # (消息类型, 内容) -> token 数
+        self.token_cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls, max_tokens: Optional[int] = None) -> "ContextAssembler":
+        """
+        从环境变量创建（供不使用 backend 配置的独立入口使用）
+
+        Args:
+            max_tokens: 输出 token 上限，默认读取 DEEPSEEK_MAX_TOKENS
+
+        Returns:
+            上下文组装器
+        """
+        if max_tokens is None:
+            max_tokens = int(os.getenv("DEEPSEEK_MAX_TOKENS", "4096"))
+        return cls(
+            context_window=int(os.getenv("DEEPSEEK_CONTEXT_WINDOW", "64000")),
+            max_tokens=max_tokens,
+            reserve_tokens=int(os.getenv("DEEPSEEK_CONTEXT_RESERVE", "1024")),
+            strategy=os.getenv("DEEPSEEK_CONTEXT_STRATEGY", "block"),
+            block_size=int(os.getenv("DEEPSEEK_CONTEXT_BLOCK_SIZE", "8")),
+        )
+
+    @property
+    def budget(self) -> int:
+        """可用于 prompt 的 token 预算"""
+        return max(0, self.context_window - self.max_tokens - self.reserve_tokens)
+
+    def count(self, message: BaseMessage) -> int:
+        """
+        计算消息 token 数（带缓存）
+
+        Args:
+            message: LangChain 消息
+
+        Returns:
+            token 数
+        """
+        content = message.content if isinstance(message.content, str) else repr(message.content)
+        key = (message.type, content)
+        tokens = self.token_cache.get(key)
+        if tokens is None:
+            tokens = count_message_tokens(message)
+            self.token_cache[key] = tokens
+            if len(self.token_cache) > self.cache_size:
+                self.token_cache.popitem(last=False)
+        return tokens
+
+    def _window_start(self, body_counts: List[int], budget: int) -> int:
+        """
+        计算窗口起点（body_counts 中的下标）
+
+        Args:
+            body_counts: 非系统消息的 token 数（按时间顺序）
+            budget: 非系统消息可用的 token 预算
+
+        Returns:
+            窗口起点，窗口至少包含最后一条消息
+        """
+        n = len(body_counts)
+        if n == 0:
+            return 0
+
+        # 后缀和：suffix[i] 为从第 i 条到最后一条的 token 总数
+        suffix = [0] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            suffix[i] = suffix[i + 1] + body_counts[i]
+
+        if self.strategy == "block":
+            # 起点只取块边界，预算内最早的块边界即窗口起点
+            for start in range(0, n, self.block_size):
+                if suffix[start] <= budget:
+                    return start
+
+        # newest 策略，或最后一块也放不下时：从最新消息往前逐条填充
+        start = n - 1
+        while start > 0 and suffix[start - 1] <= budget:
+            start -= 1
+        return start
+
+    def assemble(
+        self,
+        messages: Sequence[BaseMessage],
+        token_counts: Optional[Sequence[int]] = None,
+        budget: Optional[int] = None,
+    ) -> Tuple[List[BaseMessage], int]:
+        """
+        组装上下文：保留所有系统消息，其余消息按窗口策略截取连续的最新一段
+
+        最新一条消息总会被保留（即使单条就超出预算）。
+
+        Args:
+            messages: 完整的消息列表
+            token_counts: 与 messages 对应的已知 token 数（如预构建历史中的缓存值）
+            budget: 本次使用的 token 预算，默认为 self.budget（需要给其他内容预留空间时传入更小的值）
+
+        Returns:
+            (发送给模型的消息, prompt token 数)
+        """
+        counts = list(token_counts) if token_counts is not None else [self.count(m) for m in messages]
+        if budget is None:
+            budget = self.budget
+
+        pinned_tokens = 0
+        body_indices = []
+        for i, message in enumerate(messages):
+            if message.type == "system":
+                pinned_tokens += counts[i]
+            else:
+                body_indices.append(i)
+
+        start = self._window_start([counts[i] for i in body_indices], budget - pinned_tokens)
+        dropped = set(body_indices[:start])
+        keep = [i for i in range(len(messages)) if i not in dropped]
+        prompt_tokens = sum(counts[i] for i in keep)
+
+        print(f"🧮 上下文: 发送 {len(keep)}/{len(messages)} 条消息, "
+              f"{prompt_tokens} tokens（预算 {budget}, 策略 {self.strategy}）"
+              + (f", 丢弃最早的 {len(dropped)} 条" if dropped else ""))
+        return [messages[i] for i in keep], prompt_tokens
@@ -0,0 +1,86 @@
+"""
+本地文本向量化模块
+把字符 n-gram 哈希到固定维度（hashing trick），不依赖任何模型或外部 API
+"""
+import unicodedata
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+
+
+def normalize_for_embedding(text: str) -> str:
+    """
+    向量化前的文本规范化：转小写、全角转半角、去掉标点和空白
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        规范化后的文本
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(
+        ch for ch in text
+        if not unicodedata.category(ch).startswith(("P", "Z", "C", "S"))
+    )
+
+
+class HashingVectorizer:
+    """字符 n-gram 哈希向量化器"""
+
+    def __init__(self, dim: int = 256, ngram_range: Tuple[int, int] = (1, 3)):
+        """
+        初始化向量化器
+
+        Args:
+            dim: 向量维度
+            ngram_range: 字符 n-gram 的长度范围（含两端）
+        """
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _ngram_buckets(self, text: str) -> Tuple[List[int], List[float]]:
+        """计算文本所有 n-gram 的哈希桶和符号"""
+        buckets: List[int] = []
+        signs: List[float] = []
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                buckets.append(h % self.dim)
+                # 用哈希的最高位决定符号，减少碰撞带来的偏差
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+        return buckets, signs
+
+    def transform(self, texts: List[str]) -> np.ndarray:
+        """
+        批量向量化
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            形状为 (len(texts), dim) 的 float32 矩阵，每行已 L2 归一化（空文本为零向量）
+        """
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets, signs = self._ngram_buckets(normalize_for_embedding(text))
+            if buckets:
+                np.add.at(matrix[row], buckets, signs)
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    def transform_one(self, text: str) -> np.ndarray:
+        """
+        向量化单条文本
+
+        Args:
+            text: 文本
+
+        Returns:
+            形状为 (dim,) 的归一化向量
+        """
+        return self.transform([text])[0]
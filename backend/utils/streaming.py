@@ -0,0 +1,102 @@
+"""
+图事件流过滤模块
+替代 astream_events(version="v2")：astream_events 为每个 runnable 的开始/结束和每个回调都构造事件字典，
+调用方只用其中的 token 和工具事件。这里只订阅调用方需要的事件种类对应的 stream_mode：
+
+- tokens: stream_mode="messages"，只保留 AI 消息分块
+- tools: stream_mode="updates"，从模型节点发出的工具调用得到 tool_start，从工具节点返回的 ToolMessage 得到 tool_end；
+  同时订阅 custom，工具执行器（ToolExecutor）在每个调用开始和结束时写出的事件更及时（不必等整个工具节点结束），
+  并带有耗时和状态，同一个调用只输出先到达的那一次
+- custom: stream_mode="custom"，节点或工具内通过 get_stream_writer() 写出的数据原样透传
+
+节点内部运行的子图（例如在节点中 ainvoke 一个 ReAct Agent）的工具事件只有 subgraphs=True 时才会输出。
+"""
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+# 事件种类 -> 订阅的 stream_mode
+STREAM_MODES = {
+    "tokens": ("messages",),
+    "tools": ("updates", "custom"),
+    "custom": ("custom",),
+}
+
+# 工具执行器写到 custom 流中的事件类型
+TOOL_EVENT_TYPES = ("tool_start", "tool_end")
+
+
+async def astream_filtered(
+    graph: Any,
+    input: Any,
+    config: Optional[Dict[str, Any]] = None,
+    kinds: Iterable[str] = ("tokens", "tools"),
+    subgraphs: bool = False,
+    **kwargs: Any,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    按事件种类流式运行图
+
+    Args:
+        graph: 编译好的图
+        input: 图的输入
+        config: 运行配置
+        kinds: 需要的事件种类（tokens/tools/custom）
+        subgraphs: 是否同时输出子图的工具事件和 custom 数据
+        **kwargs: 透传给 graph.astream 的其他参数（如 context）
+
+    Yields:
+        ("token", AI 消息分块)、("tool_start", {"tool", "args", "id"})、
+        ("tool_end", {"tool", "output", "id", "status"?, "elapsed_ms"?}) 或 ("custom", 写出的数据)
+
+    Raises:
+        ValueError: 未知的事件种类
+    """
+    kinds = set(kinds)
+    unknown = kinds - STREAM_MODES.keys()
+    if unknown:
+        raise ValueError(f"未知的事件种类: {', '.join(sorted(unknown))}")
+    stream_modes = list(dict.fromkeys(mode for kind in STREAM_MODES if kind in kinds for mode in STREAM_MODES[kind]))
+    # 已输出过的 (事件, 工具调用ID)
+    seen_tool_events = set()
+
+    async for chunk in graph.astream(input, config, stream_mode=stream_modes, subgraphs=subgraphs, **kwargs):
+        # subgraphs=True 时每项前面多一个命名空间
+        mode, payload = chunk[-2:]
+        if mode == "messages":
+            message, _ = payload
+            # 工具节点返回的 ToolMessage 等也会出现在 messages 流中；
+            # 不流式输出的模型只在节点结束时给出完整的 AIMessage（已流式输出过的不会重复出现）
+            if isinstance(message, AIMessage) and message.content:
+                yield "token", message
+            continue
+
+        if mode == "updates":
+            events = list(_tool_events(payload))
+        elif "tools" in kinds and isinstance(payload, dict) and payload.get("type") in TOOL_EVENT_TYPES:
+            data = {key: value for key, value in payload.items() if key != "type"}
+            events = [(payload["type"], data)]
+        else:
+            if "custom" in kinds:
+                yield "custom", payload
+            continue
+        for kind, data in events:
+            key = (kind, data["id"])
+            if key not in seen_tool_events:
+                seen_tool_events.add(key)
+                yield kind, data
+
+
+def _tool_events(update: Dict[str, Any]) -> Iterable[Tuple[str, Dict[str, Any]]]:
+    """从一个节点更新中提取工具事件"""
+    for node_update in update.values():
+        # 中断（__interrupt__）等非字典更新没有消息
+        if not isinstance(node_update, dict):
+            continue
+        messages = node_update.get("messages") or []
+        for message in messages if isinstance(messages, list) else [messages]:
+            if isinstance(message, ToolMessage):
+                yield "tool_end", {"tool": message.name, "output": message.content, "id": message.tool_call_id}
+            elif isinstance(message, AIMessage):
+                for tool_call in message.tool_calls:
+                    yield "tool_start", {"tool": tool_call["name"], "args": tool_call["args"], "id": tool_call["id"]}
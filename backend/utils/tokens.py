@@ -0,0 +1,85 @@
+"""
+Token 计数模块
+优先使用 tiktoken 本地分词器，未安装时退回到按字符估算
+"""
+from typing import Any, Optional
+
+# 每条消息的固定开销（角色标记、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding: Any = None
+_encoding_loaded = False
+
+
+def _get_encoding() -> Optional[Any]:
+    """懒加载 tiktoken 编码器，失败时返回 None"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+            print("⚠️  tiktoken 不可用，使用字符数估算 token")
+    return _encoding
+
+
+def flatten_content(content: Any) -> str:
+    """
+    将消息内容展平为纯文本
+
+    Args:
+        content: 字符串或多模态内容列表
+
+    Returns:
+        纯文本内容
+    """
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        text_parts = [
+            item.get("text", "") for item in content
+            if isinstance(item, dict) and item.get("type") == "text"
+        ]
+        return " ".join(text_parts)
+    return str(content) if content is not None else ""
+
+
+def count_text_tokens(text: str) -> int:
+    """
+    计算文本的 token 数
+
+    Args:
+        text: 文本
+
+    Returns:
+        token 数
+    """
+    if not text:
+        return 0
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    # 估算：CJK 字符按 1 token 计，其余按 4 字符 1 token 计
+    cjk = sum(1 for ch in text if "\u2e80" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_message_tokens(message: Any) -> int:
+    """
+    计算单条消息的 token 数（含固定开销）
+
+    Args:
+        message: LangChain 消息或 {"type", "content"} 字典
+
+    Returns:
+        token 数
+    """
+    if isinstance(message, dict):
+        content = message.get("content", "")
+    else:
+        content = getattr(message, "content", "")
+    return count_text_tokens(flatten_content(content)) + MESSAGE_OVERHEAD_TOKENS
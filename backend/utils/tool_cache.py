@@ -0,0 +1,329 @@
+"""
+工具结果缓存模块
+为 @tool 定义的工具声明式地加上 TTL 缓存：同样参数（规范化后）的调用在有效期内直接返回上次的结果，
+参数先规范化（默认去掉字符串首尾空白）再传给工具并作为缓存 key，同一时刻的相同调用只执行一次（其余调用等待它的结果），缓存条目数有上限（LRU 淘汰）。
+
+- cached_tool(ttl=...)：给单个工具加缓存（写在 @tool 之上）
+- no_cache：声明工具不能缓存（结果依赖调用时刻或有副作用），cache_tools 会跳过
+- cache_tools(tools, ttl=...)：给一组工具中没有声明过的工具统一加缓存
+
+命中情况通过 tool_cache_status 上下文变量告诉调用方（工具执行器据此在 tool_end 事件中标记 cached），
+各工具的命中统计由 tool_cache_stats() 汇总。
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+# 调用方设置为一个 dict，缓存命中时写入 {"cached": True}，合并到进行中的调用时写入 {"coalesced": True}
+tool_cache_status: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("tool_cache_status", default=None)
+
+# 工具框架注入的参数，不参与缓存 key
+INJECTED_ARGS = ("callbacks", "run_manager", "config")
+
+# 所有工具缓存：工具名 -> 缓存
+_caches: Dict[str, "ToolCache"] = {}
+
+
+def normalize_args(args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    默认的参数规范化：字符串去掉首尾空白
+
+    Args:
+        args: 工具参数
+
+    Returns:
+        规范化后的参数
+    """
+    return {key: value.strip() if isinstance(value, str) else value for key, value in args.items()}
+
+
+def cache_key(args: Dict[str, Any]) -> str:
+    """
+    缓存 key：按参数名排序后序列化（不含工具框架注入的参数）
+
+    Args:
+        args: 规范化后的工具参数
+
+    Returns:
+        缓存 key
+    """
+    keyed = {key: value for key, value in args.items() if key not in INJECTED_ARGS}
+    return json.dumps(keyed, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class ToolCache:
+    """单个工具的 TTL 缓存（线程安全，同步工具在线程池中执行时也可使用）"""
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float = 300.0,
+        maxsize: int = 1024,
+        normalize: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    ):
+        """
+        初始化工具缓存
+
+        Args:
+            name: 工具名
+            ttl: 有效期（秒）
+            maxsize: 最多缓存的结果数
+            normalize: 参数规范化函数（参数 dict -> 规范化后的参数 dict），默认使用 normalize_args
+        """
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.normalize = normalize or normalize_args
+        self.entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self.in_flight: Dict[Any, Future] = {}
+        self.tasks: set = set()  # 异步工具进行中的调用（由缓存持有，不随发起方一起取消）
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+
+    def _lookup(self, key: Any) -> tuple:
+        """
+        查找缓存（调用方持有锁）
+
+        Returns:
+            (是否命中, 结果或进行中调用的 Future)；都没有时返回 (False, None)
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return True, value
+            del self.entries[key]
+            self.counters["expired"] += 1
+        return False, self.in_flight.get(key)
+
+    def _store(self, key: Any, value: Any) -> None:
+        """保存结果（调用方持有锁）"""
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _begin(self, args: Dict[str, Any]) -> tuple:
+        """
+        开始一次调用
+
+        Args:
+            args: 规范化后的工具参数
+
+        Returns:
+            (key, 命中的结果, 进行中调用的 Future, 本次需要执行时由本次完成的 Future)
+        """
+        key = cache_key(args)
+        with self.lock:
+            hit, found = self._lookup(key)
+            if hit:
+                _mark(cached=True)
+                return key, found, None, None
+            if found is not None:
+                self.counters["coalesced"] += 1
+                _mark(coalesced=True)
+                return key, None, found, None
+            self.counters["misses"] += 1
+            leader = Future()
+            self.in_flight[key] = leader
+            return key, None, None, leader
+
+    def _finish(self, key: Any, leader: Future, value: Any = None, error: BaseException = None) -> None:
+        """结束执行：成功的结果写入缓存（异常不缓存），唤醒等待的相同调用"""
+        with self.lock:
+            self.in_flight.pop(key, None)
+            if error is None:
+                self._store(key, value)
+        if error is None:
+            leader.set_result(value)
+        else:
+            leader.set_exception(error)
+
+    def call(self, func: Callable, args: Dict[str, Any]) -> Any:
+        """同步调用（经过缓存）"""
+        args = self.normalize(args)
+        key, value, waiting, leader = self._begin(args)
+        if leader is None:
+            return value if waiting is None else waiting.result()
+        try:
+            value = func(**args)
+        except BaseException as e:
+            self._finish(key, leader, error=e)
+            raise
+        self._finish(key, leader, value)
+        return value
+
+    async def acall(self, coroutine: Callable, args: Dict[str, Any]) -> Any:
+        """
+        异步调用（经过缓存）
+
+        实际调用在缓存持有的任务中执行，各调用方通过 shield 等待：发起调用的一方被取消（例如超时）时，
+        调用继续完成并写入缓存，合并进来的调用照常拿到结果；任何一方被取消都不影响其他等待的调用。
+        """
+        args = self.normalize(args)
+        key, value, waiting, leader = self._begin(args)
+        if leader is None:
+            if waiting is None:
+                return value
+            wrapped = asyncio.wrap_future(waiting)
+            # 本方被取消后没人再等这个结果，取走异常，避免 "exception was never retrieved"
+            wrapped.add_done_callback(_retrieve)
+            return await asyncio.shield(wrapped)
+        task = asyncio.ensure_future(coroutine(**args))
+        self.tasks.add(task)
+        task.add_done_callback(functools.partial(self._task_done, key, leader))
+        return await asyncio.shield(task)
+
+    def _task_done(self, key: Any, leader: Future, task: asyncio.Task) -> None:
+        """异步调用结束：把结果交给等待的调用（底层调用本身被取消时转成普通异常，等待方不会收到 CancelledError）"""
+        self.tasks.discard(task)
+        if task.cancelled():
+            self._finish(key, leader, error=RuntimeError(f"工具 {self.name} 的调用被取消"))
+        elif task.exception() is not None:
+            self._finish(key, leader, error=task.exception())
+        else:
+            self._finish(key, leader, task.result())
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计
+
+        Returns:
+            有效期、条目数、命中率和计数器
+        """
+        lookups = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+        return {
+            "ttl": self.ttl,
+            "entries": len(self.entries),
+            "maxsize": self.maxsize,
+            "hit_rate": round((self.counters["hits"] + self.counters["coalesced"]) / lookups, 3) if lookups else None,
+            **self.counters,
+        }
+
+
+def _retrieve(future: asyncio.Future) -> None:
+    """取走已完成 Future 的异常"""
+    if not future.cancelled():
+        future.exception()
+
+
+def _mark(**status: bool) -> None:
+    """告诉调用方本次调用命中了缓存"""
+    holder = tool_cache_status.get()
+    if holder is not None:
+        holder.update(status)
+
+
+def cached_tool(
+    tool: Optional[BaseTool] = None,
+    *,
+    ttl: float = 300.0,
+    maxsize: int = 1024,
+    normalize: Optional[Callable[[Dict[str, Any]], Any]] = None,
+):
+    """
+    给工具加上 TTL 缓存（写在 @tool 之上，返回新的工具对象）
+
+    用法:
+        @cached_tool(ttl=60)
+        @tool
+        def query_order_status(order_id: str) -> str: ...
+
+    Args:
+        tool: 工具（直接作为装饰器使用时）
+        ttl: 有效期（秒）
+        maxsize: 最多缓存的结果数
+        normalize: 参数规范化函数（规范化后的参数传给工具并作为缓存 key），默认去掉字符串首尾空白
+
+    Returns:
+        带缓存的工具，或装饰器
+    """
+    def decorate(tool: BaseTool) -> BaseTool:
+        if not isinstance(tool, StructuredTool):
+            raise TypeError(f"cached_tool 只支持 @tool 定义的函数工具: {tool.name}")
+        if (tool.metadata or {}).get("cache") is False:
+            raise ValueError(f"工具 {tool.name} 已声明 no_cache")
+        cache = ToolCache(tool.name, ttl=ttl, maxsize=maxsize, normalize=normalize)
+        _caches[tool.name] = cache
+        update: Dict[str, Any] = {"metadata": {**(tool.metadata or {}), "cache": cache}}
+
+        if tool.func is not None:
+            func = tool.func
+
+            @functools.wraps(func)
+            def cached_func(**kwargs):
+                return cache.call(func, kwargs)
+
+            update["func"] = cached_func
+        if tool.coroutine is not None:
+            coroutine = tool.coroutine
+
+            @functools.wraps(coroutine)
+            async def cached_coroutine(**kwargs):
+                return await cache.acall(coroutine, kwargs)
+
+            update["coroutine"] = cached_coroutine
+        return tool.model_copy(update=update)
+
+    return decorate(tool) if tool is not None else decorate
+
+
+def no_cache(tool: BaseTool) -> BaseTool:
+    """
+    声明工具不能缓存（写在 @tool 之上），cache_tools 会跳过它
+
+    Args:
+        tool: 工具
+
+    Returns:
+        同一个工具
+    """
+    tool.metadata = {**(tool.metadata or {}), "cache": False}
+    return tool
+
+
+def cache_tools(tools: Iterable[BaseTool], ttl: float = 300.0, maxsize: int = 1024) -> List[BaseTool]:
+    """
+    给一组工具统一加缓存：跳过声明了 no_cache 的工具和已经带缓存的工具
+
+    Args:
+        tools: 工具列表
+        ttl: 默认有效期（秒），0 表示不缓存
+        maxsize: 每个工具最多缓存的结果数
+
+    Returns:
+        工具列表
+    """
+    result = []
+    for tool in tools:
+        declared = (tool.metadata or {}).get("cache")
+        if ttl > 0 and declared is None and isinstance(tool, StructuredTool):
+            tool = cached_tool(tool, ttl=ttl, maxsize=maxsize)
+        result.append(tool)
+    return result
+
+
+def tool_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    获取所有工具缓存的统计
+
+    Returns:
+        工具名 -> 统计
+    """
+    return {name: cache.stats() for name, cache in _caches.items()}
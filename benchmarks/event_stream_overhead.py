@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+图事件流开销测试
+
+对比 astream_events(version="v2")（改造前 ImprovedGraphService 和 real_langgraph_server.py 的做法）
+与 astream_filtered（只订阅需要的 stream_mode）在改进版 ReAct Agent 上每个 token 的 CPU 时间和内存分配：
+- 对话：假模型直接回答，只需要 token
+- 工具：假模型先调用 calculator 再回答，需要 token 和工具事件
+
+内存分配用 tracemalloc 单独测一轮（tracemalloc 本身会拖慢执行，不与 CPU 时间同时测），
+报告每次运行期间的内存峰值；另外报告每个 token 收到的事件数（astream_events 的大部分事件被丢弃）。
+两种方式输出的 token 文本和工具事件必须一致。
+
+用法:
+    python benchmarks/event_stream_overhead.py
+    python benchmarks/event_stream_overhead.py --runs 50 --length 500
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import AsyncIterator, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure(args) -> None:
+    """在导入应用之前通过环境变量选择假模型"""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_TTFT_MS"] = str(args.ttft_ms)
+    os.environ["FAKE_LLM_TOKENS_PER_SECOND"] = str(args.tps)
+    os.environ["FAKE_LLM_LENGTH_DISTRIBUTION"] = "fixed"
+    os.environ["FAKE_LLM_LENGTH_MEAN"] = str(args.length)
+    os.environ["LLM_HEALTH_CHECK_INTERVAL"] = "0"
+    os.environ["SQLITE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "event_stream_overhead.sqlite")
+
+
+def tool_calling_agent(service, args):
+    """与改进版服务相同的 ReAct Agent，但模型在第一轮调用 calculator"""
+    from langchain_core.messages import AIMessageChunk, HumanMessage
+    from langchain_core.outputs import ChatGenerationChunk
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.prebuilt import create_react_agent
+    from backend.providers import FakeChatModel
+
+    class ToolCallingFakeModel(FakeChatModel):
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+            if isinstance(messages[-1], HumanMessage):
+                await asyncio.sleep(self.ttft_ms / 1000)
+                yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[{
+                    "name": "calculator", "args": '{"expression": "6*7"}', "id": "call_calc", "index": 0,
+                }]))
+                return
+            async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+                yield chunk
+
+    model = ToolCallingFakeModel(
+        ttft_ms=args.ttft_ms, tokens_per_second=args.tps, length_distribution="fixed", length_mean=args.length,
+    )
+    return create_react_agent(
+        model=model, tools=service.tools, checkpointer=MemorySaver(), pre_model_hook=service._assemble_context,
+    )
+
+
+async def consume_events(graph, question: str, thread_id: str, tools: bool) -> tuple:
+    """改造前：astream_events v2，只保留 token 和工具事件"""
+    config = {"configurable": {"thread_id": thread_id}}
+    text, tool_events, received = [], [], 0
+    async for event in graph.astream_events({"messages": [("user", question)]}, config, version="v2"):
+        received += 1
+        kind = event["event"]
+        if kind == "on_chat_model_stream":
+            chunk = event["data"]["chunk"]
+            if chunk.content:
+                text.append(chunk.content)
+        elif tools and kind in ("on_tool_start", "on_tool_end"):
+            tool_events.append((kind[3:], event["name"]))
+    return "".join(text), tool_events, received, len(text)
+
+
+async def consume_filtered(graph, question: str, thread_id: str, tools: bool) -> tuple:
+    """改造后：astream_filtered 只订阅需要的 stream_mode"""
+    from backend.utils.streaming import astream_filtered
+
+    config = {"configurable": {"thread_id": thread_id}}
+    text, tool_events, received = [], [], 0
+    kinds = ("tokens", "tools") if tools else ("tokens",)
+    async for kind, data in astream_filtered(graph, {"messages": [("user", question)]}, config, kinds=kinds):
+        received += 1
+        if kind == "token":
+            text.append(data.content)
+        else:
+            tool_events.append((kind, data["tool"]))
+    return "".join(text), tool_events, received, len(text)
+
+
+async def measure(consume, graph, label: str, runs: int, tools: bool, trace: bool) -> dict:
+    """依次运行 runs 次，统计 CPU 时间（或内存峰值）、token（分块）数和事件数"""
+    outputs: List[tuple] = []
+    peaks: List[int] = []
+    cpu = 0.0
+    for index in range(runs):
+        if trace:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        cpu_start = time.process_time()
+        outputs.append(await consume(graph, f"问题 {index}", f"{label}-{trace}-{index}", tools))
+        cpu += time.process_time() - cpu_start
+        if trace:
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tokens = sum(output[3] for output in outputs)
+    return {
+        "outputs": outputs,
+        "tokens": tokens,
+        "cpu": cpu,
+        "events": sum(output[2] for output in outputs),
+        "peak_kb": sum(peaks) / len(peaks) / 1024 if peaks else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="图事件流开销测试")
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--ttft-ms", type=float, default=20.0)
+    parser.add_argument("--tps", type=float, default=1000.0, help="假模型每秒输出的分块数（只影响耗时，不影响 CPU 统计）")
+    parser.add_argument("--length", type=int, default=200, help="每次回复的分块数")
+    args = parser.parse_args()
+    configure(args)
+
+    # 应用和工具都会打印日志，测量期间屏蔽
+    with contextlib.redirect_stdout(io.StringIO()):
+        from backend.services.graph_service_improved import improved_graph_service
+        scenarios = {
+            "对话": (improved_graph_service.graph, False),
+            "工具": (tool_calling_agent(improved_graph_service, args), True),
+        }
+
+    print(f"🧪 假模型: {args.length} 分块/次, 每组 {args.runs} 次运行")
+    for name, (graph, tools) in scenarios.items():
+        results = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for label, consume in (("astream_events", consume_events), ("filtered", consume_filtered)):
+                # 预热后先测 CPU，再开启 tracemalloc 测内存
+                await measure(consume, graph, f"warmup-{label}", 2, tools, trace=False)
+                result = await measure(consume, graph, label, args.runs, tools, trace=False)
+                tracemalloc.start()
+                result["peak_kb"] = (await measure(consume, graph, label, args.runs, tools, trace=True))["peak_kb"]
+                tracemalloc.stop()
+                results[label] = result
+
+        old, new = results["astream_events"], results["filtered"]
+        same = [output[:2] for output in old["outputs"]] == [output[:2] for output in new["outputs"]]
+        for label, result in results.items():
+            print(f"📦 {name} {label:>14}: CPU {result['cpu'] / result['tokens'] * 1e6:.0f}µs/token, "
+                  f"事件 {result['events'] / args.runs:.0f}/次运行, 内存峰值 {result['peak_kb']:.0f}KB/次运行")
+        print(f"   CPU 降低 {(1 - new['cpu'] / old['cpu']) * 100:.0f}%, "
+              + ("输出一致 ✅" if same else "⚠️ 输出不一致"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
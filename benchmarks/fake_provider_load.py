@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+假模型/回放模型端到端压测
+
+使用确定性假模型（LLM_PROVIDER=fake）或录制的真实 token 流（LLM_PROVIDER=replay）启动完整的 FastAPI 应用，并发请求
+/threads/{id}/runs/stream，经过 路由 -> 上下文组装 -> 准入控制 -> 模型流式输出 -> SSE -> SQLite 的完整路径，
+统计客户端看到的首 token 延迟、总耗时和输出速度。不访问网络，同样的参数得到可重复的结果。
+
+用法:
+    python benchmarks/fake_provider_load.py --clients 50 --turns 3
+    python benchmarks/fake_provider_load.py --clients 20 --ttft-ms 800 --tps 30 --corpus zh --error-rate 0.05
+    # 回放用 LLM_RECORD_DIR 录制的生产流量（--time-scale 0.5 表示两倍速）
+    python benchmarks/fake_provider_load.py --replay cassettes/ --time-scale 1.0 --clients 50
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure(args) -> None:
+    """在导入应用之前通过环境变量选择假模型或回放模型"""
+    os.environ["LLM_PROVIDER"] = "replay" if args.replay else "fake"
+    if args.replay:
+        os.environ["LLM_REPLAY_PATH"] = args.replay
+        os.environ["LLM_REPLAY_TIME_SCALE"] = str(args.time_scale)
+        os.environ["LLM_REPLAY_MATCH"] = "sequential"
+    if args.record:
+        os.environ["LLM_RECORD_DIR"] = args.record
+    os.environ["SQLITE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "fake_provider_load.sqlite")
+    os.environ["LLM_HEALTH_CHECK_INTERVAL"] = "0"
+    os.environ["FAKE_LLM_TTFT_MS"] = str(args.ttft_ms)
+    os.environ["FAKE_LLM_TOKENS_PER_SECOND"] = str(args.tps)
+    os.environ["FAKE_LLM_LENGTH_MEAN"] = str(args.length)
+    os.environ["FAKE_LLM_CORPUS"] = args.corpus
+    os.environ["FAKE_LLM_ERROR_RATE"] = str(args.error_rate)
+    os.environ["FAKE_LLM_SEED"] = str(args.seed)
+
+
+async def run_client(client, index: int, turns: int, results: list) -> None:
+    """一个客户端在自己的线程中连续对话 turns 轮"""
+    thread_id = f"load-{index}"
+    for turn in range(turns):
+        body = {
+            "input": {"messages": [{"role": "user", "content": [{"type": "text", "text": f"问题 {index}-{turn}"}]}]},
+            "stream_mode": ["messages", "values"],
+        }
+        start = time.perf_counter()
+        ttft = None
+        chunks = 0
+        error = False
+        async with client.stream("POST", f"/threads/{thread_id}/runs/stream", json=body) as response:
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: ") and event == "messages/partial":
+                    chunks += 1
+                    if ttft is None:
+                        ttft = (time.perf_counter() - start) * 1000
+                elif line.startswith("data: ") and event == "error":
+                    error = True
+        total = (time.perf_counter() - start) * 1000
+        results.append({"ttft": ttft, "total": total, "chunks": chunks, "error": error})
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="假模型/回放模型端到端压测")
+    parser.add_argument("--clients", type=int, default=20, help="并发客户端数")
+    parser.add_argument("--turns", type=int, default=3, help="每个客户端的对话轮数")
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--tps", type=float, default=50.0, help="假模型每秒输出的分块数")
+    parser.add_argument("--length", type=int, default=100, help="平均输出分块数")
+    parser.add_argument("--corpus", default="mixed", choices=["zh", "en", "code", "mixed"])
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", default=None, help="回放 cassette 文件或目录，替代假模型")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="回放时间缩放")
+    parser.add_argument("--record", default=None, help="同时把模型 token 流录制到该目录")
+    args = parser.parse_args()
+    configure(args)
+
+    import httpx
+    import uvicorn
+    from backend.main import app
+    from backend.services.metrics_service import percentile
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="error")
+    server = uvicorn.Server(config)
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    results: list = []
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    started = time.perf_counter()
+    # 应用每个分块都会打印日志，压测期间屏蔽
+    with contextlib.redirect_stdout(io.StringIO()):
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=600, limits=limits) as client:
+            await asyncio.gather(*(run_client(client, i, args.turns, results) for i in range(args.clients)))
+        stats = (await httpx.AsyncClient().get(f"http://127.0.0.1:{port}/stats")).json()
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if not r["error"]]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    totals = [r["total"] for r in ok]
+    chunks = sum(r["chunks"] for r in ok)
+    if args.replay:
+        print(f"📼 回放: {args.replay}, 时间缩放 {args.time_scale}")
+    else:
+        print(f"🧪 假模型: TTFT {args.ttft_ms}ms, {args.tps} 分块/s, 平均 {args.length} 分块, 语料 {args.corpus}, "
+              f"错误率 {args.error_rate}")
+    print(f"📦 {args.clients} 个客户端 x {args.turns} 轮 = {len(results)} 次运行, 失败 {len(results) - len(ok)}, "
+          f"用时 {elapsed:.1f}s")
+    print(f"⏱️  TTFT: p50={percentile(ttfts, 50)}ms p95={percentile(ttfts, 95)}ms p99={percentile(ttfts, 99)}ms")
+    print(f"⏱️  总耗时: p50={percentile(totals, 50)}ms p95={percentile(totals, 95)}ms")
+    print(f"🚀 吞吐: {len(ok) / elapsed:.1f} 次运行/s, {chunks / elapsed:.0f} 分块/s")
+    print(f"📊 服务端: {json.dumps(stats['runs'], ensure_ascii=False)}")
+
+    server.should_exit = True
+    await serve_task
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
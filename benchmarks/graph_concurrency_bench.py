@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+graph.py 聊天节点并发测试
+
+使用假模型（LLM_PROVIDER=fake）对比同步节点（llm.stream，由 LangGraph 放到线程池执行）和异步节点（llm.astream）
+在不同并发数下的首 token 延迟、总耗时和吞吐。同步节点在整个生成期间占用一个线程，并发超过线程池大小后开始排队；
+异步节点等待上游时不占用线程，并发只受事件循环调度开销限制。两种节点都通过 stream_mode="messages" 接收 token，
+都使用 graph.py 的 SQLite 检查点。
+
+用法:
+    python benchmarks/graph_concurrency_bench.py
+    python benchmarks/graph_concurrency_bench.py --concurrency 50 200 500 --ttft-ms 300 --tps 50 --length 30
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure(args) -> None:
+    """在导入 graph.py 之前通过环境变量选择假模型"""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_TTFT_MS"] = str(args.ttft_ms)
+    os.environ["FAKE_LLM_TOKENS_PER_SECOND"] = str(args.tps)
+    os.environ["FAKE_LLM_LENGTH_DISTRIBUTION"] = "fixed"
+    os.environ["FAKE_LLM_LENGTH_MEAN"] = str(args.length)
+    os.environ["SQLITE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "graph_concurrency_bench.sqlite")
+
+
+def sync_graph(graph_module):
+    """改造前的同步节点（llm.stream），作为对照"""
+    from langgraph.graph import StateGraph, END
+
+    def chatbot(state):
+        messages, _ = graph_module.context_assembler.assemble(state["messages"])
+        response = None
+        for chunk in graph_module.llm.stream(messages):
+            response = chunk if response is None else response + chunk
+        return {"messages": [response]}
+
+    workflow = StateGraph(graph_module.State)
+    workflow.add_node("chatbot", chatbot)
+    workflow.set_entry_point("chatbot")
+    workflow.add_edge("chatbot", END)
+    return workflow.compile(checkpointer=graph_module.graph.checkpointer)
+
+
+async def run_load(graph, label: str, concurrency: int) -> dict:
+    """同时发起 concurrency 个对话，统计首 token 延迟、总耗时和期间的最大线程数"""
+    from langchain_core.messages import HumanMessage
+
+    ttfts: List[float] = []
+    totals: List[float] = []
+    peak_threads = threading.active_count()
+
+    async def one(index: int) -> None:
+        config = {"configurable": {"thread_id": f"{label}-{concurrency}-{index}"}}
+        start = time.perf_counter()
+        first = None
+        async for message, _ in graph.astream(
+            {"messages": [HumanMessage(content=f"问题 {index}")]}, config, stream_mode="messages"
+        ):
+            if first is None and message.content:
+                first = (time.perf_counter() - start) * 1000
+        ttfts.append(first)
+        totals.append((time.perf_counter() - start) * 1000)
+
+    async def sample_threads() -> None:
+        nonlocal peak_threads
+        while True:
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample_threads())
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+    return {"ttfts": ttfts, "totals": totals, "elapsed": elapsed, "peak_threads": peak_threads}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="graph.py 聊天节点并发测试")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--tps", type=float, default=50.0, help="假模型每秒输出的分块数")
+    parser.add_argument("--length", type=int, default=25, help="每次回复的分块数")
+    args = parser.parse_args()
+    configure(args)
+
+    from backend.services.metrics_service import percentile
+
+    # graph.py 和节点都会打印日志，压测期间屏蔽
+    with contextlib.redirect_stdout(io.StringIO()):
+        import graph as graph_module
+        graphs = {"同步节点": sync_graph(graph_module), "异步节点": graph_module.graph}
+
+    ideal = args.ttft_ms + (args.length - 1) / args.tps * 1000
+    print(f"🧪 假模型: TTFT {args.ttft_ms}ms, {args.tps} 分块/s, {args.length} 分块（单次约 {ideal:.0f}ms）, "
+          f"CPU {os.cpu_count()}")
+    for concurrency in args.concurrency:
+        for label, graph in graphs.items():
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = await run_load(graph, label, concurrency)
+            ttfts, totals = result["ttfts"], result["totals"]
+            print(f"📦 {label} 并发 {concurrency}: TTFT p50={percentile(ttfts, 50)}ms p95={percentile(ttfts, 95)}ms, "
+                  f"总耗时 p50={percentile(totals, 50)}ms p95={percentile(totals, 95)}ms, "
+                  f"{concurrency / result['elapsed']:.1f} 次运行/s, 最大线程数 {result['peak_threads']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+图执行流式开销测试
+
+GraphService 的生成经过编译好的图（节点经 stream writer 送出分块，stream_mode="custom"），
+这里对比它与直接调用 LLM 流式接口的差别：使用确定性假模型（同一 prompt 的分块内容和节奏完全相同），
+两种方式各跑同样的 prompt，得到：
+- 每分块转发延迟：模型产出分块到调用方收到的时间（图执行给每个 token 增加的延迟）
+- TTFT 增加：图的启动开销（假模型按调用开始的绝对时间输出，启动晚多少，之后每个分块都晚多少）
+- 端到端每分块增加延迟：逐个分块比较到达时间（= 启动开销 + 转发延迟）
+- 每个分块消耗的 CPU 时间
+
+每分块转发延迟的 p99 或端到端每分块增加延迟的 p50 超过 --max-token-ms 时以非零状态退出。
+
+用法:
+    python benchmarks/graph_streaming_overhead.py
+    python benchmarks/graph_streaming_overhead.py --runs 100 --concurrency 20 --tps 100 --length 200
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure(args) -> None:
+    """在导入应用之前通过环境变量选择假模型"""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_TTFT_MS"] = str(args.ttft_ms)
+    os.environ["FAKE_LLM_TOKENS_PER_SECOND"] = str(args.tps)
+    os.environ["FAKE_LLM_LENGTH_DISTRIBUTION"] = "fixed"
+    os.environ["FAKE_LLM_LENGTH_MEAN"] = str(args.length)
+    os.environ["LLM_HEALTH_CHECK_INTERVAL"] = "0"
+    os.environ["SQLITE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "graph_streaming_overhead.sqlite")
+
+
+class StampedLLM:
+    """记录模型产出每个非空分块的时间（按 prompt 对象区分运行），其余行为与原模型相同"""
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.stamps: Dict[int, List[float]] = {}
+
+    async def astream(self, messages, config=None, **kwargs):
+        stamps = self.stamps.setdefault(id(messages), [])
+        async for chunk in self.llm.astream(messages, config, **kwargs):
+            if chunk.content:
+                stamps.append(time.perf_counter())
+            yield chunk
+
+
+async def run_mode(mode: str, runs: int, concurrency: int) -> tuple:
+    """
+    按指定方式运行 runs 次
+
+    Returns:
+        (每次运行各分块的到达时间（毫秒，相对开始）, 各分块从模型产出到收到的毫秒数, 消耗的 CPU 秒数)
+    """
+    from langchain_core.messages import HumanMessage
+    from backend.services.graph_service import graph_service
+    from backend.services.llm_service import llm_service
+    from backend.services.metrics_service import metrics_service
+
+    llm = StampedLLM(llm_service.llm)
+    semaphore = asyncio.Semaphore(concurrency)
+    offsets: List[List[float]] = [[] for _ in range(runs)]
+    delivery: List[float] = []
+
+    async def one(index: int) -> None:
+        question = f"问题 {index}"
+        prompt = [HumanMessage(content=question)]
+        received = []
+        async with semaphore:
+            start = time.perf_counter()
+            if mode == "raw":
+                stream = (chunk.content async for chunk in llm.astream(prompt) if chunk.content)
+            else:
+                run_id = f"{mode}-{index}"
+                metrics = metrics_service.start_run(run_id, run_id)
+                stream = graph_service._stream_graph(question, prompt, f"overhead-{index}", run_id, metrics)
+            async for _ in stream:
+                received.append(time.perf_counter())
+        offsets[index] = [(at - start) * 1000 for at in received]
+        delivery.extend((at - made) * 1000 for made, at in zip(llm.stamps.pop(id(prompt), []), received))
+
+    # 图的节点通过 llm_service.get_llm() 取模型，测量期间换成记录时间的包装
+    get_llm = llm_service.get_llm
+    llm_service.get_llm = lambda: llm
+    try:
+        cpu_start = time.process_time()
+        await asyncio.gather(*(one(i) for i in range(runs)))
+        return offsets, delivery, time.process_time() - cpu_start
+    finally:
+        llm_service.get_llm = get_llm
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="图执行流式开销测试")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 20])
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--tps", type=float, default=100.0, help="假模型每秒输出的分块数")
+    parser.add_argument("--length", type=int, default=100, help="每次回复的分块数")
+    parser.add_argument("--max-token-ms", type=float, default=10.0, help="每个 token 允许增加的延迟上限（毫秒）")
+    args = parser.parse_args()
+    configure(args)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from backend.services.metrics_service import percentile
+        # 预热：首次调用会初始化模型和图
+        await run_mode("raw", 1, 1)
+        await run_mode("graph", 1, 1)
+    # 与 backend/main.py 启动完成后一致：启动时的对象移出 GC 追踪
+    gc.freeze()
+
+    print(f"🧪 假模型: TTFT {args.ttft_ms}ms, {args.tps} 分块/s, {args.length} 分块, 每组 {args.runs} 次运行")
+    failures = []
+    for concurrency in args.concurrency:
+        # 应用和节点都会打印日志，测量期间屏蔽
+        with contextlib.redirect_stdout(io.StringIO()):
+            raw, _, raw_cpu = await run_mode("raw", args.runs, concurrency)
+            graph, delivery, graph_cpu = await run_mode("graph", args.runs, concurrency)
+
+        deltas = [g - r for raw_run, graph_run in zip(raw, graph) for r, g in zip(raw_run, graph_run)]
+        ttft_deltas = [graph_run[0] - raw_run[0] for raw_run, graph_run in zip(raw, graph) if raw_run and graph_run]
+        tokens = sum(len(run) for run in raw)
+        mismatched = sum(len(r) != len(g) for r, g in zip(raw, graph))
+        print(f"📦 并发 {concurrency}: 每分块转发延迟 p50={percentile(delivery, 50)}ms "
+              f"p99={percentile(delivery, 99)}ms max={max(delivery):.1f}ms, "
+              f"TTFT 增加 p50={percentile(ttft_deltas, 50)}ms p99={percentile(ttft_deltas, 99)}ms")
+        print(f"   端到端每分块增加延迟 p50={percentile(deltas, 50)}ms p99={percentile(deltas, 99)}ms "
+              f"max={max(deltas):.1f}ms, CPU {raw_cpu / tokens * 1e6:.0f}µs -> {graph_cpu / tokens * 1e6:.0f}µs/分块"
+              + (f", ⚠️ {mismatched} 次运行分块数不一致" if mismatched else ""))
+
+        if percentile(delivery, 99) > args.max_token_ms:
+            failures.append(f"并发 {concurrency} 每分块转发延迟 p99 {percentile(delivery, 99)}ms")
+        if percentile(deltas, 50) > args.max_token_ms:
+            failures.append(f"并发 {concurrency} 端到端每分块增加延迟 p50 {percentile(deltas, 50)}ms")
+        if mismatched:
+            failures.append(f"并发 {concurrency} 有 {mismatched} 次运行分块数不一致")
+
+    for failure in failures:
+        print(f"❌ {failure} 超过 {args.max_token_ms}ms 上限" if "不一致" not in failure else f"❌ {failure}")
+    if not failures:
+        print(f"✅ 每个 token 增加的延迟在 {args.max_token_ms}ms 以内")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
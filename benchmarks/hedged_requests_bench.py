@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+对冲请求首 token 长尾测试
+
+用两个假模型后端（大多数请求首 token 约 200ms，少数请求卡顿数秒）模拟上游偶发的长尾延迟，
+分别在关闭和开启对冲的情况下发起同样的请求，对比首 token 的 p50/p95/p99、对冲率、对冲胜出率和额外请求数。
+
+用法:
+    python benchmarks/hedged_requests_bench.py
+    python benchmarks/hedged_requests_bench.py --requests 1000 --stall-rate 0.05 --stall-ms 4000 --percentile 90 --budget 0.1
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DEEPSEEK_API_KEY", "benchmark")  # 仅用于通过配置校验，不会调用 API
+os.environ.setdefault("SQLITE_DB_PATH", os.path.join(tempfile.gettempdir(), "hedged_requests_bench.sqlite"))
+
+from langchain_core.messages import BaseMessage, HumanMessage  # noqa: E402
+from backend.providers import FakeChatModel  # noqa: E402
+from backend.services.llm_pool import CircuitBreaker, HedgePolicy, LLMBackend, PooledChatModel  # noqa: E402
+from backend.services.metrics_service import percentile  # noqa: E402
+
+
+class StallingChatModel(FakeChatModel):
+    """按概率在首个分块前卡顿的假模型"""
+
+    stall_rate: float = 0.05
+    stall_ms: float = 3000.0
+    calls_total: int = 0
+
+    def plan(self, messages: List[BaseMessage], max_tokens: Optional[int] = None):
+        steps, error = super().plan(messages, max_tokens)
+        self.calls_total += 1
+        rng = random.Random(f"{self.seed}:stall:{self.calls}")
+        if rng.random() < self.stall_rate:
+            delay, token = steps[0]
+            steps[0] = (delay + self.stall_ms / 1000, token)
+        return steps, error
+
+
+def create_pool(args, hedge: Optional[HedgePolicy]) -> PooledChatModel:
+    backends = [
+        LLMBackend(
+            name,
+            StallingChatModel(
+                model_name=name, ttft_ms=args.ttft_ms, jitter=0.3, tokens_per_second=200,
+                length_distribution="fixed", length_mean=20, deterministic=False, seed=seed,
+                stall_rate=args.stall_rate, stall_ms=args.stall_ms,
+            ),
+            breaker=CircuitBreaker(failure_threshold=1000),
+        )
+        for seed, name in enumerate(["a", "b"])
+    ]
+    return PooledChatModel(backends=backends, first_token_timeout=30, hedge=hedge)
+
+
+async def measure(pool: PooledChatModel, requests: int, concurrency: int) -> List[float]:
+    """并发发起请求，返回每个请求的首 token 延迟（毫秒）"""
+    semaphore = asyncio.Semaphore(concurrency)
+    ttfts: List[float] = []
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            first = None
+            async for chunk in pool.astream([HumanMessage(content=f"问题 {i}")]):
+                if first is None and chunk.content:
+                    first = (time.perf_counter() - start) * 1000
+            ttfts.append(first)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return ttfts
+
+
+def report(label: str, ttfts: List[float], pool: PooledChatModel) -> None:
+    calls = sum(backend.llm.calls_total for backend in pool.backends)
+    print(f"{label}: TTFT p50={percentile(ttfts, 50)}ms p95={percentile(ttfts, 95)}ms "
+          f"p99={percentile(ttfts, 99)}ms max={max(ttfts):.0f}ms, 上游调用 {calls} 次")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="对冲请求首 token 长尾测试")
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--stall-rate", type=float, default=0.03, help="首 token 卡顿的概率")
+    parser.add_argument("--stall-ms", type=float, default=3000.0, help="卡顿时长")
+    parser.add_argument("--percentile", type=float, default=95.0, help="对冲延迟取首 token 延迟的百分位")
+    parser.add_argument("--budget", type=float, default=0.1, help="对冲请求占比上限")
+    args = parser.parse_args()
+
+    print(f"🧪 {args.requests} 个请求, 并发 {args.concurrency}, 首 token {args.ttft_ms}ms, "
+          f"{args.stall_rate:.0%} 的请求卡顿 {args.stall_ms}ms")
+
+    baseline = create_pool(args, hedge=None)
+    report("⏱️  不对冲", await measure(baseline, args.requests, args.concurrency), baseline)
+
+    hedge = HedgePolicy(percentile=args.percentile, min_delay_ms=50, initial_delay_ms=1000, budget=args.budget)
+    hedged = create_pool(args, hedge=hedge)
+    # 对冲时会打印每次对冲，压测期间只保留结果
+    with contextlib.redirect_stdout(io.StringIO()):
+        ttfts = await measure(hedged, args.requests, args.concurrency)
+    report("🪞 对冲  ", ttfts, hedged)
+    stats = hedge.stats()
+    print(f"📊 对冲率 {stats['hedge_rate']:.1%}, 胜出率 {stats['win_rate'] or 0:.1%}, "
+          f"预算不足 {stats['budget_exhausted']} 次, 当前对冲延迟 {stats['delay_ms']}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
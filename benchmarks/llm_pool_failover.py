@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+LLM 后端池路由与故障切换测试
+
+在本地启动若干个 OpenAI 兼容的假服务（可配置首 token 延迟、吞吐和故障模式），验证：
+1. 路由：多数请求被路由到更快的后端
+2. 故障切换：后端返回 500 时请求仍然成功，连续失败后熔断打开
+3. 首 token 超时：后端挂起时在超时后切换到下一个后端
+4. 健康检查：后端下线后被标记为不健康并退出路由
+
+用法:
+    python benchmarks/llm_pool_failover.py
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DEEPSEEK_API_KEY", "benchmark")  # 仅用于通过配置校验，不会调用 API
+os.environ.setdefault("SQLITE_DB_PATH", os.path.join(tempfile.gettempdir(), "llm_pool_bench.sqlite"))
+
+from langchain_openai import ChatOpenAI  # noqa: E402
+from backend.services.llm_pool import CircuitBreaker, LLMBackend, PooledChatModel  # noqa: E402
+
+
+class FakeOpenAIServer:
+    """OpenAI 兼容的假服务（流式 /v1/chat/completions 和 /v1/models）"""
+
+    def __init__(self, name: str, ttft: float = 0.05, tokens_per_second: float = 200, tokens: int = 20):
+        self.name = name
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.mode = "ok"  # ok / error / hang / down
+        self.requests = 0
+        self.server = None
+        self.port = None
+
+    def create_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/v1/models")
+        async def models():
+            if self.mode == "down":
+                return JSONResponse({"error": "down"}, status_code=503)
+            return {"object": "list", "data": [{"id": "fake", "object": "model"}]}
+
+        @app.post("/v1/chat/completions")
+        async def completions(request: Request):
+            await request.json()
+            self.requests += 1
+            if self.mode in ("error", "down"):
+                return JSONResponse({"error": {"message": "upstream error"}}, status_code=500)
+
+            async def stream():
+                await asyncio.sleep(3600 if self.mode == "hang" else self.ttft)
+                for i in range(self.tokens):
+                    chunk = {
+                        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                        "choices": [{"index": 0, "delta": {"content": f"{self.name}{i} "}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(1 / self.tokens_per_second)
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        return app
+
+    async def start(self) -> None:
+        config = uvicorn.Config(self.create_app(), host="127.0.0.1", port=0, log_level="error")
+        self.server = uvicorn.Server(config)
+        asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            await asyncio.sleep(0.01)
+        self.port = self.server.servers[0].sockets[0].getsockname()[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+
+def make_pool(servers, first_token_timeout: float = 5.0) -> PooledChatModel:
+    backends = [
+        LLMBackend(
+            name=server.name,
+            llm=ChatOpenAI(model="fake", api_key="fake", base_url=server.base_url, max_retries=0, stream_usage=True),
+            base_url=server.base_url,
+            api_key="fake",
+            breaker=CircuitBreaker(failure_threshold=3, cooldown_seconds=30),
+        )
+        for server in servers
+    ]
+    return PooledChatModel(backends=backends, first_token_timeout=first_token_timeout)
+
+
+async def ask(pool: PooledChatModel) -> str:
+    text = ""
+    async for chunk in pool.astream("你好"):
+        text += chunk.content
+    return text
+
+
+def check(name: str, ok: bool, detail: str = "") -> bool:
+    print(f"{'✅' if ok else '❌'} {name} {detail}")
+    return ok
+
+
+async def main():
+    fast = FakeOpenAIServer("fast", ttft=0.02, tokens_per_second=400)
+    slow = FakeOpenAIServer("slow", ttft=0.3, tokens_per_second=50)
+    for server in (fast, slow):
+        await server.start()
+
+    results = []
+
+    # 1. 路由：测量过一轮后请求集中到快的后端
+    pool = make_pool([slow, fast])
+    for _ in range(20):
+        await ask(pool)
+    results.append(check("路由到最快的后端", fast.requests >= 18, f"fast={fast.requests} slow={slow.requests}"))
+    for stats in pool.stats():
+        print(f"   {stats}")
+
+    # 2. 故障切换 + 熔断
+    fast.mode = "error"
+    fast.requests = slow.requests = 0
+    start = time.perf_counter()
+    answers = [await ask(pool) for _ in range(5)]
+    elapsed = time.perf_counter() - start
+    results.append(check("500 时切换到其他后端", all(a.startswith("slow") for a in answers), f"{elapsed:.2f}s"))
+    results.append(check("连续失败后熔断打开", pool.backends[1].breaker.state == "open" and fast.requests == 3,
+                         f"fast 收到 {fast.requests} 个请求"))
+
+    # 3. 首 token 超时
+    fast.mode = "ok"
+    hang = FakeOpenAIServer("hang")
+    await hang.start()
+    hang.mode = "hang"
+    pool = make_pool([hang, fast], first_token_timeout=0.5)
+    start = time.perf_counter()
+    answer = await ask(pool)
+    elapsed = time.perf_counter() - start
+    results.append(check("首 token 超时后切换", answer.startswith("fast") and elapsed < 1.5, f"{elapsed:.2f}s"))
+
+    # 4. 健康检查
+    slow.mode = "down"
+    pool = make_pool([slow, fast])
+    await pool.check_health()
+    results.append(check("下线的后端退出路由", [b.name for b in pool.candidates()] == ["fast"],
+                         str([b.stats()["healthy"] for b in pool.backends])))
+
+    for server in (fast, slow, hang):
+        server.server.should_exit = True
+    await asyncio.sleep(0.2)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+检索记忆请求路径开销测试
+
+在一个长线程（默认 1 万条消息）上启用检索记忆，测量 retrieval_memory.inject 在请求路径上的耗时
+（不含线程缓存失效后重新加载历史）和期间事件循环被阻塞的最长时间（一个每 1ms 醒来一次的任务观察到的最大间隔）：
+1. 冷启动：索引第一次构建（在后台线程中进行，本轮不召回），并报告后台构建总耗时
+2. 冷启动（数据库中已有向量）：清空常驻索引后重新构建
+3. 新一轮：保存一条消息后检索
+4. 编辑消息：线程缓存失效、索引随视图重建
+5. 其他 worker 写入：线程缓存失效、索引随视图重建
+
+用法:
+    python benchmarks/retrieval_index_bench.py
+    python benchmarks/retrieval_index_bench.py --messages 20000 --rounds 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = "订单 发货 退款 物流 发票 地址 优惠 会员 积分 手机 电脑 耳机 屏幕 电池 保修 售后 价格 库存 颜色 尺寸".split()
+
+
+def configure() -> None:
+    """在导入应用之前启用检索记忆，使用假模型和临时数据库"""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["LLM_HEALTH_CHECK_INTERVAL"] = "0"
+    os.environ["RETRIEVAL_ENABLED"] = "true"
+    os.environ["SQLITE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "retrieval_index_bench.sqlite")
+
+
+def sentence(index: int) -> str:
+    """生成一条长度适中、内容各不相同的消息"""
+    words = [WORDS[(index * 7 + i * 3) % len(WORDS)] for i in range(12)]
+    return f"第 {index} 条：" + " ".join(words) + f" 编号 {index * 31 % 9973}"
+
+
+async def measure(thread_id: str, window: int) -> dict:
+    """运行一次 inject，返回耗时和事件循环最长阻塞时间（ms）"""
+    from backend.services.retrieval_memory import retrieval_memory
+    from backend.services.thread_service import thread_service
+
+    stalls = [0.0]
+    running = True
+
+    async def ticker():
+        last = time.perf_counter()
+        while running:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stalls.append((now - last) * 1000 - 1)
+            last = now
+
+    # 线程缓存失效后重新加载历史是线程服务的开销（与是否启用检索无关），不计入
+    history = thread_service.get_prepared_history(thread_id)
+    messages = list(history.messages[-window:])
+    prompt_tokens = sum(history.token_counts[-window:])
+    watcher = asyncio.create_task(ticker())
+    await asyncio.sleep(0.005)
+    started = time.perf_counter()
+    await retrieval_memory.inject(thread_id, history, messages, prompt_tokens, prompt_tokens + 4096)
+    elapsed = (time.perf_counter() - started) * 1000
+    await asyncio.sleep(0.005)
+    running = False
+    await watcher
+    return {"ms": elapsed, "stall_ms": max(stalls)}
+
+
+async def wait_built() -> float:
+    """等待后台构建和保存完成，返回等待时间（ms）"""
+    from backend.services.retrieval_memory import retrieval_memory
+
+    started = time.perf_counter()
+    while retrieval_memory.tasks:
+        await asyncio.gather(*retrieval_memory.tasks)
+    return (time.perf_counter() - started) * 1000
+
+
+def report(label: str, samples: list) -> None:
+    ms = [sample["ms"] for sample in samples]
+    stalls = [sample["stall_ms"] for sample in samples]
+    print(f"📦 {label}: inject 中位 {statistics.median(ms):.2f}ms / 最大 {max(ms):.2f}ms, "
+          f"事件循环最长阻塞 {max(stalls):.1f}ms（{len(samples)} 次）")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="检索记忆请求路径开销测试")
+    parser.add_argument("--messages", type=int, default=10000, help="线程中的消息数")
+    parser.add_argument("--rounds", type=int, default=10, help="新一轮/编辑/其他 worker 写入各测几次")
+    parser.add_argument("--window", type=int, default=20, help="上下文窗口中的消息数（其余为可召回的早期消息）")
+    args = parser.parse_args()
+    configure()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from backend.services.database_service import database_service
+        from backend.services.retrieval_memory import retrieval_memory
+        from backend.services.thread_service import thread_service
+
+        thread_id = "bench-thread"
+        thread_service.create_thread(thread_id)
+        ids = []
+        for index in range(args.messages):
+            ids.append(str(uuid.uuid4()))
+            database_service.save_message(thread_id, ids[-1], "human" if index % 2 == 0 else "ai", sentence(index))
+        thread_service._cache_drop(thread_id)
+
+    print(f"🧪 线程 {args.messages} 条消息, 窗口 {args.window} 条, 后台构建阈值 {retrieval_memory.inline_limit} 条")
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["冷启动（首次构建）"] = [await measure(thread_id, args.window)]
+        build_ms = await wait_built()
+
+        retrieval_memory.resident.clear()
+        thread_service._cache_drop(thread_id)
+        results["冷启动（数据库已有向量）"] = [await measure(thread_id, args.window)]
+        reload_ms = await wait_built()
+
+        for key in ("新一轮", "编辑消息", "其他 worker 写入"):
+            results[key] = []
+        for round_index in range(args.rounds):
+            thread_service.save_message(thread_id, str(uuid.uuid4()), "human", sentence(args.messages + round_index))
+            results["新一轮"].append(await measure(thread_id, args.window))
+            await wait_built()
+
+            thread_service.save_message(thread_id, ids[round_index * 97], "human", sentence(round_index) + " 已修改")
+            results["编辑消息"].append(await measure(thread_id, args.window))
+            await wait_built()
+
+            # 其他 worker 写入后本 worker 的缓存版本落后，下次读取时整体重新加载
+            thread_service._cache_drop(thread_id)
+            results["其他 worker 写入"].append(await measure(thread_id, args.window))
+            await wait_built()
+
+    for label, samples in results.items():
+        report(label, samples)
+    print(f"   后台构建: 首次 {build_ms:.0f}ms, 数据库已有向量 {reload_ms:.0f}ms（不在请求路径上）")
+    print(f"📊 {retrieval_memory.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+线程缓存多进程读写一致性检查
+
+启动两个 worker 进程（模拟两个 uvicorn worker），共用一个 SQLite 文件，各自持有 thread_service 的内存缓存。
+每轮在 worker A 写入后立即在 worker B 读取（反之亦然），检查读到的消息列表与数据库一致：
+1. 新消息：A 追加消息后 B 能读到（B 的缓存已预热）
+2. 编辑消息：A 覆盖一条已有消息后 B 读到修改后的内容，派生视图（预构建历史）也随之更新
+3. 交替写入：B 追加后 A 再追加（A 的缓存版本落后），两边和数据库一致
+4. 删除线程：A 删除后 B 读不到该线程
+
+任一检查不通过时以非零状态退出。
+
+用法:
+    python benchmarks/thread_cache_coherence_check.py
+    python benchmarks/thread_cache_coherence_check.py --rounds 50
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def worker(db_path: str, conn) -> None:
+    """worker 进程：执行主进程发来的 (操作, 参数)，返回结果"""
+    sys.path.insert(0, ROOT)
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["LLM_HEALTH_CHECK_INTERVAL"] = "0"
+    os.environ["SQLITE_DB_PATH"] = db_path
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        from backend.services.thread_service import thread_service
+
+        def messages(thread):
+            return None if thread is None else [(m["id"], m["type"], m["content"]) for m in thread["messages"]]
+
+        operations = {
+            "create": thread_service.create_thread,
+            "save": thread_service.save_message,
+            "get": lambda thread_id: messages(thread_service.get_thread(thread_id)),
+            "prepared": lambda thread_id: [m.content for m in thread_service.get_prepared_history(thread_id).messages],
+            "database": lambda thread_id: messages(thread_service.db.load_thread(thread_id)),
+            "exists": thread_service.thread_exists,
+            "delete": thread_service.delete_thread,
+        }
+        while True:
+            request = conn.recv()
+            if request is None:
+                return
+            operation, args = request
+            try:
+                conn.send(("ok", operations[operation](*args)))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class Worker:
+    """worker 进程的句柄"""
+
+    def __init__(self, name: str, db_path: str):
+        self.name = name
+        context = multiprocessing.get_context("spawn")
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=worker, args=(db_path, child), daemon=True)
+        self.process.start()
+
+    def __call__(self, operation: str, *args):
+        self.conn.send((operation, args))
+        status, result = self.conn.recv()
+        if status == "error":
+            raise RuntimeError(f"worker {self.name} 执行 {operation} 失败: {result}")
+        return result
+
+    def close(self) -> None:
+        self.conn.send(None)
+        self.process.join(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线程缓存多进程读写一致性检查")
+    parser.add_argument("--rounds", type=int, default=20, help="检查轮数")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "thread_cache_coherence_check.sqlite")
+    a, b = Worker("A", db_path), Worker("B", db_path)
+    failures = []
+
+    def check(name: str, ok: bool) -> None:
+        if not ok:
+            failures.append(name)
+            print(f"❌ {name}")
+
+    thread_id = "coherence-thread"
+    a("create", thread_id)
+    first = str(uuid.uuid4())
+    a("save", thread_id, first, "human", "第一条消息")
+    check("B 读到 A 创建的线程", b("get", thread_id) == a("database", thread_id))
+
+    for round_index in range(args.rounds):
+        # 1. A 追加，B 立即读取（B 的缓存已预热）
+        b("get", thread_id)
+        a("save", thread_id, str(uuid.uuid4()), "ai", f"第 {round_index} 轮 A 的回复")
+        truth = a("database", thread_id)
+        check(f"第 {round_index} 轮: B 读到 A 追加的消息", b("get", thread_id) == truth)
+
+        # 2. A 编辑一条已有消息，B 读到修改后的内容（包括派生视图）
+        b("prepared", thread_id)
+        edited = f"第一条消息（第 {round_index} 轮修改）"
+        a("save", thread_id, first, "human", edited)
+        truth = a("database", thread_id)
+        seen = b("get", thread_id)
+        check(f"第 {round_index} 轮: B 读到 A 编辑后的消息", seen == truth and (first, "human", edited) in seen)
+        check(f"第 {round_index} 轮: B 的派生视图包含编辑", b("prepared", thread_id) == [m[2] for m in truth])
+
+        # 3. 交替写入：B 追加后 A 追加（A 的缓存版本落后），两边都与数据库一致
+        a("get", thread_id)
+        b("save", thread_id, str(uuid.uuid4()), "human", f"第 {round_index} 轮 B 的提问")
+        a("save", thread_id, str(uuid.uuid4()), "ai", f"第 {round_index} 轮 A 的回答")
+        truth = a("database", thread_id)
+        check(f"第 {round_index} 轮: 交替写入后 A 与数据库一致", a("get", thread_id) == truth)
+        check(f"第 {round_index} 轮: 交替写入后 B 与数据库一致", b("get", thread_id) == truth)
+        check(f"第 {round_index} 轮: 交替写入后 A 的派生视图一致", a("prepared", thread_id) == [m[2] for m in truth])
+
+    # 4. A 删除线程，B 读不到
+    b("get", thread_id)
+    a("delete", thread_id)
+    check("A 删除后 B 读不到线程", b("get", thread_id) is None and not b("exists", thread_id))
+
+    a.close()
+    b.close()
+    checks = 1 + args.rounds * 6 + 1
+    print(f"{'✅' if not failures else '❌'} {checks - len(failures)}/{checks} 项检查通过"
+          f"（{args.rounds} 轮，最终 {len(truth)} 条消息）")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
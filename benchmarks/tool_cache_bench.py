@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+工具结果缓存测试
+
+假模型在第一步对同一个订单发起多个相同的查询（参数写法不同：带 # 和空格），之后给出回答；
+同一个图连续运行多次（模拟多轮对话和多个用户查询同一订单）。
+对比不带缓存和带缓存（cached_tool）的查询工具：实际访问后端的次数、每次运行的工具耗时、
+tool_end 事件中的 cached 标记，以及声明了 no_cache 的工具是否每次都执行。
+
+用法:
+    python benchmarks/tool_cache_bench.py
+    python benchmarks/tool_cache_bench.py --runs 10 --parallel 8 --backend-seconds 0.3
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from typing import AsyncIterator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure() -> None:
+    """在导入应用之前通过环境变量选择假模型"""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["LLM_HEALTH_CHECK_INTERVAL"] = "0"
+    os.environ["SQLITE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "tool_cache_bench.sqlite")
+
+
+def make_tools(args, backend_calls: dict, cached: bool):
+    """模拟访问后端的订单查询（同步，阻塞 I/O）和取当前时间的工具"""
+    from langchain_core.tools import tool
+    from backend.utils.tool_cache import cached_tool, no_cache
+
+    @tool
+    def query_order_status(order_id: str) -> str:
+        """查询订单状态"""
+        backend_calls["query_order_status"] += 1
+        time.sleep(args.backend_seconds)
+        return f"订单 {order_id} 已发货"
+
+    @no_cache
+    @tool
+    def get_current_time() -> str:
+        """获取当前时间"""
+        backend_calls["get_current_time"] += 1
+        return time.strftime("%H:%M:%S")
+
+    if cached:
+        query_order_status = cached_tool(
+            query_order_status, ttl=args.ttl,
+            normalize=lambda tool_args: {**tool_args, "order_id": tool_args["order_id"].strip().lstrip("#")},
+        )
+    return [query_order_status, get_current_time]
+
+
+def make_model(args):
+    """第一步对同一订单并发查询 parallel 次（写法不同）并取一次时间，之后流式回答"""
+    from langchain_core.messages import AIMessageChunk, HumanMessage
+    from langchain_core.outputs import ChatGenerationChunk
+    from backend.providers import FakeChatModel
+
+    spellings = ["12345", "#12345", " 12345 ", "#12345 "]
+
+    class ToolCallingFakeModel(FakeChatModel):
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+            if isinstance(messages[-1], HumanMessage):
+                chunks = [
+                    {"name": "query_order_status", "args": f'{{"order_id": "{spellings[i % len(spellings)]}"}}',
+                     "id": f"call_order_{i}", "index": i}
+                    for i in range(args.parallel)
+                ]
+                chunks.append({"name": "get_current_time", "args": "{}", "id": "call_time", "index": args.parallel})
+                yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=chunks))
+                return
+            async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+                yield chunk
+
+    return ToolCallingFakeModel(ttft_ms=5, tokens_per_second=1000, length_distribution="fixed", length_mean=5)
+
+
+async def run_once(graph, thread_id: str) -> dict:
+    """运行一次，记录工具阶段耗时和 tool_end 事件的 cached 标记"""
+    from backend.utils.streaming import astream_filtered
+
+    started = time.perf_counter()
+    last_tool_end, cached, ends = 0.0, 0, 0
+    async for kind, data in astream_filtered(
+        graph, {"messages": [("user", "我的订单 12345 到哪了")]}, {"configurable": {"thread_id": thread_id}}
+    ):
+        if kind == "tool_end":
+            ends += 1
+            cached += bool(data.get("cached"))
+            last_tool_end = (time.perf_counter() - started) * 1000
+    return {"tools_ms": last_tool_end, "cached": cached, "ends": ends}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="工具结果缓存测试")
+    parser.add_argument("--runs", type=int, default=5, help="连续运行次数")
+    parser.add_argument("--parallel", type=int, default=6, help="每次运行中相同查询的调用次数")
+    parser.add_argument("--backend-seconds", type=float, default=0.2, help="每次访问后端的耗时")
+    parser.add_argument("--ttl", type=float, default=60.0, help="缓存有效期（秒）")
+    args = parser.parse_args()
+    configure()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from langgraph.checkpoint.memory import MemorySaver
+        from langgraph.prebuilt import create_react_agent
+        from backend.services.tool_executor import ToolExecutor
+        from backend.utils.tool_cache import tool_cache_stats
+
+    print(f"🧪 每次运行 {args.parallel} 个相同的订单查询 + 1 次取时间, 后端耗时 {args.backend_seconds}s, "
+          f"连续 {args.runs} 次运行, 缓存有效期 {args.ttl:g}s")
+    for label, cached in (("不缓存", False), ("cached_tool", True)):
+        backend_calls = {"query_order_status": 0, "get_current_time": 0}
+        executor = ToolExecutor(max_workers=args.parallel + 1, default_timeout=0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            graph = create_react_agent(
+                make_model(args), executor.tool_node(make_tools(args, backend_calls, cached)),
+                checkpointer=MemorySaver(),
+            )
+            results = [await run_once(graph, f"{label}-{index}") for index in range(args.runs)]
+
+        tools_ms = ", ".join(f"{result['tools_ms']:.0f}" for result in results)
+        cached_ends = sum(result["cached"] for result in results)
+        total_ends = sum(result["ends"] for result in results)
+        print(f"📦 {label}: 订单查询访问后端 {backend_calls['query_order_status']} 次, "
+              f"取时间 {backend_calls['get_current_time']} 次, tool_end 中 cached {cached_ends}/{total_ends}, "
+              f"执行器 cache_hits {executor.stats()['cache_hits']}")
+        print(f"   每次运行的工具阶段耗时(ms): {tools_ms}")
+    print(f"📊 缓存统计: {tool_cache_stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
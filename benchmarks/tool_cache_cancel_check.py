@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+工具缓存取消检查
+
+带缓存的异步工具执行需要 slow 秒，工具执行器的超时为 timeout 秒（timeout < slow）：
+- 运行 1 发起调用，超时后收到超时结果（调用被取消）
+- 运行 2 在 delay 秒后开始，合并到运行 1 进行中的调用；运行 1 被取消不能影响它：
+  它应在自己的超时（delay + timeout）时收到超时结果，而不是在运行 1 超时时随之失败
+- 运行 3 在底层调用完成后开始，直接命中缓存
+
+任一检查不通过时以非零状态退出。
+
+用法:
+    python benchmarks/tool_cache_cancel_check.py
+    python benchmarks/tool_cache_cancel_check.py --timeout 0.5 --slow 1 --delay 0.25
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from typing import AsyncIterator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure() -> None:
+    """在导入应用之前通过环境变量选择假模型"""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["LLM_HEALTH_CHECK_INTERVAL"] = "0"
+    os.environ["SQLITE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "tool_cache_cancel_check.sqlite")
+
+
+def make_graph(args, backend_calls: list):
+    """模型第一步调用慢查询，之后流式回答；工具节点使用限时的工具执行器"""
+    from langchain_core.messages import AIMessageChunk, HumanMessage
+    from langchain_core.outputs import ChatGenerationChunk
+    from langchain_core.tools import tool
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.prebuilt import create_react_agent
+    from backend.providers import FakeChatModel
+    from backend.services.tool_executor import ToolExecutor
+    from backend.utils.tool_cache import cached_tool
+
+    @cached_tool(ttl=60)
+    @tool
+    async def query_order_status(order_id: str) -> str:
+        """查询订单状态（慢）"""
+        backend_calls.append(time.perf_counter())
+        await asyncio.sleep(args.slow)
+        return f"订单 {order_id} 已发货"
+
+    class ToolCallingFakeModel(FakeChatModel):
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+            if isinstance(messages[-1], HumanMessage):
+                yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[{
+                    "name": "query_order_status", "args": '{"order_id": "12345"}', "id": "call_order", "index": 0,
+                }]))
+                return
+            async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+                yield chunk
+
+    model = ToolCallingFakeModel(ttft_ms=1, tokens_per_second=1000, length_distribution="fixed", length_mean=3)
+    executor = ToolExecutor(max_workers=2, default_timeout=args.timeout)
+    return create_react_agent(model, executor.tool_node([query_order_status]), checkpointer=MemorySaver())
+
+
+async def run_at(graph, label: str, delay: float, started: float) -> dict:
+    """delay 秒后开始一次运行，记录 tool_end 的状态、缓存标记和到达时间（相对 started）"""
+    from backend.utils.streaming import astream_filtered
+
+    await asyncio.sleep(delay)
+    result = {"label": label, "error": None, "tool_end": None}
+    try:
+        async for kind, data in astream_filtered(
+            graph, {"messages": [("user", "订单 12345")]}, {"configurable": {"thread_id": label}}
+        ):
+            if kind == "tool_end":
+                result["tool_end"] = {
+                    "at": time.perf_counter() - started,
+                    "status": data.get("status"),
+                    "cached": bool(data.get("cached")),
+                }
+    except BaseException as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="工具缓存取消检查")
+    parser.add_argument("--timeout", type=float, default=1.0, help="工具执行器的超时")
+    parser.add_argument("--slow", type=float, default=2.0, help="底层调用耗时（应大于超时）")
+    parser.add_argument("--delay", type=float, default=0.5, help="运行 2 的开始时间（应小于超时）")
+    args = parser.parse_args()
+    configure()
+
+    backend_calls: list = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        graph = make_graph(args, backend_calls)
+        started = time.perf_counter()
+        first, second = await asyncio.gather(
+            run_at(graph, "run-1", 0, started),
+            run_at(graph, "run-2", args.delay, started),
+        )
+        # 等底层调用完成后再查一次
+        third = await run_at(graph, "run-3", max(0.0, args.slow + 0.1 - (time.perf_counter() - started)), started)
+
+    slack = 0.3
+    checks = [
+        ("运行 1 收到超时结果", first["error"] is None and first["tool_end"] and first["tool_end"]["status"] == "error"),
+        ("运行 2 没有随运行 1 失败", second["error"] is None and second["tool_end"] is not None),
+        ("运行 2 按自己的超时结束",
+         second["tool_end"] is not None and second["tool_end"]["at"] >= args.delay + args.timeout - 0.05),
+        ("运行 2 是合并的调用", second["tool_end"] is not None and second["tool_end"]["cached"]),
+        ("底层调用被取消后仍然完成并写入缓存",
+         third["error"] is None and third["tool_end"] and third["tool_end"]["status"] == "success"
+         and third["tool_end"]["cached"] and third["tool_end"]["at"] < args.slow + 0.1 + slack),
+        ("后端只调用一次", len(backend_calls) == 1),
+    ]
+    for result in (first, second, third):
+        print(f"📦 {result['label']}: tool_end={result['tool_end']}, error={result['error']}")
+    failed = 0
+    for name, ok in checks:
+        failed += not ok
+        print(f"{'✅' if ok else '❌'} {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+工具执行器测试
+
+假模型在第一步同时发起多个工具调用（同步慢查询、异步慢查询、一个会卡住的同步查询），之后给出回答。
+对比改造前的 ReAct Agent（默认 ToolNode）与使用 ToolExecutor 的工具节点：
+每个 tool_end 事件到达的时间、首个回答 token 的时间和总耗时，以及卡住的工具是否被超时截断。
+
+用法:
+    python benchmarks/tool_executor_bench.py
+    python benchmarks/tool_executor_bench.py --hang-seconds 10 --timeout 2 --parallel 6
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from typing import AsyncIterator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure() -> None:
+    """在导入应用之前通过环境变量选择假模型"""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["LLM_HEALTH_CHECK_INTERVAL"] = "0"
+    os.environ["SQLITE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "tool_executor_bench.sqlite")
+
+
+def make_tools(args):
+    """模拟慢 I/O 查询的工具"""
+    from langchain_core.tools import tool
+
+    @tool
+    def lookup_sync(key: str) -> str:
+        """同步查询（阻塞 I/O）"""
+        time.sleep(args.sync_seconds)
+        return f"sync:{key}"
+
+    @tool
+    async def lookup_async(key: str) -> str:
+        """异步查询"""
+        await asyncio.sleep(args.async_seconds)
+        return f"async:{key}"
+
+    @tool
+    def lookup_hung(key: str) -> str:
+        """偶尔卡住的同步查询"""
+        time.sleep(args.hang_seconds)
+        return f"hung:{key}"
+
+    return [lookup_sync, lookup_async, lookup_hung]
+
+
+def make_model(args):
+    """第一步并发调用所有工具（每个同步/异步工具各 parallel 次），之后流式回答"""
+    from langchain_core.messages import AIMessageChunk, HumanMessage
+    from langchain_core.outputs import ChatGenerationChunk
+    from backend.providers import FakeChatModel
+
+    class ToolCallingFakeModel(FakeChatModel):
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+            if isinstance(messages[-1], HumanMessage):
+                calls = [("lookup_hung", 0)] + [
+                    (name, i) for i in range(args.parallel) for name in ("lookup_sync", "lookup_async")
+                ]
+                yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                    {"name": name, "args": f'{{"key": "{name}-{i}"}}', "id": f"call_{name}_{i}", "index": index}
+                    for index, (name, i) in enumerate(calls)
+                ]))
+                return
+            async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+                yield chunk
+
+    return ToolCallingFakeModel(ttft_ms=20, tokens_per_second=500, length_distribution="fixed", length_mean=10)
+
+
+async def run_once(graph, label: str) -> dict:
+    """运行一次，记录每个工具事件和首个 token 的到达时间"""
+    from backend.utils.streaming import astream_filtered
+
+    started = time.perf_counter()
+    tool_ends, first_token = [], None
+    async for kind, data in astream_filtered(
+        graph, {"messages": [("user", "查一下")]}, {"configurable": {"thread_id": label}}
+    ):
+        elapsed = (time.perf_counter() - started) * 1000
+        if kind == "tool_end":
+            tool_ends.append((elapsed, data["tool"], data.get("status", "success")))
+        elif kind == "token" and first_token is None:
+            first_token = elapsed
+    return {"tool_ends": tool_ends, "first_token": first_token, "total": (time.perf_counter() - started) * 1000}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="工具执行器测试")
+    parser.add_argument("--parallel", type=int, default=4, help="每种慢查询的调用次数")
+    parser.add_argument("--sync-seconds", type=float, default=0.5)
+    parser.add_argument("--async-seconds", type=float, default=0.3)
+    parser.add_argument("--hang-seconds", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=1.0, help="执行器的单个调用超时")
+    parser.add_argument("--workers", type=int, default=8, help="执行器的同步工具线程池大小")
+    args = parser.parse_args()
+    configure()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from langgraph.checkpoint.memory import MemorySaver
+        from langgraph.prebuilt import create_react_agent
+        from backend.services.tool_executor import ToolExecutor
+
+        tools = make_tools(args)
+        executor = ToolExecutor(max_workers=args.workers, default_timeout=args.timeout)
+        graphs = {
+            "默认 ToolNode": create_react_agent(make_model(args), tools, checkpointer=MemorySaver()),
+            "ToolExecutor": create_react_agent(make_model(args), executor.tool_node(tools), checkpointer=MemorySaver()),
+        }
+
+    print(f"🧪 一步 {args.parallel * 2 + 1} 个工具调用: 同步 {args.sync_seconds}s ×{args.parallel}, "
+          f"异步 {args.async_seconds}s ×{args.parallel}, 卡住 {args.hang_seconds}s ×1; "
+          f"执行器超时 {args.timeout}s, 线程池 {args.workers}")
+    for label, graph in graphs.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = await run_once(graph, label)
+        ends = result["tool_ends"]
+        arrivals = ", ".join(f"{tool.removeprefix('lookup_')}@{elapsed:.0f}" for elapsed, tool, _ in ends)
+        errors = sum(status == "error" for _, _, status in ends)
+        print(f"📦 {label}: 首个 tool_end {ends[0][0]:.0f}ms, 最后 {ends[-1][0]:.0f}ms, 首个 token "
+              f"{result['first_token']:.0f}ms, 总耗时 {result['total']:.0f}ms, 超时 {errors} 个")
+        print(f"   tool_end 到达顺序(ms): {arrivals}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
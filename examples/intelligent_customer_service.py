@@ -1,23 +1,38 @@
 """
 智能客服系统示例
 展示 LangChain 和 LangGraph 的完整配合
+
+create_graph(llm, checkpointer, tool_node) 可以被 backend 的图注册表按需编译（助手 customer_service），
+模型、检查点和工具节点（工具执行器：并发、限时、tool_start/tool_end 事件）由注册表传入；
+直接运行本文件时使用 DeepSeek 模型、默认的 ToolNode 和内存中的 SQLite 检查点。
 """
+import asyncio
+import os
+import sqlite3
+import sys
 from typing import TypedDict, Annotated, Literal
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.constants import TAG_NOSTREAM
+from langgraph.prebuilt import ToolNode, create_react_agent
 from langchain.chat_models import init_chat_model
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.tools import tool
 from langchain_core.messages import HumanMessage, AIMessage
 
+# 直接运行本文件时也能导入 backend.utils（只依赖 langchain，不会初始化 backend 的配置和服务）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.utils.checkpoint import AsyncSqliteCheckpointer
+from backend.utils.tool_cache import cached_tool, no_cache
+
 
 # ============ LangChain 组件层 ============
 
-# 1. LLM 模型
-llm = init_chat_model("deepseek:deepseek-chat", temperature=0.7)
+# 1. LLM 模型（在 create_graph 中传入，默认使用 DeepSeek）
 
 # 2. 工具定义
+# 查询类工具的结果缓存一段时间，同一订单/产品的重复查询不再访问后端（订单状态变化快，有效期更短）
+@cached_tool(ttl=60, normalize=lambda args: {**args, "order_id": args["order_id"].strip().lstrip("#")})
 @tool
 def query_order_status(order_id: str) -> str:
     """查询订单状态"""
@@ -29,6 +44,7 @@ def query_order_status(order_id: str) -> str:
     return orders.get(order_id, "订单不存在")
 
 
+@cached_tool(ttl=600)
 @tool
 def query_product_info(product_name: str) -> str:
     """查询产品信息"""
@@ -39,6 +55,8 @@ def query_product_info(product_name: str) -> str:
     return products.get(product_name, "产品不存在")
 
 
+# 有副作用，每次调用都要执行
+@no_cache
 @tool
 def create_ticket(issue: str) -> str:
     """创建工单"""
@@ -88,93 +106,12 @@ class CustomerServiceState(TypedDict):
     needs_human: bool
 
 
-# 创建工作流
-workflow = StateGraph(CustomerServiceState)
-
-
-# 节点 1: 分类器（使用 LangChain LLM）
-def classify_question(state: CustomerServiceState):
-    """分类用户问题"""
-    question = state["question"]
-    
-    # 使用 LangChain 的 LCEL
-    chain = classifier_prompt | llm
-    response = chain.invoke({"question": question})
-    
-    category = response.content.strip().lower()
-    print(f"📋 问题分类: {category}")
-    
-    return {"category": category}
-
-
-# 节点 2: 订单处理 Agent（使用 LangChain Tools）
-def order_agent(state: CustomerServiceState):
-    """处理订单问题"""
-    from langgraph.prebuilt import create_react_agent
-    
-    # 创建专门的订单 Agent
-    agent = create_react_agent(
-        model=llm,
-        tools=[query_order_status],
-        state_modifier=order_agent_prompt.format(question=state["question"])
-    )
-    
-    result = agent.invoke({"messages": [HumanMessage(content=state["question"])]})
-    answer = result["messages"][-1].content
-    
-    print(f"📦 订单 Agent 回复: {answer[:50]}...")
-    return {"answer": answer}
-
-
-# 节点 3: 产品咨询 Agent
-def product_agent(state: CustomerServiceState):
-    """处理产品咨询"""
-    from langgraph.prebuilt import create_react_agent
-    
-    agent = create_react_agent(
-        model=llm,
-        tools=[query_product_info],
-        state_modifier=product_agent_prompt.format(question=state["question"])
-    )
-    
-    result = agent.invoke({"messages": [HumanMessage(content=state["question"])]})
-    answer = result["messages"][-1].content
-    
-    print(f"🛍️ 产品 Agent 回复: {answer[:50]}...")
-    return {"answer": answer}
-
-
-# 节点 4: 投诉处理 Agent
-def complaint_agent(state: CustomerServiceState):
-    """处理投诉"""
-    from langgraph.prebuilt import create_react_agent
-    
-    agent = create_react_agent(
-        model=llm,
-        tools=[create_ticket],
-        state_modifier=complaint_agent_prompt.format(question=state["question"])
-    )
-    
-    result = agent.invoke({"messages": [HumanMessage(content=state["question"])]})
-    answer = result["messages"][-1].content
-    
-    print(f"📝 投诉 Agent 回复: {answer[:50]}...")
-    return {"answer": answer}
-
-
-# 节点 5: 通用客服
-def general_agent(state: CustomerServiceState):
-    """处理一般咨询"""
-    chain = ChatPromptTemplate.from_messages([
-        ("system", "你是友好的客服助手，回答用户的一般问题"),
-        ("human", "{question}")
-    ]) | llm
-    
-    response = chain.invoke({"question": state["question"]})
-    answer = response.content
-    
-    print(f"💬 通用 Agent 回复: {answer[:50]}...")
-    return {"answer": answer}
+def last_question(state: CustomerServiceState) -> str:
+    """本轮的问题：最后一条用户消息（通过对话接口调用时只传入消息），没有时使用 question"""
+    for message in reversed(state["messages"]):
+        if isinstance(message, HumanMessage):
+            return message.content
+    return state.get("question", "")
 
 
 # 路由函数
@@ -192,44 +129,109 @@ def route_to_agent(state: CustomerServiceState) -> Literal["order", "product", "
         return "general"
 
 
-# ============ 构建工作流 ============
-
-# 添加节点
-workflow.add_node("classify", classify_question)
-workflow.add_node("order", order_agent)
-workflow.add_node("product", product_agent)
-workflow.add_node("complaint", complaint_agent)
-workflow.add_node("general", general_agent)
-
-# 定义流程
-workflow.add_edge(START, "classify")
-
-# 条件路由
-workflow.add_conditional_edges(
-    "classify",
-    route_to_agent,
-    {
-        "order": "order",
-        "product": "product",
-        "complaint": "complaint",
-        "general": "general"
-    }
-)
+# 创建工作流
+def create_graph(llm=None, checkpointer=None, tool_node=ToolNode):
+    """
+    创建客服工作流
+
+    Args:
+        llm: 聊天模型，为 None 时使用 DeepSeek
+        checkpointer: 检查点存储
+        tool_node: 工具列表 -> 工具节点，默认 ToolNode
+
+    Returns:
+        编译好的图
+    """
+    if llm is None:
+        llm = init_chat_model("deepseek:deepseek-chat", temperature=0.7)
+    # 分类结果只用于路由，不作为回复流式输出
+    classifier_llm = llm.with_config(tags=[TAG_NOSTREAM])
+
+    workflow = StateGraph(CustomerServiceState)
+
+    # 节点 1: 分类器（使用 LangChain LLM）
+    def classify_question(state: CustomerServiceState):
+        """分类用户问题"""
+        question = last_question(state)
+        
+        # 使用 LangChain 的 LCEL
+        chain = classifier_prompt | classifier_llm
+        response = chain.invoke({"question": question})
+        
+        category = response.content.strip().lower()
+        print(f"📋 问题分类: {category}")
+        
+        return {"question": question, "category": category}
+
+    # 节点 2-4: 使用工具的专门 Agent（订单、产品、投诉）
+    def make_tool_agent(tools, prompt, label):
+        """创建使用 LangChain Tools 的 Agent 节点"""
+        async def agent_node(state: CustomerServiceState):
+            agent = create_react_agent(
+                model=llm,
+                tools=tool_node(tools),
+                prompt=prompt.format(question=state["question"])
+            )
+            
+            # 作为子图运行，工具事件（含缓存命中标记）随父图的流输出（需要 subgraphs=True）
+            result = await agent.ainvoke({"messages": [HumanMessage(content=state["question"])]})
+            # 回复消息保留原ID，流式输出过的分块不会再作为完整消息重复输出
+            reply = result["messages"][-1]
+            
+            print(f"{label} 回复: {reply.content[:50]}...")
+            return {"answer": reply.content, "messages": [reply]}
+        return agent_node
+
+    # 节点 5: 通用客服
+    def general_agent(state: CustomerServiceState):
+        """处理一般咨询"""
+        chain = ChatPromptTemplate.from_messages([
+            ("system", "你是友好的客服助手，回答用户的一般问题"),
+            ("human", "{question}")
+        ]) | llm
+        
+        response = chain.invoke({"question": state["question"]})
+        
+        print(f"💬 通用 Agent 回复: {response.content[:50]}...")
+        return {"answer": response.content, "messages": [response]}
+
+    # ============ 构建工作流 ============
+
+    # 添加节点
+    workflow.add_node("classify", classify_question)
+    workflow.add_node("order", make_tool_agent([query_order_status], order_agent_prompt, "📦 订单 Agent"))
+    workflow.add_node("product", make_tool_agent([query_product_info], product_agent_prompt, "🛍️ 产品 Agent"))
+    workflow.add_node("complaint", make_tool_agent([create_ticket], complaint_agent_prompt, "📝 投诉 Agent"))
+    workflow.add_node("general", general_agent)
+
+    # 定义流程
+    workflow.add_edge(START, "classify")
+
+    # 条件路由
+    workflow.add_conditional_edges(
+        "classify",
+        route_to_agent,
+        {
+            "order": "order",
+            "product": "product",
+            "complaint": "complaint",
+            "general": "general"
+        }
+    )
 
-# 所有 Agent 都到结束
-workflow.add_edge("order", END)
-workflow.add_edge("product", END)
-workflow.add_edge("complaint", END)
-workflow.add_edge("general", END)
+    # 所有 Agent 都到结束
+    workflow.add_edge("order", END)
+    workflow.add_edge("product", END)
+    workflow.add_edge("complaint", END)
+    workflow.add_edge("general", END)
 
-# 编译（添加持久化）
-checkpointer = SqliteSaver.from_conn_string(":memory:")
-customer_service_app = workflow.compile(checkpointer=checkpointer)
+    # 编译（添加持久化）
+    return workflow.compile(checkpointer=checkpointer)
 
 
 # ============ 使用示例 ============
 
-def chat(question: str, thread_id: str = "user-001"):
+def chat(app, question: str, thread_id: str = "user-001"):
     """与客服系统对话"""
     print(f"\n{'='*60}")
     print(f"👤 用户: {question}")
@@ -237,16 +239,16 @@ def chat(question: str, thread_id: str = "user-001"):
     
     config = {"configurable": {"thread_id": thread_id}}
     
-    result = customer_service_app.invoke(
+    result = asyncio.run(app.ainvoke(
         {
             "question": question,
-            "messages": [],
+            "messages": [HumanMessage(content=question)],
             "category": "",
             "answer": "",
             "needs_human": False
         },
         config=config
-    )
+    ))
     
     print(f"\n🤖 客服: {result['answer']}")
     print(f"{'='*60}\n")
@@ -255,19 +257,23 @@ def chat(question: str, thread_id: str = "user-001"):
 
 
 if __name__ == "__main__":
+    customer_service_app = create_graph(
+        checkpointer=AsyncSqliteCheckpointer(sqlite3.connect(":memory:", check_same_thread=False))
+    )
+
     # 测试不同类型的问题
     
     # 1. 订单查询
-    chat("我的订单 12345 到哪了？")
+    chat(customer_service_app, "我的订单 12345 到哪了？")
     
     # 2. 产品咨询
-    chat("你们的手机怎么样？")
+    chat(customer_service_app, "你们的手机怎么样？")
     
     # 3. 投诉
-    chat("我收到的商品有质量问题，要求退款！")
+    chat(customer_service_app, "我收到的商品有质量问题，要求退款！")
     
     # 4. 一般咨询
-    chat("你们的营业时间是？")
+    chat(customer_service_app, "你们的营业时间是？")
     
     # 可视化工作流
     try:
@@ -275,4 +281,3 @@ if __name__ == "__main__":
         display(Image(customer_service_app.get_graph().draw_mermaid_png()))
     except:
         print("提示：在 Jupyter 环境中可以可视化工作流")
-
@@ -3,14 +3,22 @@ LangGraph 图定义 - 用于 langgraph_api
 这个文件不使用相对导入，可以被 langgraph_api 直接加载
 """
 import os
+import sys
 import sqlite3
-from typing import Annotated
+from typing import Annotated, Optional
 from typing_extensions import TypedDict
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, START, END, add_messages
-from langgraph.checkpoint.sqlite import SqliteSaver  # 使用 SQLite 持久化
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langchain_openai import ChatOpenAI
 
+# 确保项目根目录在导入路径中（langgraph_api 按文件路径加载本模块）
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from backend.utils.context import ContextAssembler  # 轻量模块，不会触发 backend 的配置和服务初始化
+from backend.providers import FakeChatModel  # 同上，压测用的假模型
+from backend.utils.checkpoint import AsyncSqliteCheckpointer  # 同上，使用 SQLite 持久化
+
 
 # 定义状态
 class State(TypedDict):
@@ -28,6 +36,12 @@ def get_llm():
     max_tokens = int(os.getenv("DEEPSEEK_MAX_TOKENS", "8000"))
     temperature = float(os.getenv("DEEPSEEK_TEMPERATURE", "0.7"))
 
+    # 压测时使用确定性假模型（与 backend 的 LLM_PROVIDER=fake 使用相同的 FAKE_LLM_* 配置）
+    if os.getenv("LLM_PROVIDER") == "fake":
+        llm = FakeChatModel.from_env(max_tokens=max_tokens)
+        print("✅ 已初始化假模型（LLM_PROVIDER=fake）")
+        return llm
+
     if not deepseek_api_key:
         raise ValueError("DEEPSEEK_API_KEY 环境变量未设置")
 
@@ -46,13 +60,34 @@ def get_llm():
     return llm
 
 
-# 创建 LLM 实例
-llm = get_llm()
+# 共享的 LLM 实例（首次使用时创建，导入本模块不会初始化模型）
+_shared_llm = None
+
+
+def get_shared_llm():
+    """获取本模块共享的 LLM 实例（首次调用时创建）"""
+    global _shared_llm
+    if _shared_llm is None:
+        _shared_llm = get_llm()
+    return _shared_llm
+
+# 上下文组装器：预算 = 上下文窗口 - max_tokens - 预留
+context_assembler = ContextAssembler.from_env(max_tokens=int(os.getenv("DEEPSEEK_MAX_TOKENS", "8000")))
 
 
 # 定义聊天节点
-def chatbot(state: State) -> State:
-    """聊天节点"""
+async def chatbot(state: State, config: RunnableConfig, llm) -> State:
+    """
+    聊天节点（异步）
+
+    使用 astream 调用模型，等待上游时不占用线程；token 通过回调进入图的 messages 流式模式，
+    调用方用 graph.astream(..., stream_mode="messages") 逐个接收，节点本身不再打印分块。
+
+    Args:
+        state: 当前状态
+        config: 运行配置
+        llm: 聊天模型
+    """
     total_messages = len(state['messages'])
     print(f"🤖 Chatbot node called with {total_messages} messages")
 
@@ -70,47 +105,42 @@ def chatbot(state: State) -> State:
             content_preview = str(last_msg.content)[:100]
         print(f"👤 用户消息: {content_preview}...")
 
-    # 🚀 性能优化：只保留最近的 N 条消息，避免上下文过长
-    MAX_HISTORY_MESSAGES = 10  # 最多保留 10 条消息（5 轮对话）
-
-    messages_to_send = state["messages"]
-    if len(messages_to_send) > MAX_HISTORY_MESSAGES:
-        # 保留最近的 N 条消息
-        messages_to_send = messages_to_send[-MAX_HISTORY_MESSAGES:]
-        print(f"⚡ 性能优化: 限制上下文为最近 {MAX_HISTORY_MESSAGES} 条消息（总共 {total_messages} 条）")
-
-    # 使用流式调用 LLM，实时输出
-    print(f"🔄 开始流式调用 LLM（发送 {len(messages_to_send)} 条消息）...")
-    full_content = ""
-
-    for chunk in llm.stream(messages_to_send):
-        if chunk.content:
-            full_content += chunk.content
-            # 实时打印每个块（只打印新增内容）
-            print(chunk.content, end='', flush=True)
+    # 🚀 性能优化：按 token 预算组装上下文（保留系统消息，从最新消息往前填充）
+    messages_to_send, prompt_tokens = context_assembler.assemble(state["messages"])
 
-    print()  # 换行
-    print(f"✅ 流式输出完成，总长度: {len(full_content)} 字符")
+    # 流式调用 LLM：传入 config 让分块回调关联到本次运行（messages 流式模式依赖这些回调）
+    print(f"🔄 开始流式调用 LLM（发送 {len(messages_to_send)} 条消息, {prompt_tokens} tokens）...")
+    response = None
+    async for chunk in llm.astream(messages_to_send, config):
+        response = chunk if response is None else response + chunk
 
-    # 创建完整的响应消息
-    from langchain_core.messages import AIMessage
-    response = AIMessage(content=full_content)
-
-    # 打印 AI 回复预览
-    reply_preview = full_content[:200] if len(full_content) > 200 else full_content
-    print(f"🤖 AI 回复预览: {reply_preview}...")
+    # 合并后的分块保留消息ID和用量，写入状态时转换为完整的 AIMessage
+    if response is None:
+        response = AIMessage(content="")
+    print(f"✅ 流式输出完成，总长度: {len(response.content)} 字符")
 
     # 返回新状态
     return {"messages": [response]}
 
 
 # 创建图
-def create_graph():
-    """创建 LangGraph（使用 SQLite 持久化）"""
+def create_graph(checkpointer: Optional[BaseCheckpointSaver] = None, llm=None):
+    """
+    创建 LangGraph（默认使用 SQLite 持久化）
+
+    Args:
+        checkpointer: 检查点存储，为 None 时使用 SQLITE_DB_PATH 指定的 SQLite 数据库
+        llm: 聊天模型，为 None 时使用本模块共享的实例（图注册表会传入 backend 共享的模型）
+    """
+    model = llm if llm is not None else get_shared_llm()
+
+    async def chatbot_node(state: State, config: RunnableConfig) -> State:
+        return await chatbot(state, config, model)
+
     workflow = StateGraph(State)
 
     # 添加聊天节点
-    workflow.add_node("chatbot", chatbot)
+    workflow.add_node("chatbot", chatbot_node)
 
     # 设置入口点
     workflow.set_entry_point("chatbot")
@@ -118,11 +148,16 @@ def create_graph():
     # 添加结束边
     workflow.add_edge("chatbot", END)
 
+    if checkpointer is not None:
+        compiled_graph = workflow.compile(checkpointer=checkpointer)
+        print("✅ LangGraph 创建完成")
+        return compiled_graph
+
     # 🗄️ 使用 SQLite 持久化存储
     db_path = os.getenv("SQLITE_DB_PATH", "checkpoints.sqlite")
     # check_same_thread=False 允许多线程访问（SqliteSaver 内部有锁保证线程安全）
     conn = sqlite3.connect(db_path, check_same_thread=False)
-    memory = SqliteSaver(conn)
+    memory = AsyncSqliteCheckpointer(conn)
 
     # 编译图（使用 SQLite checkpointer）
     compiled_graph = workflow.compile(checkpointer=memory)
@@ -134,6 +169,18 @@ def create_graph():
     return compiled_graph
 
 
-# 创建图实例（供 langgraph_api 使用）
-graph = create_graph()
+# 图实例（供 langgraph_api 使用）在首次访问 graph 时创建
+_graph = None
+
+
+def __getattr__(name: str):
+    """模块属性 llm 和 graph 按需创建，导入本模块时不初始化模型和数据库"""
+    global _graph
+    if name == "llm":
+        return get_shared_llm()
+    if name == "graph":
+        if _graph is None:
+            _graph = create_graph()
+        return _graph
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
@@ -21,12 +21,13 @@ import os
 from dotenv import load_dotenv
 import sqlite3
 from contextlib import contextmanager
+from backend.utils.context import ContextAssembler
 
 # 加载环境变量
 load_dotenv()
 
 # 模型配置
-MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "deepseek")  # openai, deepseek, ollama, mock
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "deepseek")  # openai, deepseek, ollama, fake, mock
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
@@ -80,6 +81,12 @@ def init_model():
                 print(f"⚠️  Ollama 导入失败，将使用模拟模式")
                 llm = None
         
+        elif MODEL_PROVIDER == "fake":
+            # 确定性假模型：有真实的流式节奏，压测不需要调用服务商
+            from backend.providers import FakeChatModel
+            llm = FakeChatModel.from_env()
+            print(f"✅ 已初始化假模型: corpus={llm.corpus}, {llm.tokens_per_second} tokens/s")
+
         else:
             print(f"⚠️  未配置有效的模型提供商，将使用模拟模式")
             print(f"📝 当前配置: MODEL_PROVIDER={MODEL_PROVIDER}")
@@ -96,6 +103,9 @@ def init_model():
 # 初始化模型
 init_model()
 
+# 上下文组装器（按 token 预算截断历史，所有调用模型的路径共用）
+context_assembler = ContextAssembler.from_env()
+
 # SQLite 数据库配置
 DB_PATH = os.getenv("SQLITE_DB_PATH", "chat_history.db")
 
@@ -280,13 +290,11 @@ def chat_node(state: AgentState) -> AgentState:
                 system_msg = SystemMessage(content="你是一个友好、有帮助的AI助手。请用中文回答用户的问题。")
                 chat_messages.append(system_msg)
                 
-                # 添加历史消息（最多保留最近10条）
-                recent_messages = messages[-10:] if len(messages) > 10 else messages
-                for msg in recent_messages:
-                    chat_messages.append(msg)
+                # 添加历史消息（按 token 预算组装，系统消息固定保留）
+                chat_messages, _ = context_assembler.assemble(chat_messages + list(messages))
                 
                 # 调用大模型
-                if MODEL_PROVIDER == "openai" or MODEL_PROVIDER == "deepseek":
+                if MODEL_PROVIDER in ("openai", "deepseek", "fake"):
                     response = llm.invoke(chat_messages)
                     ai_response = response.content
                 elif MODEL_PROVIDER == "ollama":
@@ -487,7 +495,7 @@ async def stream_run(thread_id: str, request: Request):
                 print(f"🤖 使用 {MODEL_PROVIDER} 模型处理流式请求...")
                 
                 # 准备消息
-                if MODEL_PROVIDER == "openai" or MODEL_PROVIDER == "deepseek":
+                if MODEL_PROVIDER in ("openai", "deepseek", "fake"):
                     from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 
                     # 构建完整的对话历史
@@ -504,6 +512,9 @@ async def stream_run(thread_id: str, request: Request):
 
                     print(f"📚 对话历史长度: {len(chat_messages)} 条消息")
 
+                    # 按 token 预算组装上下文
+                    chat_messages, _ = context_assembler.assemble(chat_messages)
+
                     # 🔄 真正的流式输出：边生成边发送
                     ai_response = ""
                     print("🔄 开始流式生成回复...")
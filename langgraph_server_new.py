@@ -19,6 +19,7 @@ from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_openai import ChatOpenAI
+from backend.utils.context import ContextAssembler
 
 # 配置 DeepSeek API
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
@@ -37,6 +38,9 @@ llm = ChatOpenAI(
 
 print("✅ 已初始化 DeepSeek 模型: deepseek-chat")
 
+# 上下文组装器（按 token 预算截断历史）
+context_assembler = ContextAssembler.from_env(max_tokens=1000)
+
 # 定义状态 - 使用标准的LangGraph消息状态
 class AgentState(TypedDict):
     """Agent状态，包含消息列表"""
@@ -60,7 +64,8 @@ def chat_node(state: AgentState) -> Dict[str, Any]:
     
     try:
         # 使用流式调用
-        for chunk in llm.stream(messages):
+        messages_to_send, _ = context_assembler.assemble(messages)
+        for chunk in llm.stream(messages_to_send):
             if hasattr(chunk, 'content') and chunk.content:
                 content = str(chunk.content) if chunk.content else ""
                 ai_response += content
@@ -24,6 +24,8 @@ from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 from typing_extensions import TypedDict
 from pydantic import BaseModel
+from backend.utils.context import ContextAssembler
+from backend.utils.streaming import astream_filtered
 
 # 环境变量
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
@@ -55,13 +57,17 @@ llm = ChatOpenAI(
     streaming=True  # 启用流式处理
 )
 
+# 上下文组装器（按 token 预算截断历史）
+context_assembler = ContextAssembler.from_env()
+
 # 定义聊天机器人节点 - 基于教程的正确方式
 async def chatbot_node(state: State) -> Dict[str, Any]:
     """聊天机器人节点 - 真正的 LangGraph 节点"""
     print(f"🤖 Chatbot node called with {len(state['messages'])} messages")
     
     # 调用 LLM - 这里使用 LangChain 的 ChatOpenAI
-    response = await llm.ainvoke(state["messages"])
+    messages, _ = context_assembler.assemble(state["messages"])
+    response = await llm.ainvoke(messages)
     print(f"🤖 LLM response: {response.content[:100]}...")
     
     # 返回新消息 - LangGraph 会自动合并到状态中
@@ -267,23 +273,12 @@ async def stream_chat_endpoint(request: ChatRequest):
                 # 收集完整响应
                 full_response = ""
 
-                # 使用 astream_events 获取流式事件 - 这是关键！
-                async for event in graph.astream_events(
-                    {"messages": messages},
-                    config,
-                    version="v2"
-                ):
-                    kind = event["event"]
-
-                    # 监听聊天模型的流式输出 - 基于教程
-                    if kind == "on_chat_model_stream":
-                        chunk_data = event["data"]
-                        if "chunk" in chunk_data and hasattr(chunk_data["chunk"], "content"):
-                            chunk_content = chunk_data["chunk"].content
-                            if chunk_content:
-                                full_response += chunk_content
-                                # 发送流式数据
-                                yield f"data: {json.dumps({'type': 'content', 'content': chunk_content})}\n\n"
+                # 只订阅模型输出的 token（stream_mode="messages"），不为每个 runnable 和回调构造事件
+                async for _, chunk in astream_filtered(graph, {"messages": messages}, config, kinds=("tokens",)):
+                    chunk_content = chunk.content
+                    full_response += chunk_content
+                    # 发送流式数据
+                    yield f"data: {json.dumps({'type': 'content', 'content': chunk_content})}\n\n"
 
                 # 添加完整响应到历史
                 if full_response:
@@ -390,22 +385,13 @@ async def runs_stream(request: Request):
             try:
                 print(f"🌊 开始流式处理，线程ID: {thread_id}")
                 # LangGraph SDK 格式的流式响应
-                async for event in graph.astream_events(
-                    {"messages": messages},
-                    config,
-                    version="v2"
-                ):
-                    kind = event["event"]
-                    if kind == "on_chat_model_stream":
-                        chunk_data = event["data"]
-                        if "chunk" in chunk_data and hasattr(chunk_data["chunk"], "content"):
-                            chunk_content = chunk_data["chunk"].content
-                            if chunk_content:
-                                chunk_count += 1
-                                full_response += chunk_content
-                                print(f"📦 收到chunk #{chunk_count}: {chunk_content[:20]}...")
-                                # 使用 LangGraph SDK 兼容的格式
-                                yield f"data: {json.dumps({'event': 'values', 'data': {'messages': [{'type': 'ai', 'content': chunk_content}]}})}\n\n"
+                async for _, chunk in astream_filtered(graph, {"messages": messages}, config, kinds=("tokens",)):
+                    chunk_content = chunk.content
+                    chunk_count += 1
+                    full_response += chunk_content
+                    print(f"📦 收到chunk #{chunk_count}: {chunk_content[:20]}...")
+                    # 使用 LangGraph SDK 兼容的格式
+                    yield f"data: {json.dumps({'event': 'values', 'data': {'messages': [{'type': 'ai', 'content': chunk_content}]}})}\n\n"
 
                 print(f"✅ 流式处理完成，共收到 {chunk_count} 个chunks，总长度: {len(full_response)}")
 
@@ -434,5 +420,5 @@ async def runs_stream(request: Request):
 if __name__ == "__main__":
     print("🚀 Starting LangGraph Chat Server...")
     print("📚 Based on LangGraph tutorials")
-    print("🌊 Real streaming with astream_events")
+    print("🌊 Real streaming with filtered stream modes")
     uvicorn.run(app, host="0.0.0.0", port=2024)